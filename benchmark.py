@@ -0,0 +1,417 @@
+"""
+Benchmark do Simulador Comercial com tabelas sintéticas.
+
+Gera tabelas no formato de tabela_produto.csv e tabela_parceiro.csv (Mac Roman, fim de
+linha CR, ';' e vírgula decimal) e planilhas no layout lido por processar_xlsx, e mede
+leitura, catálogo, busca, filtros, precificação, carrinho e exportação, informando
+tempo, vazão (linhas/s) e pico de memória (tracemalloc) de cada etapa.
+
+Exemplos:
+    python benchmark.py
+    python benchmark.py --linhas 10000 100000 1000000 --carrinhos 10 1000 10000
+    python benchmark.py --saida base.json
+    python benchmark.py --referencia base.json --tolerancia 0.25
+
+Com --referencia, o comando termina com código 1 se alguma etapa ficar mais lenta que a
+referência além da tolerância (para rodar antes de publicar uma versão).
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import nucleo
+
+np = nucleo.np
+pd = nucleo.pd
+
+GRUPOS_SINTETICOS = [
+    'TEMPERO', 'CAFÉ', 'AÇÚCAR', 'FEIJÃO', 'COLORAU', 'PIMENTA', 'BARBECUE',
+    'CANJICA', 'FLOCÃO', 'COMINHO', 'ORÉGANO', 'CALDO'
+]
+SABORES_SINTETICOS = [
+    'TRADICIONAL', 'NORDESTE', 'ARROZ', 'CARNES', 'FRANGO', 'PEIXE', 'LIMÃO',
+    'ALHO', 'CEBOLA', 'PICANTE', 'DEFUMADO', 'COMPLETO'
+]
+MARCAS_SINTETICAS = ['SADIO', 'SABORÁ', 'NORDESTÃO', 'TEMPERÔ']
+PESOS_SINTETICOS = [30, 50, 100, 200, 500, 830, 1000]
+BUSCAS_BENCHMARK = ['tempero', 'cafe 500', 'limao sadio', '789', 'inexistente xyz']
+
+# Função para gerar a tabela de produtos sintética
+def gerar_tabela_produto(linhas, tabelas=40, semente=0):
+    """
+    Gera os bytes de uma tabela_produto.csv com o número de linhas pedido:
+    cada produto aparece em todas as tabelas (CODTAB), com preços que variam por tabela
+    """
+    rng = np.random.default_rng(semente)
+    produtos = -(-linhas // tabelas)
+
+    grupo = rng.choice(GRUPOS_SINTETICOS, produtos)
+    sabor = rng.choice(SABORES_SINTETICOS, produtos)
+    peso = rng.choice(PESOS_SINTETICOS, produtos)
+    marca = rng.choice(MARCAS_SINTETICAS, produtos)
+    descricao = pd.Series(grupo) + ' ' + pd.Series(sabor) + ' ' + pd.Series(peso).astype(str) + 'G ' + pd.Series(marca)
+    quantidade = rng.choice([6, 12, 24, 48], produtos)
+    preco_base = np.round(rng.uniform(0.5, 30.0, produtos), 2)
+
+    # Produto × tabela, cortado no número de linhas pedido
+    posicao_produto = np.repeat(np.arange(produtos), tabelas)[:linhas]
+    codtab = np.tile(np.arange(1, tabelas + 1), produtos)[:linhas]
+    fator_tabela = np.round(rng.uniform(0.85, 1.15, tabelas + 1), 3)
+    preco_unitario = np.round(preco_base[posicao_produto] * fator_tabela[codtab], 2)
+
+    df = pd.DataFrame({
+        'CODPROD': 1000 + posicao_produto,
+        'REFERENCIA': (7897518000000 + posicao_produto).astype(str),
+        'DESCRPROD': descricao.to_numpy()[posicao_produto],
+        'CODTAB': codtab,
+        'PRECO_UNITARIO': preco_unitario,
+        'QUANTIDADE': quantidade[posicao_produto],
+        'PRECO_CX': np.round(preco_unitario * quantidade[posicao_produto], 2)
+    })
+    return df.to_csv(index=False, sep=';', decimal=',', lineterminator='\r').encode('mac_roman')
+
+# Função para gerar a tabela de clientes sintética
+def gerar_tabela_parceiro(linhas, tabelas=40, semente=0):
+    """
+    Gera os bytes de uma tabela_parceiro.csv com o número de linhas pedido
+    """
+    rng = np.random.default_rng(semente)
+    vendedores = np.array([f"VENDEDOR{i:03d}" for i in range(max(1, linhas // 200))])
+    cidades = np.array([f"CIDADE {i:04d}" for i in range(max(1, linhas // 50))])
+    grupos = np.array(['', 'ASSAÍ', 'ATACADÃO', 'SUPERCOP', 'REDE NORDESTE'])
+    posicao_vendedor = rng.integers(0, len(vendedores), linhas)
+
+    df = pd.DataFrame({
+        'ID_CLIENTE': np.arange(1, linhas + 1),
+        'FANTASIA': [f"CLIENTE SINTÉTICO {i}" for i in range(linhas)],
+        'ID_VENDEDOR': posicao_vendedor,
+        'VENDEDOR': vendedores[posicao_vendedor],
+        'CODTAB': rng.integers(1, tabelas + 1, linhas),
+        'CIDADE': rng.choice(cidades, linhas),
+        'GRUPODESC': rng.choice(grupos, linhas)
+    })
+    return df.to_csv(index=False, sep=';', lineterminator='\r').encode('mac_roman')
+
+# Função para gerar uma planilha no layout de processar_xlsx
+def gerar_xlsx(linhas, semente=0):
+    """
+    Gera os bytes de uma planilha com duas linhas de preâmbulo, cabeçalho na linha 3,
+    os produtos e uma linha de rodapé (descartada na leitura)
+    """
+    rng = np.random.default_rng(semente)
+    grupo = rng.choice(GRUPOS_SINTETICOS, linhas).tolist()
+    sabor = rng.choice(SABORES_SINTETICOS, linhas).tolist()
+    marca = rng.choice(MARCAS_SINTETICAS, linhas).tolist()
+    peso = rng.choice(PESOS_SINTETICOS, linhas).tolist()
+    quantidade = rng.choice([6, 12, 24, 48], linhas).tolist()
+    preco_un = np.round(rng.uniform(0.5, 30.0, linhas), 2).tolist()
+
+    workbook = nucleo.openpyxl.Workbook(write_only=True)
+    planilha = workbook.create_sheet()
+    planilha.append(['TABELA DE PREÇOS SINTÉTICA'])
+    planilha.append([])
+    planilha.append(['EAN', 'NCM', 'Cod', 'Descrição', 'QTD', 'X', 'Peso', 'Preco CX', 'Preco UN', 'Grupo', 'Marca'])
+    for i in range(linhas):
+        planilha.append([
+            str(7898950000000 + i), '34029039', 1000 + i,
+            f"{grupo[i]} {sabor[i]} {peso[i]}G {marca[i]} | CX - {quantidade[i]}/{peso[i]}G",
+            quantidade[i], 'X', peso[i], round(preco_un[i] * quantidade[i], 2), preco_un[i], grupo[i], marca[i]
+        ])
+    planilha.append([f"Total de itens: {linhas}"])
+
+    saida = io.BytesIO()
+    workbook.save(saida)
+    return saida.getvalue()
+
+# Função para gerar os itens de um carrinho sintético
+def gerar_itens_carrinho(linhas, semente=0):
+    """
+    Gera itens de produtos distintos (metade em CX, metade em UN), com quantidades e descontos
+    """
+    rng = np.random.default_rng(semente)
+    grupo = rng.choice(GRUPOS_SINTETICOS, linhas)
+    sabor = rng.choice(SABORES_SINTETICOS, linhas)
+    tipos = np.where(np.arange(linhas) % 2 == 0, 'CX', 'UN')
+    return {
+        'codigo': 1000 + np.arange(linhas),
+        'descricao': (pd.Series(grupo) + ' ' + pd.Series(sabor) + ' SADIO').to_numpy(),
+        'tipo': tipos,
+        'quantidade': rng.integers(1, 50, linhas),
+        'preco_base': np.round(rng.uniform(0.5, 300.0, linhas), 2),
+        'desconto_percentual': np.round(rng.uniform(0, 15, linhas), 1),
+        'desconto_reais': np.zeros(linhas),
+        'tipo_desconto': np.full(linhas, '%', dtype=object)
+    }
+
+# Função para medir o tempo e o pico de memória de uma etapa
+def medir(funcao, repeticoes):
+    """
+    Executa a função repeticoes vezes (vale o menor tempo) e mais uma vez sob tracemalloc
+    para o pico de memória. Retorna (tempo em s, pico em bytes, resultado)
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    try:
+        funcao()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(tempos), pico, resultado
+
+# Função para executar o benchmark de um tamanho de tabela
+def benchmark_tabelas(linhas, repeticoes, diretorio):
+    """
+    Mede leitura, cache binário, catálogo, busca, filtros, precificação e cenário
+    sobre tabelas sintéticas com o número de linhas pedido
+    """
+    resultados = []
+
+    # Função para registrar uma etapa medida
+    def registrar(etapa, funcao, quantidade=linhas, vezes=repeticoes):
+        """
+        Mede a etapa e guarda o resultado; retorna o valor produzido pela função
+        """
+        tempo, pico, resultado = medir(funcao, vezes)
+        resultados.append({'etapa': etapa, 'linhas': quantidade, 'tempo_s': tempo, 'pico_bytes': pico})
+        return resultado
+
+    conteudo_produto = gerar_tabela_produto(linhas)
+    caminho_produto = os.path.join(diretorio, 'tabela_produto.csv')
+    with open(caminho_produto, 'wb') as arquivo:
+        arquivo.write(conteudo_produto)
+
+    df_produto = registrar('csv_produto', lambda: nucleo.ler_csv(conteudo_produto, nucleo.detectar_dialeto_csv(conteudo_produto)))
+
+    # Cache binário: gravação (cache apagado a cada repetição) e leitura mapeada em memória
+    diretorio_cache = os.path.join(nucleo.DIRETORIO_CACHE_TABELAS, 'tabela_produto.csv')
+
+    # Função para ler a tabela com o cache sempre frio
+    def ler_cache_frio():
+        """
+        Apaga o cache antes da leitura, forçando a gravação
+        """
+        shutil.rmtree(diretorio_cache, ignore_errors=True)
+        return nucleo.ler_tabela_com_cache(caminho_produto)
+
+    registrar('cache_tabela_frio', ler_cache_frio)
+    registrar('cache_tabela_quente', lambda: nucleo.ler_tabela_com_cache(caminho_produto))
+
+    catalogo = registrar('catalogo', lambda: nucleo.construir_catalogo(df_produto))
+    produtos = len(catalogo['codigos_produto'])
+    codtab = catalogo['codigos_tabela'][0]
+    registrar('precos_tabela', lambda: nucleo.precos_tabela(catalogo, codtab), quantidade=produtos)
+    base = registrar('linhas_catalogo', lambda: nucleo.linhas_catalogo(catalogo))
+
+    # Busca sobre a base longa (todas as tabelas), o maior índice que o aplicativo monta
+    indice = registrar('indice_busca', lambda: nucleo.construir_indice_busca(base), quantidade=len(base), vezes=1)
+    registrar(
+        'busca',
+        lambda: [nucleo.buscar_produtos(indice, busca) for busca in BUSCAS_BENCHMARK],
+        quantidade=len(base) * len(BUSCAS_BENCHMARK)
+    )
+
+    grupo = base['Grupo'].iloc[0]
+    marca = base['Marca'].iloc[0]
+    registrar('filtro_grupo_marca', lambda: base[(base['Grupo'] == grupo) & (base['Marca'] == marca)], quantidade=len(base))
+
+    precos = base['Preco CX'].to_numpy()
+    descontos = np.resize(np.array([0.0, 2.5, 5.0, 7.5, 10.0]), len(precos))
+    registrar(
+        'precificacao_lote',
+        lambda: nucleo.calcular_precos_lote(precos, 1, descontos_percentuais=descontos),
+        quantidade=len(base)
+    )
+    regras = [
+        {'Grupo': [grupo], 'desconto_percentual': 5.0},
+        {'Marca': [marca], 'CODTAB': [codtab], 'desconto_percentual': 8.0}
+    ]
+    registrar('cenario', lambda: nucleo.aplicar_cenario(base, regras), quantidade=len(base))
+
+    conteudo_parceiro = gerar_tabela_parceiro(linhas)
+    registrar(
+        'parceiros',
+        lambda: nucleo.construir_indice_parceiros(
+            nucleo.ler_csv(conteudo_parceiro, nucleo.detectar_dialeto_csv(conteudo_parceiro))
+        )
+    )
+    return resultados
+
+# Função para executar o benchmark de leitura de planilhas
+def benchmark_xlsx(linhas, repeticoes):
+    """
+    Mede load_data sobre uma planilha sintética no layout de processar_xlsx
+    """
+    conteudo = gerar_xlsx(linhas)
+
+    # Função para carregar a planilha a partir dos bytes
+    def carregar():
+        """
+        Lê a planilha como o aplicativo lê um upload
+        """
+        arquivo = io.BytesIO(conteudo)
+        arquivo.name = 'tabela.xlsx'
+        return nucleo.load_data(arquivo, 'xlsx')
+
+    tempo, pico, (df, _) = medir(carregar, repeticoes)
+    if df is None or len(df) != linhas:
+        raise RuntimeError(f"Planilha sintética de {linhas} linhas não foi lida corretamente")
+    return [{'etapa': 'xlsx_load_data', 'linhas': linhas, 'tempo_s': tempo, 'pico_bytes': pico}]
+
+# Função para executar o benchmark do carrinho
+def benchmark_carrinho(linhas, repeticoes):
+    """
+    Mede inclusão (em lote e item a item), paginação e exportações de um carrinho com o número de linhas pedido
+    """
+    itens = gerar_itens_carrinho(linhas)
+    quantidade = linhas
+    resultados = []
+
+    # Função para montar o carrinho em uma única operação
+    def adicionar_lote():
+        """
+        Inclui todos os itens em uma chamada
+        """
+        carrinho = nucleo.criar_carrinho()
+        nucleo.adicionar_itens_carrinho(carrinho, itens)
+        return carrinho
+
+    # Função para montar o carrinho item a item, como na interface
+    def adicionar_unitario():
+        """
+        Inclui os itens um por um
+        """
+        carrinho = nucleo.criar_carrinho()
+        for i in range(quantidade):
+            nucleo.adicionar_item_carrinho(carrinho, {chave: valores[i] for chave, valores in itens.items()})
+        return carrinho
+
+    etapas = [
+        ('carrinho_lote', adicionar_lote),
+        ('carrinho_unitario', adicionar_unitario),
+    ]
+    for etapa, funcao in etapas:
+        tempo, pico, carrinho = medir(funcao, repeticoes)
+        resultados.append({'etapa': etapa, 'linhas': quantidade, 'tempo_s': tempo, 'pico_bytes': pico})
+
+    etapas = [
+        ('carrinho_pagina', lambda: nucleo.pagina_carrinho(carrinho, 0, 50)),
+        ('exportacao_csv', lambda: nucleo.exportar_csv(carrinho)),
+        ('exportacao_xlsx', lambda: nucleo.exportar_xlsx(carrinho)),
+        ('exportacao_html', lambda: nucleo.exportar_orcamento_html(carrinho, cliente='Cliente sintético', tabela='CODTAB 1')),
+    ]
+    for etapa, funcao in etapas:
+        tempo, pico, _ = medir(funcao, repeticoes)
+        resultados.append({'etapa': etapa, 'linhas': quantidade, 'tempo_s': tempo, 'pico_bytes': pico})
+    return resultados
+
+# Função para exibir os resultados em forma de tabela
+def imprimir_resultados(resultados, regressoes=()):
+    """
+    Imprime etapa, linhas, tempo, vazão e pico de memória; marca as regressões
+    """
+    chaves_regressao = {(r['etapa'], r['linhas']) for r in regressoes}
+    print(f"{'etapa':<22} {'linhas':>10} {'tempo (ms)':>12} {'linhas/s':>14} {'pico (MB)':>10}")
+    for r in resultados:
+        vazao = r['linhas'] / r['tempo_s'] if r['tempo_s'] > 0 else float('inf')
+        marca = '  <- regressão' if (r['etapa'], r['linhas']) in chaves_regressao else ''
+        print(
+            f"{r['etapa']:<22} {r['linhas']:>10} {r['tempo_s'] * 1000:>12.2f} "
+            f"{vazao:>14,.0f} {r['pico_bytes'] / (1024 * 1024):>10.1f}{marca}"
+        )
+
+# Função para comparar os resultados com uma execução de referência
+def comparar_referencia(resultados, referencia, tolerancia, folga_s=0.002):
+    """
+    Retorna as etapas mais lentas que a referência além da tolerância relativa
+    (diferenças abaixo de folga_s são ignoradas como ruído)
+    """
+    tempos_referencia = {(r['etapa'], r['linhas']): r['tempo_s'] for r in referencia}
+    regressoes = []
+    for r in resultados:
+        anterior = tempos_referencia.get((r['etapa'], r['linhas']))
+        if anterior is not None and r['tempo_s'] > anterior * (1 + tolerancia) and r['tempo_s'] - anterior > folga_s:
+            regressoes.append(dict(r, tempo_referencia_s=anterior))
+    return regressoes
+
+# Função para montar os argumentos da linha de comando
+def criar_parser():
+    """
+    Define os argumentos aceitos pelo comando
+    """
+    parser = argparse.ArgumentParser(description="Benchmark do Simulador Comercial com tabelas sintéticas.")
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="Tamanhos da tabela_produto/tabela_parceiro (padrão: 10000 100000 1000000)")
+    parser.add_argument('--linhas-xlsx', type=int, nargs='+', default=[10000, 100000],
+                        help="Tamanhos das planilhas XLSX (padrão: 10000 100000)")
+    parser.add_argument('--carrinhos', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help="Tamanhos de carrinho (padrão: 10 100 1000 10000)")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Repetições por etapa, vale a mais rápida (padrão: 3)")
+    parser.add_argument('--saida', help="Grava os resultados em JSON (para usar como referência)")
+    parser.add_argument('--referencia', help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help="Aumento de tempo aceito em relação à referência (padrão: 0.25 = 25%%)")
+    return parser
+
+# Função principal do comando
+def main(argv=None):
+    """
+    Executa os benchmarks pedidos, imprime a tabela de resultados e compara com a referência
+    """
+    args = criar_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    resultados = []
+    diretorio = tempfile.mkdtemp(prefix='benchmark_simulador_')
+    cache_original = nucleo.DIRETORIO_CACHE_TABELAS
+    nucleo.DIRETORIO_CACHE_TABELAS = os.path.join(diretorio, '.cache_tabelas')
+    try:
+        for linhas in args.linhas:
+            print(f"Tabelas sintéticas de {linhas} linhas...", file=sys.stderr)
+            resultados.extend(benchmark_tabelas(linhas, args.repeticoes, diretorio))
+
+        for linhas in args.linhas_xlsx:
+            print(f"Planilha sintética de {linhas} linhas...", file=sys.stderr)
+            resultados.extend(benchmark_xlsx(linhas, args.repeticoes))
+
+        for linhas in args.carrinhos:
+            print(f"Carrinho de {linhas} linhas...", file=sys.stderr)
+            resultados.extend(benchmark_carrinho(linhas, args.repeticoes))
+    finally:
+        nucleo.DIRETORIO_CACHE_TABELAS = cache_original
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    regressoes = []
+    if args.referencia:
+        with open(args.referencia, encoding='utf-8') as arquivo:
+            regressoes = comparar_referencia(resultados, json.load(arquivo)['resultados'], args.tolerancia)
+
+    imprimir_resultados(resultados, regressoes)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({'python': sys.version.split()[0], 'resultados': resultados}, arquivo, ensure_ascii=False, indent=1)
+
+    if regressoes:
+        print(f"\n{len(regressoes)} etapa(s) mais lentas que a referência:", file=sys.stderr)
+        for r in regressoes:
+            print(
+                f"  {r['etapa']} ({r['linhas']} linhas): {r['tempo_referencia_s'] * 1000:.2f} ms -> {r['tempo_s'] * 1000:.2f} ms",
+                file=sys.stderr
+            )
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,78 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
+import pandas as pd
 from datetime import datetime
+import functools
 import io
+import os
+import uuid
+
+import nucleo
+import perfil
+import simulacoes
+from nucleo import (
+    CAMINHO_BANCO_SIMULACOES,
+    CAMINHO_TABELA_PARCEIRO,
+    CAMINHO_TABELA_CUSTO,
+    CAMINHO_TABELA_PRODUTO,
+    CAMINHO_TRACES_PERFIL,
+    CAMPOS_REGRA_CENARIO,
+    CAMPOS_REGRA_MARGEM,
+    PRECOS_ESTATISTICAS,
+    adicionar_item_carrinho,
+    adicionar_itens_carrinho,
+    aplicar_cenario,
+    atributo_por_codigo,
+    atualizar_estatisticas_lote,
+    buscar_produtos,
+    calcular_estatisticas_tabela,
+    calcular_hash_arquivo,
+    calcular_preco_com_desconto_reais,
+    calcular_precos_com_desconto,
+    carregar_tabelas_paralelo,
+    catalogo_de_tabelas,
+    coluna_carrinho,
+    comparar_cesta_tabelas,
+    construir_catalogo,
+    construir_indice_busca,
+    construir_chaves_grade,
+    construir_indice_parceiros,
+    converter_desconto_reais_para_percentual,
+    criar_carrinho,
+    criar_pool_importacao,
+    criar_repositorio_tabelas,
+    descrever_cliente,
+    editar_item_carrinho,
+    exportar_carrinho,
+    fatia_estatisticas,
+    filtrar_grade,
+    indexar_custos,
+    liberar_tabela_compartilhada,
+    filtrar_clientes,
+    itens_de_pedido,
+    ler_lista_codigos,
+    ler_pedido,
+    ler_tabela_custos,
+    ler_tabela_com_cache,
+    linhas_catalogo,
+    obter_tabela_compartilhada,
+    load_data,
+    margens_minimas,
+    pagina_carrinho,
+    pagina_grade,
+    para_centavos,
+    precificar_pedido,
+    precos_tabela,
+    remover_item_carrinho,
+    resumir_cenario,
+    resumo_estatisticas,
+    resumo_repositorio_tabelas,
+    tipo_arquivo_tabela,
+    totais_carrinho,
+    valores_distintos,
+    verificar_guardas,
+    verificar_guardas_carrinho,
+)
 
 # Configuração da página
 st.set_page_config(
@@ -11,305 +81,1025 @@ st.set_page_config(
     layout="wide"
 )
 
+# Função para exibir as mensagens do núcleo na interface
+def notificar_streamlit(nivel, *conteudo, area='sidebar'):
+    """
+    Mostra as mensagens de diagnóstico do núcleo na sidebar ou na área principal
+    """
+    destino = st.sidebar if area == 'sidebar' else st
+    getattr(destino, nivel)(*conteudo)
+
+nucleo.definir_notificador(notificar_streamlit)
+
+# Instrumentação de desempenho: ligada pelo painel no fim da sidebar, mede cada etapa desta execução
+perfil_ativo = st.session_state.get('perfil_ativo', False)
+if perfil_ativo:
+    if 'registro_perfil' not in st.session_state:
+        st.session_state.registro_perfil = perfil.criar_registro()
+    st.session_state.registro_perfil['arquivo_jsonl'] = (
+        CAMINHO_TRACES_PERFIL if st.session_state.get('perfil_jsonl') else None
+    )
+    perfil.ativar(st.session_state.registro_perfil)
+registro_perfil = st.session_state.registro_perfil if perfil_ativo else None
+
+# Função para gerar uma exportação medindo o tempo no perfil da sessão
+def exportacao_medida(carrinho, formato, **opcoes):
+    """
+    Os downloads são gerados fora da thread da execução, por isso o registro é passado explicitamente
+    """
+    with perfil.etapa(f"download_{formato}", registro=registro_perfil):
+        return exportar_carrinho(carrinho, formato, **opcoes)
+
 # Título da aplicação
 st.title("🧮 Sadio | Simulador Comercial")
 st.markdown("---")
 
-# Função para processar arquivo XLSX
-def processar_xlsx(uploaded_file):
+# Função para abrir o banco de simulações salvas, compartilhado por todas as sessões
+@st.cache_resource
+def armazem_simulacoes():
+    """
+    Uma conexão SQLite (WAL) por processo; as gravações adiadas de todas as sessões são enviadas em lote
+    """
+    return simulacoes.abrir_armazem(CAMINHO_BANCO_SIMULACOES)
+
+# Função para obter o repositório de tabelas compartilhado por todas as sessões
+@st.cache_resource
+def repositorio_tabelas():
+    """
+    Uma única instância por processo: cada tabela distinta fica em memória uma vez,
+    e as sessões guardam apenas a chave da tabela que estão usando
+    """
+    return criar_repositorio_tabelas()
+
+# Função para ler um arquivo de tabela importado
+def carregar_tabela_arquivo(conteudo, nome_arquivo, file_type):
+    """
+    Processa o arquivo e retorna (DataFrame, mapeamento de colunas), ou None se a leitura falhar
+    (falhas não são guardadas no repositório, para que a mensagem de erro apareça de novo)
+    """
+    arquivo = io.BytesIO(conteudo)
+    arquivo.name = nome_arquivo
+    df, mapeamento = load_data(arquivo, file_type)
+    return None if df is None else (df, mapeamento)
+
+# Função para obter o pool de processos da importação de vários arquivos
+@st.cache_resource
+def pool_importacao():
+    """
+    Um pool por processo do servidor, reaproveitado entre importações e sessões
+    """
+    return criar_pool_importacao()
+
+# Função para obter o catálogo formado por um lote de tabelas importadas
+@st.cache_resource(max_entries=8, show_spinner=False)
+def obter_catalogo_lote(chaves_lote, _tabelas):
+    """
+    Reúne as tabelas do lote em um catálogo (uma CODTAB por arquivo) uma vez por conjunto de arquivos
+    """
+    return catalogo_de_tabelas(_tabelas)
+
+# Função para obter o índice de busca da tabela carregada
+@st.cache_resource(max_entries=16, show_spinner=False)
+def obter_indice_busca(chave_tabela, _df):
+    """
+    Constrói o índice de busca uma única vez por tabela carregada
+    """
+    return construir_indice_busca(_df)
+
+# Função para obter as chaves de filtro e ordenação da grade da tabela carregada
+@st.cache_resource(max_entries=16, show_spinner=False)
+def obter_chaves_grade(chave_tabela, _df):
+    """
+    Calcula códigos de Grupo/Marca e ordens das colunas uma única vez por tabela carregada
+    """
+    return construir_chaves_grade(_df)
+
+# Função para obter as estatísticas agregadas da tabela carregada
+@st.cache_resource(max_entries=16, show_spinner=False)
+def obter_estatisticas(chave_tabela, _df, _atualizar=None):
+    """
+    Agrega preços por Grupo, Marca e CODTAB uma única vez por tabela carregada.
+    _atualizar, se informada, obtém as estatísticas de forma incremental (None quando não é possível)
+    """
+    estatisticas = _atualizar() if _atualizar is not None else None
+    return estatisticas if estatisticas is not None else calcular_estatisticas_tabela(_df)
+
+# Função para obter a tabela de custos indexada para a tabela carregada
+@st.cache_resource(max_entries=16, show_spinner=False)
+def obter_custos(hash_custos, chave_tabela, _conteudo, nome_arquivo, _df):
+    """
+    Lê e indexa a tabela de custos uma única vez por arquivo de custos e tabela de preços
+    (a tabela de preços fornece a quantidade por caixa para derivar custos por unidade)
+    """
+    custos, colunas = ler_tabela_custos(_conteudo, nome_arquivo)
+    return indexar_custos(custos, colunas, _df)
+
+# Função para carregar o catálogo uma única vez por processo
+@st.cache_resource(show_spinner="Carregando catálogo de preços...")
+def carregar_catalogo(caminho):
     """
-    Função para processar arquivo XLSX - estrutura específica do arquivo
+    Lê a tabela_produto.csv e monta o catálogo compartilhado (somente leitura)
     """
     try:
-        # Ler o arquivo XLSX sem cabeçalho inicialmente
-        df = pd.read_excel(uploaded_file, engine='openpyxl', header=None)
-        
-        # Exibir informações originais para debug
-        st.sidebar.write(f"📊 Arquivo original: {len(df)} linhas, {len(df.columns)} colunas")
-        
-        # Verificar se temos pelo menos 4 linhas
-        if len(df) < 4:
-            st.error("❌ Arquivo muito pequeno. Necessário pelo menos 4 linhas.")
-            return None
-        
-        # ESTRUTURA DO ARQUIVO:
-        # Linha 0: Cabeçalho geral
-        # Linha 1: (vazia ou com outros dados)
-        # Linha 2: Cabeçalho real (EAN, NCM, Cod, Descrição, QTD, etc.)
-        # Linha 3 em diante: Dados reais
-        
-        # Pegar o cabeçalho real da linha 2 (índice 2)
-        cabecalho_real = df.iloc[2].values.tolist()
-        st.sidebar.write("📝 Cabeçalho real encontrado na linha 3")
-        
-        # Pegar os dados a partir da linha 3 (índice 3)
-        dados = df.iloc[3:]
-        
-        # Criar novo DataFrame com o cabeçalho correto
-        df_processado = pd.DataFrame(dados.values, columns=cabecalho_real)
+        df_produto = ler_tabela_com_cache(caminho)
+        return construir_catalogo(df_produto)
+    except Exception as e:
+        st.error(f"❌ Erro ao carregar o catálogo de preços: {str(e)}")
+        return None
+
+# Função para carregar o índice de clientes uma única vez por processo
+@st.cache_resource(show_spinner="Carregando clientes...")
+def carregar_parceiros(caminho):
+    """
+    Lê a tabela_parceiro.csv e monta o índice compartilhado de clientes
+    """
+    try:
+        df_parceiro = ler_tabela_com_cache(caminho)
+        return construir_indice_parceiros(df_parceiro)
+    except Exception as e:
+        st.error(f"❌ Erro ao carregar a tabela de clientes: {str(e)}")
+        return None
+
+# Sidebar para escolha da tabela de preços
+st.sidebar.header("📁 Importar Tabela de Preços")
+
+fonte_tabela = st.sidebar.radio(
+    "Fonte da tabela de preços:",
+    ["Importar arquivo", "Catálogo Sadio (CODTAB)"],
+    key="fonte_tabela"
+)
+
+arquivos_tabela = []
+catalogo = None
+codtab_selecionada = None
+
+if fonte_tabela == "Importar arquivo":
+    arquivos_tabela = st.sidebar.file_uploader(
+        "Carregue o(s) arquivo(s) com a tabela de preços",
+        type=['csv', 'xlsx'],
+        accept_multiple_files=True,
+        help="Suporte para CSV e XLSX. Para XLSX: linhas 1-2 serão excluídas, linha 3 será o cabeçalho, e última linha removida. "
+             "Vários arquivos são lidos em paralelo e reunidos em um catálogo com uma tabela por arquivo.",
+        key="arquivos_tabela"
+    ) or []
+    # Tabelas importadas não têm cliente: não manter (nem salvar) o escolhido no catálogo
+    st.session_state.cliente_selecionado = None
+    st.session_state.vendedor_selecionado = None
+else:
+    catalogo = carregar_catalogo(CAMINHO_TABELA_PRODUTO)
+    parceiros = carregar_parceiros(CAMINHO_TABELA_PARCEIRO)
+    
+    # Seleção do cliente: a tabela de preços é resolvida automaticamente pelo CODTAB do cliente
+    cliente_selecionado = None
+    vendedor_selecionado = None
+    if parceiros is not None:
+        vendedor_filter = st.sidebar.selectbox(
+            "Vendedor:",
+            ["Todos"] + sorted(parceiros['por_vendedor']),
+            key="vendedor_select"
+        )
+        posicoes_clientes = filtrar_clientes(
+            parceiros,
+            vendedor=None if vendedor_filter == "Todos" else vendedor_filter
+        )
+        posicao_cliente = st.sidebar.selectbox(
+            "Cliente:",
+            [None] + posicoes_clientes.tolist(),
+            format_func=lambda p: "Nenhum (escolher tabela manualmente)" if p is None else descrever_cliente(parceiros, p),
+            key="cliente_select"
+        )
+        if posicao_cliente is not None:
+            cliente_selecionado = int(parceiros['ids'][posicao_cliente])
+            vendedor_selecionado = parceiros['vendedor'][posicao_cliente] or None
+        elif vendedor_filter != "Todos":
+            vendedor_selecionado = vendedor_filter
+    st.session_state.cliente_selecionado = cliente_selecionado
+    st.session_state.vendedor_selecionado = vendedor_selecionado
+    
+    if catalogo is not None:
+        codtab_cliente = None
+        if cliente_selecionado is not None:
+            codtab_cliente = parceiros['cliente_codtab'].get(cliente_selecionado)
+            if codtab_cliente not in catalogo['indice_tabela']:
+                st.sidebar.warning("⚠️ Cliente sem tabela de preços válida. Escolha a tabela manualmente.")
+                codtab_cliente = None
         
-        # Excluir a última linha se tiver dados
-        if len(df_processado) > 0:
-            df_processado = df_processado.iloc[:-1].reset_index(drop=True)
-            st.sidebar.write("✅ Última linha removida")
+        if codtab_cliente is not None:
+            codtab_selecionada = codtab_cliente
+            st.sidebar.info(f"📋 Tabela do cliente: {codtab_cliente}")
+        else:
+            codtab_selecionada = st.sidebar.selectbox(
+                "Tabela de preços (CODTAB):",
+                catalogo['codigos_tabela'],
+                key="codtab_select"
+            )
+
+# Determinar o tipo de arquivo
+tipos_arquivos = [tipo_arquivo_tabela(arquivo.name) for arquivo in arquivos_tabela]
+if len(tipos_arquivos) == 1:
+    if tipos_arquivos[0] == 'xlsx':
+        st.sidebar.info("📊 Arquivo XLSX detectado")
+    else:
+        st.sidebar.info("📄 Arquivo CSV detectado")
+elif tipos_arquivos:
+    st.sidebar.info(f"📚 {len(tipos_arquivos)} arquivos: {tipos_arquivos.count('xlsx')} XLSX, {tipos_arquivos.count('csv')} CSV")
+
+# Inicializar session state: a sessão guarda só dados pequenos (chave da tabela, carrinho, descontos e cliente)
+if 'id_sessao' not in st.session_state:
+    st.session_state.id_sessao = uuid.uuid4().hex
+if 'carrinho' not in st.session_state:
+    st.session_state.carrinho = criar_carrinho()
+if 'chave_tabela' not in st.session_state:
+    st.session_state.chave_tabela = None
+if 'chaves_lote' not in st.session_state:
+    st.session_state.chaves_lote = set()
+
+repositorio = repositorio_tabelas()
+id_sessao = st.session_state.id_sessao
+
+# Função para trocar a tabela usada pela sessão
+def usar_tabela(chave):
+    """
+    Registra a nova chave na sessão e libera a referência à tabela anterior
+    """
+    chave_anterior = st.session_state.chave_tabela
+    if chave_anterior is not None and chave_anterior != chave:
+        liberar_tabela_compartilhada(repositorio, chave_anterior, id_sessao)
+    st.session_state.chave_tabela = chave
+
+# Função para trocar o lote de tabelas usado pela sessão
+def usar_lote(chaves):
+    """
+    Registra as chaves do lote atual (tabelas dos arquivos e base do catálogo) e libera as
+    referências às chaves do lote anterior que não fazem parte do novo
+    """
+    chaves = set(chaves)
+    for chave in st.session_state.chaves_lote - chaves:
+        if chave != st.session_state.chave_tabela:
+            liberar_tabela_compartilhada(repositorio, chave, id_sessao)
+    st.session_state.chaves_lote = chaves
+
+# Função para carregar os arquivos de tabela enviados
+def carregar_tabelas_enviadas(arquivos):
+    """
+    Retorna {nome do arquivo: (chave, DataFrame, mapeamento)} na ordem do envio.
+    Arquivos já presentes no repositório são reaproveitados; um único arquivo novo é lido
+    nesta execução e vários são lidos em paralelo no pool de processos, com barra de progresso.
+    O nome identifica a tabela no lote: arquivos com nome repetido são ignorados (com aviso)
+    """
+    por_nome = {}
+    for arquivo in arquivos:
+        por_nome.setdefault(arquivo.name, arquivo)
+    if len(por_nome) < len(arquivos):
+        repetidos = sorted({arquivo.name for arquivo in arquivos if por_nome[arquivo.name] is not arquivo})
+        st.sidebar.warning(f"⚠️ Arquivos com nome repetido ignorados (vale o primeiro): {', '.join(repetidos)}")
+    arquivos = list(por_nome.values())
+    
+    lidos, novos = {}, []
+    for arquivo in arquivos:
+        conteudo = arquivo.getvalue()
+        chave = calcular_hash_arquivo(conteudo)
+        tabela = obter_tabela_compartilhada(repositorio, chave, sessao=id_sessao)
+        if tabela is None:
+            novos.append((arquivo.name, conteudo, chave))
+        else:
+            lidos[arquivo.name] = (chave, *tabela)
+    
+    if len(novos) == 1:
+        nome, conteudo, chave = novos[0]
+        with st.spinner('Carregando e processando arquivo...'):
+            tabela = obter_tabela_compartilhada(
+                repositorio,
+                chave,
+                lambda: carregar_tabela_arquivo(conteudo, nome, tipo_arquivo_tabela(nome)),
+                id_sessao
+            )
+        if tabela is not None:
+            lidos[nome] = (chave, *tabela)
+    elif novos:
+        progresso = st.sidebar.progress(0.0, text=f"Lendo {len(novos)} arquivos em paralelo...")
+        resultados = carregar_tabelas_paralelo(
+            [(nome, conteudo) for nome, conteudo, _ in novos],
+            pool_importacao(),
+            lambda resultado, concluidos, total: progresso.progress(
+                concluidos / total, text=f"{concluidos}/{total} arquivos lidos ({resultado['nome']})"
+            )
+        )
+        progresso.empty()
         
-        # Limpar nomes de colunas
-        df_processado.columns = df_processado.columns.astype(str).str.strip()
+        with st.sidebar.expander(f"📋 Detalhes da importação ({len(novos)} arquivos)"):
+            for (nome, _, chave), resultado in zip(novos, resultados):
+                st.markdown(f"**{nome}**" + (f" ({resultado['tempo_s']:.1f} s)" if resultado['tempo_s'] else ""))
+                for nivel, partes, _ in resultado['mensagens']:
+                    getattr(st, nivel)(*partes)
+                if resultado['erro']:
+                    st.error(f"❌ {resultado['erro']}")
+                if resultado['df'] is not None:
+                    tabela = obter_tabela_compartilhada(
+                        repositorio, chave, lambda: (resultado['df'], resultado['mapeamento']), id_sessao
+                    )
+                    lidos[nome] = (chave, *tabela)
         
-        # Limpar dados - remover linhas completamente vazias
-        df_processado = df_processado.dropna(how='all')
+        # Falha de um processo do pool (não de validação): recriar o pool na próxima importação
+        if any(resultado['erro'] for resultado in resultados):
+            pool_importacao().shutdown(wait=False)
+            pool_importacao.clear()
+        falhas = [nome for nome, _, _ in novos if nome not in lidos]
+        if falhas:
+            st.sidebar.error(f"❌ Não foi possível carregar: {', '.join(falhas)}")
+    
+    return {arquivo.name: lidos[arquivo.name] for arquivo in arquivos if arquivo.name in lidos}
+
+# Processar arquivo(s) carregado(s)
+df_loaded = None
+tabelas_enviadas = {}
+chaves_lote = ()
+chave_catalogo = "CATÁLOGO"
+if arquivos_tabela:
+    with perfil.etapa('carregar_tabela'):
+        tabelas_enviadas = carregar_tabelas_enviadas(arquivos_tabela)
+    
+    if len(tabelas_enviadas) > 1:
+        # Lote: as tabelas formam um catálogo (uma CODTAB por arquivo) para comparação, cenários e análise
+        chaves_lote = tuple((nome, chave) for nome, (chave, _, _) in tabelas_enviadas.items())
+        catalogo = obter_catalogo_lote(chaves_lote, {nome: df for nome, (_, df, _) in tabelas_enviadas.items()})
+        chave_catalogo = f"LOTE {calcular_hash_arquivo(repr(chaves_lote).encode())}"
+        codtab_selecionada = st.sidebar.selectbox("Tabela do lote:", list(tabelas_enviadas), key="tabela_lote")
+    
+    if tabelas_enviadas:
+        chave_arquivo, df_loaded, mapeamento_colunas = tabelas_enviadas[codtab_selecionada or next(iter(tabelas_enviadas))]
+        st.session_state.mapeamento_colunas = mapeamento_colunas
+        usar_tabela(chave_arquivo)
+        if len(tabelas_enviadas) > 1:
+            st.sidebar.success(f"✅ {len(tabelas_enviadas)} tabelas carregadas | {codtab_selecionada}: {len(df_loaded)} produtos")
+        else:
+            st.sidebar.success(f"✅ Arquivo carregado: {len(df_loaded)} produtos")
+elif codtab_selecionada is not None:
+    # Trocar de tabela é apenas uma fatia da matriz do catálogo, feita uma vez por processo
+    chave_codtab = f"CODTAB {codtab_selecionada}"
+    df_loaded, _ = obter_tabela_compartilhada(
+        repositorio,
+        chave_codtab,
+        lambda: (precos_tabela(catalogo, codtab_selecionada), {}),
+        id_sessao
+    )
+    usar_tabela(chave_codtab)
+    st.sidebar.success(f"✅ Tabela {codtab_selecionada} carregada: {len(df_loaded)} produtos")
+usar_lote([chave for chave, _, _ in tabelas_enviadas.values()] + [chave_catalogo])
+
+# Função para obter as estatísticas da base do catálogo (catálogo distribuído ou lote)
+def estatisticas_catalogo(base):
+    """
+    As de um lote são atualizadas a partir das do lote anterior da sessão, se ele ainda estiver
+    no repositório: só as tabelas acrescentadas ou retiradas são agregadas
+    """
+    atualizar = None
+    anterior = st.session_state.get('lote_estatisticas')
+    if chaves_lote and anterior is not None and anterior['chave'] != chave_catalogo:
+        tabela_anterior = obter_tabela_compartilhada(repositorio, anterior['chave'])
+        if tabela_anterior is not None:
+            base_anterior = tabela_anterior[0]
+            atualizar = lambda: atualizar_estatisticas_lote(
+                obter_estatisticas(anterior['chave'], base_anterior),
+                base_anterior, base, anterior['chaves'], chaves_lote
+            )
+    estatisticas = obter_estatisticas(chave_catalogo, base, atualizar)
+    if chaves_lote:
+        st.session_state.lote_estatisticas = {'chave': chave_catalogo, 'chaves': chaves_lote}
+    return estatisticas
+
+# Tabela da sessão: a escolhida nesta execução ou a última usada (se ainda estiver no repositório)
+df_sessao = df_loaded
+if df_sessao is None and st.session_state.chave_tabela is not None:
+    tabela_sessao = obter_tabela_compartilhada(repositorio, st.session_state.chave_tabela, sessao=id_sessao)
+    if tabela_sessao is not None:
+        df_sessao = tabela_sessao[0]
+
+if df_loaded is not None:
+    # Mostrar estatísticas rápidas (agregados calculados uma vez por tabela)
+    resumo_tabela = resumo_estatisticas(obter_estatisticas(st.session_state.chave_tabela, df_loaded))
+    col1, col2, col3, col4 = st.sidebar.columns(4)
+    with col1:
+        st.metric("Total Produtos", resumo_tabela['produtos'])
+    with col2:
+        st.metric("Grupos", resumo_tabela['distintos_Grupo'])
+    with col3:
+        st.metric("Preço Médio CX", f"R$ {resumo_tabela['medio_cx']:.2f}")
+    with col4:
+        st.metric("Preço Médio UN", f"R$ {resumo_tabela['medio_un']:.2f}")
+
+# Custos e margens mínimas (opcional): tabela enviada ou tabela_custo.csv ao lado do aplicativo
+custos = None
+regras_margem = st.session_state.setdefault('regras_margem', [])
+margem_padrao = 0.0
+if df_sessao is not None:
+    with st.sidebar.expander("🛡️ Custos e margens mínimas"):
+        arquivo_custos = st.file_uploader(
+            "Tabela de custos / preço mínimo",
+            type=['csv', 'xlsx'],
+            help="Colunas: código (Cod/CODPROD) e custo e/ou preço mínimo, por caixa (CX) ou unidade (UN).",
+            key="arquivo_custos"
+        )
+        conteudo_custos, nome_custos = None, None
+        if arquivo_custos is not None:
+            conteudo_custos, nome_custos = arquivo_custos.getvalue(), arquivo_custos.name
+        elif os.path.exists(CAMINHO_TABELA_CUSTO):
+            with open(CAMINHO_TABELA_CUSTO, 'rb') as arquivo:
+                conteudo_custos, nome_custos = arquivo.read(), os.path.basename(CAMINHO_TABELA_CUSTO)
         
-        st.sidebar.write(f"📊 Arquivo processado: {len(df_processado)} linhas")
-        st.sidebar.write("🔍 Colunas finais:", list(df_processado.columns))
+        if conteudo_custos is not None:
+            try:
+                custos = obter_custos(
+                    calcular_hash_arquivo(conteudo_custos), st.session_state.chave_tabela, conteudo_custos, nome_custos, df_sessao
+                )
+                st.caption(f"{len(custos['indice'])} produtos com custo/preço mínimo ({nome_custos})")
+            except (ValueError, OSError) as e:
+                st.error(f"❌ Erro ao ler a tabela de custos: {str(e)}")
         
-        return df_processado
+        margem_padrao = st.number_input(
+            "Margem mínima padrão (%)", min_value=0.0, max_value=99.0, value=0.0, step=0.5, key="margem_padrao"
+        )
         
-    except Exception as e:
-        st.error(f"❌ Erro ao processar arquivo XLSX: {str(e)}")
-        return None
+        # Regras de margem por tabela (CODTAB) e/ou grupo; as últimas prevalecem
+        regra_margem = {}
+        if catalogo is not None:
+            regra_margem['CODTAB'] = st.multiselect("Tabelas (CODTAB):", catalogo['codigos_tabela'].tolist(), key="margem_codtab")
+        regra_margem['Grupo'] = st.multiselect(
+            "Grupos:", valores_distintos(obter_estatisticas(st.session_state.chave_tabela, df_sessao), 'Grupo'), key="margem_grupo"
+        )
+        regra_margem['margem_minima'] = st.number_input(
+            "Margem mínima da regra (%)", min_value=0.0, max_value=99.0, value=10.0, step=0.5, key="margem_regra"
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("➕ Regra", use_container_width=True, key="adicionar_regra_margem"):
+                regras_margem.append(regra_margem)
+        with col2:
+            if st.button("🔄 Limpar", use_container_width=True, key="limpar_regras_margem"):
+                regras_margem.clear()
+        for i, regra_aplicada in enumerate(regras_margem):
+            filtros = [f"{campo}: {', '.join(map(str, regra_aplicada[campo]))}"
+                       for campo in CAMPOS_REGRA_MARGEM if regra_aplicada.get(campo)]
+            st.caption(f"Regra {i + 1}: margem ≥ {regra_aplicada['margem_minima']:.1f}% em " + ("; ".join(filtros) or "todos os produtos"))
 
-# Função para mapear colunas automaticamente
-def mapear_colunas(df):
+# Função para salvar a simulação da sessão no banco
+def salvar_simulacao_sessao(codtab, nova=False, adiar=False):
     """
-    Tenta mapear automaticamente as colunas disponíveis para as colunas esperadas
+    Salva carrinho, regras de cenário, cliente e vendedor da sessão; sem nova=True, atualiza
+    a simulação aberta. Gravações adiadas (salvamento automático) seguem no próximo lote
     """
-    mapeamento = {}
-    colunas_esperadas = ['EAN', 'Descrição', 'QTD', 'Preco CX', 'Preco UN', 'Grupo']
-    colunas_disponiveis = [str(col).strip() for col in df.columns]
-    
-    st.sidebar.write("🔄 Tentando mapear colunas automaticamente...")
+    carrinho = st.session_state.carrinho
+    st.session_state.id_simulacao = simulacoes.salvar_simulacao(
+        armazem_simulacoes(),
+        carrinho,
+        nome=st.session_state.get('nome_simulacao', ''),
+        cliente=st.session_state.get('cliente_selecionado'),
+        vendedor=st.session_state.get('vendedor_selecionado'),
+        codtab=codtab,
+        cenario=st.session_state.get('regras_cenario', []),
+        id_simulacao=None if nova else st.session_state.get('id_simulacao'),
+        adiar=adiar
+    )
+    st.session_state.versao_simulacao = carrinho['versao']
+
+# Função para abrir uma simulação salva na sessão
+def abrir_simulacao(id_simulacao, duplicar=False):
+    """
+    Callback dos botões abrir/duplicar: troca o carrinho e as regras de cenário da sessão
+    pelos da simulação (a cópia, ao duplicar) antes da próxima execução
+    """
+    armazem = armazem_simulacoes()
+    if duplicar:
+        id_simulacao = simulacoes.duplicar_simulacao(armazem, id_simulacao)
+    simulacao = simulacoes.carregar_simulacao(armazem, id_simulacao)
+    if simulacao is None:
+        return
+    st.session_state.carrinho = simulacao['carrinho']
+    st.session_state.regras_cenario = simulacao['cenario']
+    st.session_state.id_simulacao = simulacao['id']
+    st.session_state.versao_simulacao = simulacao['carrinho']['versao']
+    st.session_state.nome_simulacao = simulacao['nome']
+    st.session_state.simulacao_aberta = simulacao
+
+# Função para excluir uma simulação salva
+def excluir_simulacao(id_simulacao):
+    """
+    Callback do botão excluir; a sessão deixa de atualizar a simulação se ela estava aberta
+    """
+    simulacoes.excluir_simulacao(armazem_simulacoes(), id_simulacao)
+    if st.session_state.get('id_simulacao') == id_simulacao:
+        st.session_state.id_simulacao = None
+        st.session_state.simulacao_aberta = None
+
+# Simulações salvas: salvar a atual e pesquisar/reabrir/duplicar as anteriores
+with st.sidebar.expander("💾 Simulações salvas"):
+    armazem = armazem_simulacoes()
+    aberta = st.session_state.get('simulacao_aberta')
+    if aberta and st.session_state.get('id_simulacao'):
+        st.caption(
+            f"Aberta: {aberta['nome'] or 'sem nome'} ({aberta['criado_em'][:10]}"
+            + (f", tabela {aberta['codtab']}" if aberta['codtab'] else "") + ") — alterações salvas automaticamente"
+        )
     
-    # Mapeamento por padrões conhecidos
-    padroes = {
-        'EAN': ['ean', 'codigo barras', 'código barras', 'codigo de barras'],
-        'Descrição': ['descrição', 'descricao', 'produto', 'nome', 'item'],
-        'QTD': ['qtd', 'quantidade', 'qtde', 'qty', 'quant'],
-        'Preco CX': ['preco cx', 'precocx', 'preço cx', 'preçocx', 'caixa'],
-        'Preco UN': ['preco un', 'precoun', 'preço un', 'preçoun', 'unidade', 'unitário'],
-        'Grupo': ['grupo', 'categoria', 'categ', 'familia', 'família']
-    }
+    if st.session_state.carrinho['tamanho'] > 0:
+        st.text_input("Nome da simulação:", key="nome_simulacao")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button(
+                "💾 Salvar", use_container_width=True, key="salvar_simulacao",
+                on_click=salvar_simulacao_sessao, args=(codtab_selecionada,)
+            )
+        with col2:
+            st.button(
+                "📄 Salvar como nova", use_container_width=True, key="salvar_simulacao_nova",
+                on_click=salvar_simulacao_sessao, args=(codtab_selecionada,), kwargs={'nova': True}
+            )
     
-    for col_esperada, possiveis_nomes in padroes.items():
-        for col_disponivel in colunas_disponiveis:
-            col_lower = col_disponivel.lower()
-            for padrao in possiveis_nomes:
-                if padrao in col_lower:
-                    mapeamento[col_esperada] = col_disponivel
-                    st.sidebar.write(f"   ✅ '{col_disponivel}' → '{col_esperada}'")
-                    break
-            if col_esperada in mapeamento:
-                break
+    st.markdown("**Pesquisar**")
+    texto_busca_simulacao = st.text_input("Nome contém:", key="busca_simulacao")
+    filtro_cliente = st.session_state.get('cliente_selecionado')
+    filtro_vendedor = st.session_state.get('vendedor_selecionado')
+    so_cliente = filtro_cliente is not None and st.checkbox(f"Só do cliente {filtro_cliente}", value=True, key="simulacao_so_cliente")
+    so_vendedor = filtro_vendedor is not None and st.checkbox(f"Só do vendedor {filtro_vendedor}", key="simulacao_so_vendedor")
+    so_tabela = codtab_selecionada is not None and st.checkbox(f"Só da tabela {codtab_selecionada}", key="simulacao_so_tabela")
+    periodo = st.date_input("Período:", value=(), key="simulacao_periodo")
     
-    return mapeamento
+    encontradas = simulacoes.buscar_simulacoes(
+        armazem,
+        cliente=filtro_cliente if so_cliente else None,
+        vendedor=filtro_vendedor if so_vendedor else None,
+        codtab=codtab_selecionada if so_tabela else None,
+        desde=periodo[0].isoformat() if len(periodo) > 0 else None,
+        ate=periodo[-1].isoformat() if len(periodo) > 0 else None,
+        texto=texto_busca_simulacao or None
+    )
+    if encontradas:
+        por_id = {simulacao['id']: simulacao for simulacao in encontradas}
+        id_escolhido = st.selectbox(
+            f"{len(encontradas)} simulação(ões):",
+            list(por_id),
+            format_func=lambda i: (
+                f"{por_id[i]['atualizado_em'][:16].replace('T', ' ')} | {por_id[i]['nome'] or 'sem nome'} | "
+                f"{por_id[i]['itens']} itens | R$ {por_id[i]['total_com_desconto'] / 100:.2f}"
+            ),
+            key="simulacao_escolhida"
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.button("📂 Abrir", use_container_width=True, key="abrir_simulacao", on_click=abrir_simulacao, args=(id_escolhido,))
+        with col2:
+            st.button(
+                "📑 Duplicar", use_container_width=True, key="duplicar_simulacao",
+                on_click=abrir_simulacao, args=(id_escolhido,), kwargs={'duplicar': True}
+            )
+        with col3:
+            st.button("🗑️ Excluir", use_container_width=True, key="excluir_simulacao", on_click=excluir_simulacao, args=(id_escolhido,))
+    else:
+        st.caption("Nenhuma simulação salva encontrada.")
+
+# Dependências das guardas de margem usadas pelos fragmentos
+guardas_margem = {'custos': custos, 'regras': regras_margem, 'margem_padrao': margem_padrao}
 
-# Função para renomear colunas
-def renomear_colunas(df, mapeamento):
+# Função para copiar o desconto equivalente para o outro campo
+def sincronizar_desconto(chave_widget, valor):
     """
-    Renomeia as colunas do DataFrame baseado no mapeamento
+    Callback dos botões de sincronização: grava o valor no estado do widget antes da
+    reexecução do fragmento, que já desenha o campo com o novo valor (sem st.rerun)
     """
-    return df.rename(columns=mapeamento)
+    st.session_state[chave_widget] = valor
 
-# Função para carregar dados
-def load_data(uploaded_file, file_type):
+# Função para limpar a simulação
+def limpar_simulacao():
     """
-    Função para carregar arquivo CSV ou XLSX com tratamento robusto de erros
+    Callback do botão de limpar: novo carrinho vazio (desvinculado da simulação salva aberta)
+    e descontos do configurador zerados
     """
-    try:
-        if file_type == 'xlsx':
-            # Processar arquivo XLSX
-            df = processar_xlsx(uploaded_file)
-            if df is None:
-                return None
-            
-            # Tentar mapear colunas automaticamente
-            mapeamento = mapear_colunas(df)
-            
-            if mapeamento:
-                df = renomear_colunas(df, mapeamento)
-                st.sidebar.success("✅ Colunas mapeadas automaticamente")
-                
-        else:
-            # Processar arquivo CSV
-            content = uploaded_file.getvalue().decode('utf-8')
-            
-            # Tentar diferentes delimitadores
-            delimiters = [',', ';', '\t']
-            df = None
-            
-            for delimiter in delimiters:
-                try:
-                    uploaded_file.seek(0)
-                    df = pd.read_csv(
-                        uploaded_file, 
-                        delimiter=delimiter,
-                        decimal=',', 
-                        thousands='.',
-                        encoding='utf-8'
-                    )
-                    
-                    if len(df.columns) > 1:
-                        st.sidebar.info(f"Delimitador detectado: '{delimiter}'")
-                        break
-                        
-                except Exception:
-                    continue
-            
-            # Se não conseguiu com delimitadores comuns, tentar leitura básica
-            if df is None or len(df.columns) <= 1:
-                uploaded_file.seek(0)
-                df = pd.read_csv(uploaded_file, encoding='utf-8')
+    st.session_state.carrinho = criar_carrinho()
+    st.session_state.id_simulacao = None
+    st.session_state.simulacao_aberta = None
+    st.session_state.desconto_slider = 0.0
+    st.session_state.desconto_manual_reais = 0.0
+
+# Função para aplicar a nova quantidade de um item do carrinho
+def atualizar_quantidade_item(carrinho, linha, chave_quantidade):
+    """
+    Callback do botão de atualizar: lê a quantidade digitada no widget da linha
+    """
+    editar_item_carrinho(carrinho, linha, quantidade=st.session_state[chave_quantidade])
+
+# Função para declarar um fragmento medido no perfil da sessão
+def fragmento_medido(nome):
+    """
+    Declara a função como fragmento (reexecutado sozinho quando seus widgets mudam).
+    Reexecuções do fragmento não passam pelo início do script, por isso o registro
+    de perfil da sessão é passado explicitamente à etapa
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            registro = st.session_state.get('registro_perfil') if st.session_state.get('perfil_ativo') else None
+            with perfil.etapa(nome, registro=registro):
+                return funcao(*args, **kwargs)
+        return st.fragment(envolvida)
+    return decorador
+
+# Função para configurar o desconto do produto escolhido
+@fragmento_medido('fragmento_desconto')
+def configurador_desconto(produto_info, tipo_venda, quantidade, preco_unitario, codtab_selecionada, guardas_margem):
+    """
+    Slider, desconto em R$, sincronização e botão de adicionar: mudar o desconto recalcula
+    só a prévia de preço deste item, sem recarregar tabela, grade ou carrinho
+    """
+    custos, regras_margem, margem_padrao = guardas_margem['custos'], guardas_margem['regras'], guardas_margem['margem_padrao']
+    
+    # Seção de desconto
+    st.subheader("🎯 Configurar Desconto")
+    
+    col5, col6 = st.columns(2)
+    
+    with col5:
+        st.markdown("**🔘 Desconto em Porcentagem**")
         
-        # Verificar se as colunas necessárias existem
-        required_columns = ['EAN', 'Descrição', 'QTD', 'Preco CX', 'Preco UN', 'Grupo']
+        desconto_slider = st.slider(
+            "Desconto (%)",
+            min_value=0.0,
+            max_value=50.0,
+            step=0.5,
+            key="desconto_slider"
+        )
         
-        # Mostrar colunas disponíveis
-        st.sidebar.write("🔍 Colunas detectadas:", list(df.columns))
+        desconto_equivalente_reais = preco_unitario * (desconto_slider / 100)
         
-        # Verificar colunas faltando
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        calculo_slider = calcular_precos_com_desconto(
+            preco_unitario, quantidade, desconto_slider, 
+            'CX' if tipo_venda == 'Caixa' else 'UN'
+        )
         
-        if missing_columns:
-            st.error(f"❌ Colunas faltando: {missing_columns}")
-            st.info("📋 Colunas disponíveis: " + ", ".join(df.columns))
-            
-            # Tentar encontrar colunas similares
-            st.info("🔍 Tentando encontrar colunas similares...")
-            for req_col in missing_columns:
-                for col in df.columns:
-                    if req_col.lower() in str(col).lower():
-                        st.info(f"   • '{req_col}' pode ser: '{col}'")
-                        break
-            
-            return None
+        st.metric(
+            "Preço com Desconto",
+            f"R$ {calculo_slider['preco_unitario_com_desconto']:.2f}",
+            delta=f"-{desconto_slider:.1f}%"
+        )
+        st.caption(f"Equivale a: R$ {desconto_equivalente_reais:.2f} de desconto")
+    
+    with col6:
+        st.markdown("**💰 Desconto em Valor (R$)**")
         
-        # Limpar e converter dados
-        df_clean = df.copy()
+        desconto_maximo_reais = preco_unitario * 0.9
         
-        # Converter colunas numéricas
-        numeric_columns = ['QTD', 'Preco CX', 'Preco UN']
-        for col in numeric_columns:
-            if col in df_clean.columns:
-                df_clean[col] = df_clean[col].astype(str).str.replace(',', '.').str.strip()
-                df_clean[col] = pd.to_numeric(df_clean[col], errors='coerce')
+        desconto_manual_reais = st.number_input(
+            "Valor do Desconto (R$)",
+            min_value=0.0,
+            max_value=float(desconto_maximo_reais),
+            step=0.10,
+            format="%.2f",
+            key="desconto_manual_reais"
+        )
         
-        # Converter EAN para string
-        if 'EAN' in df_clean.columns:
-            df_clean['EAN'] = df_clean['EAN'].astype(str)
+        desconto_equivalente_percentual = converter_desconto_reais_para_percentual(desconto_manual_reais, preco_unitario)
         
-        # Remover linhas com valores NaN críticos
-        colunas_criticas = ['Descrição', 'Preco CX', 'Preco UN']
-        for col in colunas_criticas:
-            if col in df_clean.columns:
-                df_clean = df_clean.dropna(subset=[col])
+        calculo_reais = calcular_preco_com_desconto_reais(preco_unitario, desconto_manual_reais, quantidade)
         
-        st.sidebar.success(f"✅ Dados processados: {len(df_clean)} produtos válidos")
-        return df_clean
+        st.metric(
+            "Preço com Desconto",
+            f"R$ {calculo_reais['preco_unitario_com_desconto']:.2f}",
+            delta=f"-R$ {desconto_manual_reais:.2f}"
+        )
+        st.caption(f"Equivale a: {desconto_equivalente_percentual:.1f}% de desconto")
+    
+    # Sincronizar campos
+    col7, col8 = st.columns(2)
+    
+    with col7:
+        st.button(
+            "🔄 Usar % em R$",
+            use_container_width=True,
+            on_click=sincronizar_desconto,
+            args=('desconto_manual_reais', desconto_equivalente_reais)
+        )
+    
+    with col8:
+        st.button(
+            "🔄 Usar R$ em %",
+            use_container_width=True,
+            on_click=sincronizar_desconto,
+            args=('desconto_slider', min(desconto_equivalente_percentual, 50.0))
+        )
+    
+    # Escolher tipo de desconto
+    st.markdown("**🎯 Qual tipo de desconto usar na simulação?**")
+    col9, col10 = st.columns(2)
+    
+    with col9:
+        usar_desconto = st.radio(
+            "Selecione o tipo de desconto:",
+            ["Usar Porcentagem", "Usar Valor em R$"],
+            horizontal=True,
+            key="fonte_desconto"
+        )
+    
+    with col10:
+        if usar_desconto == "Usar Porcentagem":
+            desconto_final_percentual = desconto_slider
+            desconto_final_reais = desconto_equivalente_reais
+            tipo = "Porcentagem"
+            preco_final = calculo_slider['preco_unitario_com_desconto']
+            total_final = calculo_slider['total_com_desconto']
+        else:
+            desconto_final_percentual = desconto_equivalente_percentual
+            desconto_final_reais = desconto_manual_reais
+            tipo = "Reais"
+            preco_final = calculo_reais['preco_unitario_com_desconto']
+            total_final = calculo_reais['total_com_desconto']
         
-    except Exception as e:
-        st.error(f"❌ Erro ao carregar o arquivo: {str(e)}")
-        return None
-
-# Função para calcular preços com desconto
-def calcular_precos_com_desconto(preco_base, quantidade, desconto_percentual, tipo_preco='CX'):
-    """
-    Calcula preços com desconto aplicado
-    """
-    desconto_decimal = desconto_percentual / 100
-    preco_com_desconto = preco_base * (1 - desconto_decimal)
+        st.info(f"**Desconto selecionado:**")
+        st.info(f"**{desconto_final_percentual:.1f}%** | **R$ {desconto_final_reais:.2f}**")
+        st.success(f"**Preço final:** R$ {preco_final:.2f}")
+        st.success(f"**Total do item:** R$ {total_final:.2f}")
     
-    if tipo_preco == 'CX':
-        total = preco_com_desconto * quantidade
-        total_sem_desconto = preco_base * quantidade
-    else:  # UN
-        total = preco_com_desconto * quantidade
-        total_sem_desconto = preco_base * quantidade
+    # Margem e preço mínimo do item configurado
+    if custos is not None:
+        guarda_item = verificar_guardas(
+            custos,
+            [produto_info.get('Cod', produto_info.get('EAN', ''))],
+            [tipo_venda],
+            para_centavos([preco_unitario]),
+            para_centavos([preco_final]),
+            margens_minimas(
+                regras_margem, {'Grupo': produto_info.get('Grupo'), 'CODTAB': codtab_selecionada}, 1, margem_padrao
+            )
+        )
+        if guarda_item['tem_guarda'][0]:
+            margem_item = guarda_item['margem_percentual'][0]
+            st.caption(
+                f"🛡️ Desconto máximo permitido: {guarda_item['desconto_maximo_percentual'][0]:.1f}% "
+                f"(R$ {guarda_item['desconto_maximo_reais'][0] / 100:.2f}) | Preço mínimo: R$ {guarda_item['preco_minimo'][0] / 100:.2f}"
+                + ("" if np.isnan(margem_item) else f" | Margem: {margem_item:.1f}%")
+            )
+            if guarda_item['violacao'][0]:
+                st.error("⚠️ O preço com desconto está abaixo do preço mínimo / margem mínima deste produto.")
     
-    desconto_total = total_sem_desconto - total
+    # Botão para adicionar à simulação
+    col11, col12, col13 = st.columns([1, 2, 1])
     
-    return {
-        'preco_unitario_com_desconto': preco_com_desconto,
-        'total_com_desconto': total,
-        'total_sem_desconto': total_sem_desconto,
-        'desconto_total': desconto_total
-    }
+    with col12:
+        if st.button("➕ Adicionar à Simulação", use_container_width=True, type="primary"):
+            novo_produto = {
+                'codigo': produto_info.get('Cod', produto_info.get('EAN', '')),
+                'descricao': produto_info['Descrição'],
+                'tipo': tipo_venda,
+                'quantidade': quantidade,
+                'preco_base': preco_unitario,
+                'desconto_percentual': desconto_final_percentual,
+                'desconto_reais': desconto_final_reais,
+                'tipo_desconto': tipo,
+                'codtab': codtab_selecionada
+            }
+            
+            adicionar_item_carrinho(st.session_state.carrinho, novo_produto)
+            st.success(f"✅ Produto adicionado! Desconto: {desconto_final_percentual:.1f}% (R$ {desconto_final_reais:.2f})")
+            # O carrinho é desenhado fora deste fragmento: reexecutar o aplicativo
+            st.rerun()
 
-# Função para converter desconto em R$ para porcentagem
-def converter_desconto_reais_para_percentual(desconto_reais, preco_base):
+# Função para escolher produto, tipo de venda e quantidade
+@fragmento_medido('fragmento_produto')
+def seletor_produto(df, posicoes_pagina, codtab_selecionada, guardas_margem):
     """
-    Converte desconto em R$ para porcentagem
+    Seleção do produto na página visível da grade; trocar produto, tipo ou quantidade
+    reexecuta só este fragmento (e o configurador de desconto dentro dele)
     """
-    if preco_base > 0:
-        return (desconto_reais / preco_base) * 100
-    return 0
+    col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
+    
+    with col1:
+        # Opções são as posições da página visível; só as descrições delas vão para o navegador
+        descricoes = df['Descrição'].to_numpy()
+        produto_selecionado = st.selectbox(
+            "Selecionar produto:",
+            posicoes_pagina.tolist(),
+            format_func=lambda posicao: str(descricoes[posicao]),
+            key="produto_select"
+        )
+    
+    if produto_selecionado is not None:
+        produto_info = df.iloc[produto_selecionado]
+        
+        with col2:
+            tipo_venda = st.radio("Tipo:", ["Caixa", "Unidade"], horizontal=True)
+        
+        with col3:
+            quantidade = st.number_input("Quantidade:", min_value=1, value=1, step=1)
+        
+        with col4:
+            st.write("Preços:")
+            if tipo_venda == "Caixa":
+                preco_cx = produto_info['Preco CX']
+                st.write(f"**R$ {preco_cx:.2f}**/CX")
+                preco_unitario = preco_cx
+            else:
+                preco_un = produto_info['Preco UN']
+                st.write(f"**R$ {preco_un:.2f}**/UN")
+                preco_unitario = preco_un
+        
+        
+        configurador_desconto(produto_info, tipo_venda, quantidade, preco_unitario, codtab_selecionada, guardas_margem)
 
-# Função para calcular preço com desconto em R$
-def calcular_preco_com_desconto_reais(preco_base, desconto_reais, quantidade):
+# Função para exibir e editar a simulação
+@fragmento_medido('fragmento_simulacao')
+def simulacao_carrinho(df, catalogo, codtab_selecionada, guardas_margem):
     """
-    Calcula preço com desconto direto em R$
+    Carrinho, edição de itens, resumo, comparação entre tabelas e exportações;
+    editar ou remover itens reexecuta só este fragmento
     """
-    preco_com_desconto = preco_base - desconto_reais
-    total_com_desconto = preco_com_desconto * quantidade
-    total_sem_desconto = preco_base * quantidade
-    desconto_total = total_sem_desconto - total_com_desconto
+    custos, regras_margem, margem_padrao = guardas_margem['custos'], guardas_margem['regras'], guardas_margem['margem_padrao']
     
-    return {
-        'preco_unitario_com_desconto': preco_com_desconto,
-        'total_com_desconto': total_com_desconto,
-        'total_sem_desconto': total_sem_desconto,
-        'desconto_total': desconto_total
-    }
-
-# Sidebar para upload do arquivo
-st.sidebar.header("📁 Importar Tabela de Preços")
-
-uploaded_file = st.sidebar.file_uploader(
-    "Carregue o arquivo com a tabela de preços",
-    type=['csv', 'xlsx'],
-    help="Suporte para CSV e XLSX. Para XLSX: linhas 1-2 serão excluídas, linha 3 será o cabeçalho, e última linha removida."
-)
-
-# Determinar o tipo de arquivo
-file_type = None
-if uploaded_file is not None:
-    if uploaded_file.name.endswith('.xlsx'):
-        file_type = 'xlsx'
-        st.sidebar.info("📊 Arquivo XLSX detectado")
-    else:
-        file_type = 'csv'
-        st.sidebar.info("📄 Arquivo CSV detectado")
-
-# Inicializar session state
-if 'produtos_selecionados' not in st.session_state:
-    st.session_state.produtos_selecionados = []
-if 'df_produtos' not in st.session_state:
-    st.session_state.df_produtos = None
-if 'sync_desconto' not in st.session_state:
-    st.session_state.sync_desconto = None
-
-# Processar arquivo carregado
-if uploaded_file is not None and file_type:
-    with st.spinner('Carregando e processando arquivo...'):
-        df_loaded = load_data(uploaded_file, file_type)
-        if df_loaded is not None:
-            st.session_state.df_produtos = df_loaded
-            st.sidebar.success(f"✅ Arquivo carregado: {len(df_loaded)} produtos")
-            
-            # Mostrar estatísticas rápidas
-            col1, col2, col3, col4 = st.sidebar.columns(4)
+    carrinho = st.session_state.carrinho
+    
+    # Salvamento automático da simulação aberta (gravação em lote, fora do caminho da interação)
+    if st.session_state.get('id_simulacao') and carrinho['versao'] != st.session_state.get('versao_simulacao'):
+        salvar_simulacao_sessao(codtab_selecionada, adiar=True)
+    
+    if carrinho['tamanho'] > 0:
+        st.subheader("🛒 Simulação Comercial")
+        
+        # Tabela de produtos na simulação: apenas a página visível é formatada
+        itens_por_pagina = 50
+        total_paginas = (carrinho['tamanho'] - 1) // itens_por_pagina + 1
+        pagina = 1
+        if total_paginas > 1:
+            pagina = st.number_input("Página da simulação:", min_value=1, max_value=total_paginas, value=1, step=1)
+        inicio = (pagina - 1) * itens_por_pagina
+        
+        # Margem e preço mínimo de todas as linhas do carrinho em uma única passada
+        guardas_carrinho = None
+        if custos is not None:
+            with perfil.etapa('guardas_carrinho'):
+                grupos_carrinho = None
+                if 'Cod' in df.columns:
+                    grupos_carrinho = atributo_por_codigo(df, coluna_carrinho(carrinho, 'codigo'), 'Grupo')
+                # Cada linha é verificada contra a tabela de onde veio o seu preço, não a selecionada agora
+                margens_carrinho = margens_minimas(
+                    regras_margem,
+                    {'Grupo': grupos_carrinho, 'CODTAB': coluna_carrinho(carrinho, 'codtab')},
+                    carrinho['tamanho'],
+                    margem_padrao
+                )
+                guardas_carrinho = verificar_guardas_carrinho(carrinho, custos, margens_carrinho)
+        
+        with perfil.etapa('grade_carrinho'):
+            df_simulacao = pagina_carrinho(carrinho, inicio, inicio + itens_por_pagina)
+            if guardas_carrinho is not None:
+                fim = inicio + len(df_simulacao)
+                df_simulacao['Margem %'] = [
+                    "" if np.isnan(v) else f"{v:.1f}%" for v in guardas_carrinho['margem_percentual'][inicio:fim]
+                ]
+                df_simulacao['Desc. Máx.'] = [
+                    f"{v:.1f}%" if tem else "" for v, tem in zip(
+                        guardas_carrinho['desconto_maximo_percentual'][inicio:fim], guardas_carrinho['tem_guarda'][inicio:fim]
+                    )
+                ]
+                df_simulacao['Guarda'] = np.where(guardas_carrinho['violacao'][inicio:fim], "⚠️ abaixo do mínimo", "")
+            st.dataframe(df_simulacao, use_container_width=True, hide_index=True)
+        
+        if guardas_carrinho is not None and guardas_carrinho['violacao'].any():
+            itens_violados = np.flatnonzero(guardas_carrinho['violacao']) + 1
+            st.warning(
+                f"⚠️ {len(itens_violados)} item(ns) abaixo do preço mínimo / margem mínima: "
+                + ", ".join(map(str, itens_violados[:20])) + ("…" if len(itens_violados) > 20 else "")
+            )
+        
+        # Editar ou remover um item
+        with st.expander("✏️ Editar item da simulação"):
+            col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
             with col1:
-                st.metric("Total Produtos", len(df_loaded))
+                item_editar = st.number_input("Item:", min_value=1, max_value=carrinho['tamanho'], value=1, step=1)
+            linha_editar = item_editar - 1
             with col2:
-                st.metric("Grupos", df_loaded['Grupo'].nunique())
+                st.number_input(
+                    "Nova quantidade:",
+                    min_value=1,
+                    value=int(coluna_carrinho(carrinho, 'quantidade')[linha_editar]),
+                    step=1,
+                    key=f"editar_quantidade_{linha_editar}"
+                )
             with col3:
-                preco_medio_cx = df_loaded['Preco CX'].mean() 
-                st.metric("Preço Médio CX", f"R$ {preco_medio_cx:.2f}")
+                st.button(
+                    "💾 Atualizar item",
+                    use_container_width=True,
+                    on_click=atualizar_quantidade_item,
+                    args=(carrinho, linha_editar, f"editar_quantidade_{linha_editar}")
+                )
             with col4:
-                preco_medio_un = df_loaded['Preco UN'].mean()
-                st.metric("Preço Médio UN", f"R$ {preco_medio_un:.2f}")
+                st.button(
+                    "🗑️ Remover item",
+                    use_container_width=True,
+                    on_click=remover_item_carrinho,
+                    args=(carrinho, linha_editar)
+                )
+        
+        # Resumo financeiro
+        st.subheader("📊 Resumo da Simulação")
+        
+        # Totais mantidos de forma incremental pelo carrinho (O(1)), exatos em centavos
+        totais = totais_carrinho(carrinho)
+        total_sem_desconto = totais['total_sem_desconto']
+        total_com_desconto = totais['total_com_desconto']
+        total_desconto = totais['desconto_total']
+        percentual_desconto_medio = (total_desconto / total_sem_desconto * 100) if total_sem_desconto > 0 else 0
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric("Total sem Desconto", f"R$ {total_sem_desconto:.2f}")
+        with col2:
+            st.metric("Total com Desconto", f"R$ {total_com_desconto:.2f}")
+        with col3:
+            st.metric("Desconto Total", f"R$ {total_desconto:.2f}")
+        with col4:
+            st.metric("Desconto Médio", f"{percentual_desconto_medio:.1f}%")
+        
+        # Mesma cesta (quantidades e descontos %) precificada em todas as tabelas do catálogo
+        if catalogo is not None:
+            with st.expander("⚖️ Comparar a simulação em todas as tabelas (CODTAB)"):
+                comparacao = comparar_cesta_tabelas(
+                    catalogo,
+                    coluna_carrinho(carrinho, 'codigo'),
+                    coluna_carrinho(carrinho, 'tipo'),
+                    coluna_carrinho(carrinho, 'quantidade'),
+                    coluna_carrinho(carrinho, 'desconto_percentual')
+                )
+                comparaveis = comparacao[comparacao['Comparável']]
+                mais_barata, mais_cara = comparaveis.iloc[0], comparaveis.iloc[-1]
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("🟢 Mais barata", f"Tabela {mais_barata['CODTAB']}", f"R$ {mais_barata['Total com Desconto']:.2f}", delta_color="off")
+                with col2:
+                    st.metric("🔴 Mais cara", f"Tabela {mais_cara['CODTAB']}", f"R$ {mais_cara['Total com Desconto']:.2f}", delta_color="off")
+                with col3:
+                    st.metric("Amplitude", f"R$ {mais_cara['Diferença vs Menor']:.2f}")
+                if mais_barata['Itens sem Preço'] > 0:
+                    st.caption(
+                        f"Nenhuma tabela tem preço para todos os itens: comparando as {len(comparaveis)} tabelas "
+                        f"sem preço para {mais_barata['Itens sem Preço']} item(ns)."
+                    )
+                
+                marcador = np.full(len(comparacao), "", dtype=object)
+                marcador[comparacao['CODTAB'].to_numpy() == codtab_selecionada] = "📌 atual"
+                marcador[0] = "🟢 mais barata"
+                marcador[len(comparaveis) - 1] = "🔴 mais cara"
+                st.dataframe(
+                    comparacao.drop(columns='Comparável').assign(**{' ': marcador}).set_index('CODTAB'),
+                    use_container_width=True,
+                    column_config={
+                        col: st.column_config.NumberColumn(format="R$ %.2f")
+                        for col in ['Total sem Desconto', 'Total com Desconto', 'Desconto Total', 'Diferença vs Menor']
+                    }
+                )
+        
+        # Botões de ação
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.button("🔄 Limpar Simulação", use_container_width=True, on_click=limpar_simulacao)
+        
+        # Exportações geradas só no clique e reaproveitadas enquanto o carrinho não mudar
+        info_orcamento = {
+            'cliente': st.session_state.get('cliente_selecionado'),
+            'tabela': st.session_state.get('chave_tabela')
+        }
+        sufixo_arquivo = datetime.now().strftime('%Y%m%d_%H%M')
+        
+        with col2:
+            st.download_button(
+                label="💾 Exportar CSV",
+                data=lambda: exportacao_medida(carrinho, 'csv'),
+                file_name=f"simulacao_comercial_{sufixo_arquivo}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+            st.download_button(
+                label="📊 Exportar XLSX",
+                data=lambda: exportacao_medida(carrinho, 'xlsx'),
+                file_name=f"simulacao_comercial_{sufixo_arquivo}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+        
+        with col3:
+            st.download_button(
+                label="🖨️ Orçamento para impressão",
+                data=lambda: exportacao_medida(carrinho, 'html', **info_orcamento),
+                file_name=f"orcamento_{sufixo_arquivo}.html",
+                mime="text/html",
+                use_container_width=True
+            )
 
 # Layout principal
-if st.session_state.df_produtos is not None:
-    df = st.session_state.df_produtos
+if df_sessao is not None:
+    df = df_sessao
+    
+    # Chaves de filtro e ordenação calculadas uma vez por tabela
+    chaves_grade = obter_chaves_grade(st.session_state.chave_tabela, df)
     
     # Colunas para busca e filtros
     col1, col2, col3 = st.columns([2, 1, 1])
@@ -320,300 +1110,257 @@ if st.session_state.df_produtos is not None:
     with col2:
         grupo_filter = st.selectbox(
             "Filtrar por grupo:",
-            ["Todos"] + list(df['Grupo'].unique())
+            ["Todos"] + chaves_grade['filtros']['Grupo']['valores']
         )
     
     with col3:
         marca_options = ["Todos"]
-        if 'Marca' in df.columns:
-            marca_options.extend(list(df['Marca'].unique()))
+        if 'Marca' in chaves_grade['filtros']:
+            marca_options.extend(chaves_grade['filtros']['Marca']['valores'])
         marca_filter = st.selectbox("Filtrar por marca:", marca_options)
     
-    # Aplicar filtros
-    df_filtrado = df.copy()
+    # Aplicar filtros: o resultado é um array de posições na tabela base (sem cópias do DataFrame)
+    with perfil.etapa('filtros'):
+        posicoes_busca = None
+        if busca:
+            indice_busca = obter_indice_busca(st.session_state.chave_tabela, df)
+            posicoes_busca = buscar_produtos(indice_busca, busca)
+        
+        filtros_grade = {}
+        if grupo_filter != "Todos":
+            filtros_grade['Grupo'] = grupo_filter
+        if marca_filter != "Todos":
+            filtros_grade['Marca'] = marca_filter
+    
+    # Mostrar produtos filtrados
+    col1, col2, col3 = st.columns([2, 1, 1])
     
-    if busca:
-        mask = (df_filtrado['Descrição'].str.contains(busca, case=False, na=False)) | \
-               (df_filtrado['Cod'].astype(str).str.contains(busca, na=False)) | \
-               (df_filtrado['EAN'].astype(str).str.contains(busca, na=False))
-        df_filtrado = df_filtrado[mask]
+    with col2:
+        ordenar_por = st.selectbox(
+            "Ordenar por:",
+            ["Relevância" if busca else "Ordem da tabela"] + list(chaves_grade['ordens']),
+            key="ordenar_produtos"
+        )
     
-    if grupo_filter != "Todos":
-        df_filtrado = df_filtrado[df_filtrado['Grupo'] == grupo_filter]
+    with col3:
+        decrescente = st.checkbox("Decrescente", key="ordem_decrescente")
     
-    if marca_filter != "Todos" and 'Marca' in df_filtrado.columns:
-        df_filtrado = df_filtrado[df_filtrado['Marca'] == marca_filter]
+    with perfil.etapa('filtros'):
+        posicoes_filtradas = filtrar_grade(
+            chaves_grade, posicoes_busca, filtros_grade, ordenar_por, decrescente
+        )
     
-    # Mostrar produtos filtrados
-    st.subheader(f"📦 Produtos Disponíveis ({len(df_filtrado)})")
+    with col1:
+        st.subheader(f"📦 Produtos Disponíveis ({len(posicoes_filtradas)})")
     
     # Selecionar colunas para exibição
     colunas_exibicao = ['Cod', 'Descrição', 'QTD', 'Preco CX', 'Preco UN', 'Grupo']
-    if 'Marca' in df_filtrado.columns:
+    if 'Marca' in df.columns:
         colunas_exibicao.append('Marca')
     
     # Mostrar apenas as colunas que existem no DataFrame
-    colunas_exibicao = [col for col in colunas_exibicao if col in df_filtrado.columns]
+    colunas_exibicao = [col for col in colunas_exibicao if col in df.columns]
     
-    st.dataframe(
-        df_filtrado[colunas_exibicao].head(50),
-        use_container_width=True,
-        height=300
-    )
+    # Paginação no servidor: só a página visível é montada e enviada ao navegador
+    produtos_por_pagina = 50
+    total_paginas_produtos = max(1, (len(posicoes_filtradas) - 1) // produtos_por_pagina + 1)
+    if st.session_state.get('pagina_produtos', 1) > total_paginas_produtos:
+        st.session_state.pagina_produtos = 1
+    
+    with perfil.etapa('grade_produtos'):
+        pagina_produtos = 1
+        if total_paginas_produtos > 1:
+            pagina_produtos = st.number_input(
+                f"Página (de {total_paginas_produtos}):",
+                min_value=1,
+                max_value=total_paginas_produtos,
+                value=1,
+                step=1,
+                key="pagina_produtos"
+            )
+        inicio_produtos = (pagina_produtos - 1) * produtos_por_pagina
+        posicoes_pagina = posicoes_filtradas[inicio_produtos:inicio_produtos + produtos_por_pagina]
+        
+        st.dataframe(
+            pagina_grade(df, posicoes_filtradas, inicio_produtos, inicio_produtos + produtos_por_pagina, colunas_exibicao),
+            use_container_width=True,
+            hide_index=True,
+            height=300
+        )
     
     # Seção para adicionar produtos à simulação
     st.subheader("➕ Adicionar Produto à Simulação")
     
-    if len(df_filtrado) > 0:
-        col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
-        
-        with col1:
-            produto_selecionado = st.selectbox(
-                "Selecionar produto:",
-                df_filtrado['Descrição'].values,
-                key="produto_select"
-            )
-        
-        if produto_selecionado:
-            produto_info = df_filtrado[df_filtrado['Descrição'] == produto_selecionado].iloc[0]
-            
-            with col2:
-                tipo_venda = st.radio("Tipo:", ["Caixa", "Unidade"], horizontal=True)
-            
-            with col3:
-                quantidade = st.number_input("Quantidade:", min_value=1, value=1, step=1)
-            
-            with col4:
-                st.write("Preços:")
-                if tipo_venda == "Caixa":
-                    preco_cx = produto_info['Preco CX']
-                    st.write(f"**R$ {preco_cx:.2f}**/CX")
-                    preco_base = preco_cx
-                    preco_unitario = preco_cx
-                else:
-                    preco_un = produto_info['Preco UN']
-                    st.write(f"**R$ {preco_un:.2f}**/UN")
-                    preco_base = preco_un
-                    preco_unitario = preco_un
-            
-            # Seção de desconto
-            st.subheader("🎯 Configurar Desconto")
-            
-            col5, col6 = st.columns(2)
-            
-            with col5:
-                st.markdown("**🔘 Desconto em Porcentagem**")
-                
-                slider_value = 0.0
-                if st.session_state.sync_desconto == 'slider':
-                    slider_value = st.session_state.get('last_slider_value', 0.0)
-                
-                desconto_slider = st.slider(
-                    "Desconto (%)",
-                    min_value=0.0,
-                    max_value=50.0,
-                    value=slider_value,
-                    step=0.5,
-                    key="desconto_slider"
-                )
-                
-                desconto_equivalente_reais = preco_unitario * (desconto_slider / 100)
-                
-                calculo_slider = calcular_precos_com_desconto(
-                    preco_unitario, quantidade, desconto_slider, 
-                    'CX' if tipo_venda == 'Caixa' else 'UN'
-                )
-                
-                st.metric(
-                    "Preço com Desconto",
-                    f"R$ {calculo_slider['preco_unitario_com_desconto']:.2f}",
-                    delta=f"-{desconto_slider:.1f}%"
-                )
-                st.caption(f"Equivale a: R$ {desconto_equivalente_reais:.2f} de desconto")
-            
-            with col6:
-                st.markdown("**💰 Desconto em Valor (R$)**")
-                
-                desconto_maximo_reais = preco_unitario * 0.9
-                
-                manual_value = 0.0
-                if st.session_state.sync_desconto == 'manual':
-                    manual_value = st.session_state.get('last_manual_value', 0.0)
-                
-                desconto_manual_reais = st.number_input(
-                    "Valor do Desconto (R$)",
-                    min_value=0.0,
-                    max_value=float(desconto_maximo_reais),
-                    value=manual_value,
-                    step=0.10,
-                    format="%.2f",
-                    key="desconto_manual_reais"
-                )
-                
-                desconto_equivalente_percentual = converter_desconto_reais_para_percentual(desconto_manual_reais, preco_unitario)
-                
-                calculo_reais = calcular_preco_com_desconto_reais(preco_unitario, desconto_manual_reais, quantidade)
-                
-                st.metric(
-                    "Preço com Desconto",
-                    f"R$ {calculo_reais['preco_unitario_com_desconto']:.2f}",
-                    delta=f"-R$ {desconto_manual_reais:.2f}"
-                )
-                st.caption(f"Equivale a: {desconto_equivalente_percentual:.1f}% de desconto")
-            
-            # Sincronizar campos
-            col7, col8 = st.columns(2)
-            
-            with col7:
-                if st.button("🔄 Usar % em R$", use_container_width=True):
-                    st.session_state.sync_desconto = 'manual'
-                    st.session_state.last_manual_value = desconto_equivalente_reais
-                    st.rerun()
-            
-            with col8:
-                if st.button("🔄 Usar R$ em %", use_container_width=True):
-                    st.session_state.sync_desconto = 'slider'
-                    st.session_state.last_slider_value = min(desconto_equivalente_percentual, 50.0)
-                    st.rerun()
-            
-            # Escolher tipo de desconto
-            st.markdown("**🎯 Qual tipo de desconto usar na simulação?**")
-            col9, col10 = st.columns(2)
-            
-            with col9:
-                usar_desconto = st.radio(
-                    "Selecione o tipo de desconto:",
-                    ["Usar Porcentagem", "Usar Valor em R$"],
-                    horizontal=True,
-                    key="fonte_desconto"
-                )
-            
-            with col10:
-                if usar_desconto == "Usar Porcentagem":
-                    desconto_final_percentual = desconto_slider
-                    desconto_final_reais = desconto_equivalente_reais
-                    tipo = "Porcentagem"
-                    preco_final = calculo_slider['preco_unitario_com_desconto']
-                    total_final = calculo_slider['total_com_desconto']
-                    calculo_final = calculo_slider
-                else:
-                    desconto_final_percentual = desconto_equivalente_percentual
-                    desconto_final_reais = desconto_manual_reais
-                    tipo = "Reais"
-                    preco_final = calculo_reais['preco_unitario_com_desconto']
-                    total_final = calculo_reais['total_com_desconto']
-                    calculo_final = calculo_reais
-                
-                st.info(f"**Desconto selecionado:**")
-                st.info(f"**{desconto_final_percentual:.1f}%** | **R$ {desconto_final_reais:.2f}**")
-                st.success(f"**Preço final:** R$ {preco_final:.2f}")
-                st.success(f"**Total do item:** R$ {total_final:.2f}")
-            
-            # Botão para adicionar à simulação
-            col11, col12, col13 = st.columns([1, 2, 1])
-            
-            with col12:
-                if st.button("➕ Adicionar à Simulação", use_container_width=True, type="primary"):
-                    novo_produto = {
-                        'codigo': produto_info['Cod'],
-                        'descricao': produto_info['Descrição'],
-                        'tipo': tipo_venda,
-                        'quantidade': quantidade,
-                        'preco_base': preco_unitario,
-                        'desconto_percentual': desconto_final_percentual,
-                        'desconto_reais': desconto_final_reais,
-                        'preco_com_desconto': calculo_final['preco_unitario_com_desconto'],
-                        'total_com_desconto': calculo_final['total_com_desconto'],
-                        'total_sem_desconto': calculo_final['total_sem_desconto'],
-                        'desconto_total': calculo_final['desconto_total'],
-                        'tipo_desconto': tipo
-                    }
-                    
-                    st.session_state.produtos_selecionados.append(novo_produto)
-                    st.success(f"✅ Produto adicionado! Desconto: {desconto_final_percentual:.1f}% (R$ {desconto_final_reais:.2f})")
-                    st.rerun()
+    if len(posicoes_pagina) > 0:
+        seletor_produto(df, posicoes_pagina, codtab_selecionada, guardas_margem)
     else:
         st.warning("⚠️ Nenhum produto encontrado com os filtros aplicados.")
     
-    # Seção da simulação
-    if st.session_state.produtos_selecionados:
-        st.subheader("🛒 Simulação Comercial")
+    # Análise de preços: fatias dos agregados pré-calculados, sem percorrer as linhas da tabela
+    with st.expander("📈 Análise de Preços por Grupo / Marca / Tabela"):
+        fontes_analise = ["Tabela atual"]
+        if catalogo is not None:
+            fontes_analise.append("Catálogo (todas as CODTAB)")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            fonte_analise = st.radio("Base:", fontes_analise, horizontal=True, key="analise_fonte")
         
-        # Tabela de produtos na simulação
-        dados_simulacao = []
-        for i, produto in enumerate(st.session_state.produtos_selecionados):
-            dados_simulacao.append({
-                'Item': i + 1,
-                'Código': produto['codigo'],
-                'Descrição': produto['descricao'],
-                'Tipo': produto['tipo'],
-                'Qtd': produto['quantidade'],
-                'Preço Base': f"R$ {produto['preco_base']:.2f}",
-                'Desconto %': f"{produto['desconto_percentual']:.1f}%",
-                'Desconto R$': f"R$ {produto['desconto_reais']:.2f}",
-                'Tipo Desc.': produto['tipo_desconto'],
-                'Preço c/ Desc': f"R$ {produto['preco_com_desconto']:.2f}",
-                'Total': f"R$ {produto['total_com_desconto']:.2f}"
-            })
-        
-        df_simulacao = pd.DataFrame(dados_simulacao)
-        st.dataframe(df_simulacao, use_container_width=True)
+        if fonte_analise == "Tabela atual":
+            estatisticas = obter_estatisticas(st.session_state.chave_tabela, df)
+        else:
+            base_catalogo, _ = obter_tabela_compartilhada(
+                repositorio, chave_catalogo, lambda: (linhas_catalogo(catalogo), {}), id_sessao
+            )
+            estatisticas = estatisticas_catalogo(base_catalogo)
         
-        # Resumo financeiro
-        st.subheader("📊 Resumo da Simulação")
+        with col2:
+            campo_analise = st.selectbox("Agrupar por:", list(estatisticas['por']), key="analise_campo")
+        with col3:
+            precos_analise = [
+                preco for preco, sufixo in PRECOS_ESTATISTICAS.items()
+                if f"n_{sufixo}" in estatisticas['por'][campo_analise].columns
+            ]
+            preco_analise = st.radio("Preço:", precos_analise, horizontal=True, key="analise_preco")
         
-        total_sem_desconto = sum(p['total_sem_desconto'] for p in st.session_state.produtos_selecionados)
-        total_com_desconto = sum(p['total_com_desconto'] for p in st.session_state.produtos_selecionados)
-        total_desconto = sum(p['desconto_total'] for p in st.session_state.produtos_selecionados)
-        percentual_desconto_medio = (total_desconto / total_sem_desconto * 100) if total_sem_desconto > 0 else 0
+        valores_analise = st.multiselect(
+            f"Filtrar {campo_analise}:",
+            valores_distintos(estatisticas, campo_analise),
+            key=f"analise_valores_{campo_analise}"
+        )
+        fatia = fatia_estatisticas(estatisticas, campo_analise, preco_analise, valores_analise)
+        st.dataframe(fatia, use_container_width=True, hide_index=True)
+        if len(fatia):
+            st.bar_chart(fatia.set_index(fatia[campo_analise].astype(str))['Médio'])
+    
+    # Cenário de desconto em massa
+    with st.expander("📉 Cenário de Desconto por Tabela / Grupo / Marca / Produto"):
+        if 'regras_cenario' not in st.session_state:
+            st.session_state.regras_cenario = []
         
-        col1, col2, col3, col4 = st.columns(4)
+        # Base do cenário: catálogo inteiro (todas as CODTAB) ou a tabela importada
+        if catalogo is not None:
+            base_cenario, _ = obter_tabela_compartilhada(
+                repositorio, chave_catalogo, lambda: (linhas_catalogo(catalogo), {}), id_sessao
+            )
+            estatisticas_cenario = estatisticas_catalogo(base_cenario)
+        else:
+            base_cenario = df
+            estatisticas_cenario = obter_estatisticas(st.session_state.chave_tabela, df)
         
+        col1, col2, col3, col4 = st.columns(4)
+        regra = {}
         with col1:
-            st.metric("Total sem Desconto", f"R$ {total_sem_desconto:.2f}")
+            if 'CODTAB' in base_cenario.columns:
+                regra['CODTAB'] = st.multiselect("Tabelas (CODTAB):", catalogo['codigos_tabela'].tolist(), key="cenario_codtab")
         with col2:
-            st.metric("Total com Desconto", f"R$ {total_com_desconto:.2f}")
+            regra['Grupo'] = st.multiselect("Grupos:", valores_distintos(estatisticas_cenario, 'Grupo'), key="cenario_grupo")
         with col3:
-            st.metric("Desconto Total", f"R$ {total_desconto:.2f}")
+            if 'Marca' in base_cenario.columns:
+                regra['Marca'] = st.multiselect("Marcas:", valores_distintos(estatisticas_cenario, 'Marca'), key="cenario_marca")
         with col4:
-            st.metric("Desconto Médio", f"{percentual_desconto_medio:.1f}%")
-        
-        # Botões de ação
-        col1, col2, col3 = st.columns(3)
+            regra['desconto_percentual'] = st.number_input(
+                "Desconto (%):", min_value=0.0, max_value=50.0, value=5.0, step=0.5, key="cenario_desconto"
+            )
+        if 'Cod' in base_cenario.columns:
+            regra['Cod'] = ler_lista_codigos(st.text_area(
+                "Produtos (Cod, separados por vírgula, espaço ou linha):", key="cenario_produtos", height=68
+            ))
         
-        with col1:
-            if st.button("🔄 Limpar Simulação", use_container_width=True):
-                st.session_state.produtos_selecionados = []
-                st.session_state.sync_desconto = None
-                st.rerun()
+        col5, col6, col7 = st.columns([1, 1, 1])
+        with col5:
+            quantidade_cenario = st.number_input("Caixas por SKU:", min_value=1, value=1, step=1, key="cenario_quantidade")
+        with col6:
+            if st.button("➕ Adicionar regra", use_container_width=True):
+                st.session_state.regras_cenario.append(regra)
+        with col7:
+            if st.button("🔄 Limpar regras", use_container_width=True):
+                st.session_state.regras_cenario = []
         
-        with col2:
-            # Criar DataFrame para exportação
-            export_data = []
-            for produto in st.session_state.produtos_selecionados:
-                export_data.append({
-                    'Código': produto['codigo'],
-                    'Descrição': produto['descricao'],
-                    'Tipo_Venda': produto['tipo'],
-                    'Quantidade': produto['quantidade'],
-                    'Preço_Base': produto['preco_base'],
-                    'Desconto_Percentual': produto['desconto_percentual'],
-                    'Desconto_Reais': produto['desconto_reais'],
-                    'Tipo_Desconto': produto['tipo_desconto'],
-                    'Preço_Com_Desconto': produto['preco_com_desconto'],
-                    'Total_Com_Desconto': produto['total_com_desconto']
-                })
+        if st.session_state.regras_cenario:
+            for i, regra_aplicada in enumerate(st.session_state.regras_cenario):
+                filtros = [f"{campo}: {', '.join(map(str, regra_aplicada[campo]))}"
+                           for campo in CAMPOS_REGRA_CENARIO if regra_aplicada.get(campo)]
+                st.caption(f"Regra {i + 1}: {regra_aplicada['desconto_percentual']:.1f}% em " + ("; ".join(filtros) or "todos os produtos"))
             
-            df_export = pd.DataFrame(export_data)
-            csv = df_export.to_csv(index=False, decimal=',', sep=';')
+            resultado_cenario = aplicar_cenario(base_cenario, st.session_state.regras_cenario, quantidade_cenario)
+            total_sem = resultado_cenario['Total sem Desconto'].sum()
+            total_com = resultado_cenario['Total com Desconto'].sum()
             
-            st.download_button(
-                label="💾 Exportar Simulação",
-                data=csv,
-                file_name=f"simulacao_comercial_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("SKUs afetados", len(resultado_cenario))
+            with col2:
+                st.metric("Receita sem Desconto", f"R$ {total_sem:.2f}")
+            with col3:
+                st.metric("Receita com Desconto", f"R$ {total_com:.2f}", delta=f"-R$ {total_sem - total_com:.2f}")
+            with col4:
+                st.metric("Desconto Médio", f"{((total_sem - total_com) / total_sem * 100) if total_sem > 0 else 0:.1f}%")
+            
+            campo_resumo = 'CODTAB' if 'CODTAB' in resultado_cenario.columns and len(resultado_cenario) else 'Grupo'
+            st.dataframe(resumir_cenario(resultado_cenario, campo_resumo), use_container_width=True)
+            
+            # Margem e preço mínimo de todas as linhas do cenário (preços por caixa)
+            if custos is not None and 'Cod' in resultado_cenario.columns:
+                with perfil.etapa('guardas_cenario'):
+                    campos_margem = {campo: resultado_cenario[campo].to_numpy() for campo in CAMPOS_REGRA_MARGEM if campo in resultado_cenario.columns}
+                    guardas_cenario = verificar_guardas(
+                        custos,
+                        resultado_cenario['Cod'].to_numpy(),
+                        'Caixa',
+                        para_centavos(resultado_cenario['Preco CX']),
+                        para_centavos(resultado_cenario['Preço c/ Desc']),
+                        margens_minimas(regras_margem, campos_margem, len(resultado_cenario), margem_padrao)
+                    )
+                violacoes_cenario = guardas_cenario['violacao']
+                st.metric("SKUs abaixo da margem / preço mínimo", int(violacoes_cenario.sum()))
+                if violacoes_cenario.any():
+                    colunas_violacao = [col for col in ['Cod', 'Descrição', 'CODTAB', 'Grupo', 'Preco CX', 'Desconto %', 'Preço c/ Desc'] if col in resultado_cenario.columns]
+                    st.dataframe(
+                        resultado_cenario.loc[violacoes_cenario, colunas_violacao].assign(**{
+                            'Margem %': guardas_cenario['margem_percentual'][violacoes_cenario].round(1),
+                            'Desc. Máx. %': guardas_cenario['desconto_maximo_percentual'][violacoes_cenario].round(1),
+                            'Preço Mínimo': guardas_cenario['preco_minimo'][violacoes_cenario] / 100
+                        }).head(200),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+    
+    # Importação de pedido em lote
+    with st.expander("📥 Importar Pedido (planilha de compra do cliente)"):
+        arquivo_pedido = st.file_uploader(
+            "Carregue o pedido (CSV ou XLSX)",
+            type=['csv', 'xlsx'],
+            help="Primeira linha com cabeçalho. Colunas: código (EAN, DUN ou Cod), quantidade e, opcionalmente, tipo (CX/UN) e desconto (%).",
+            key="arquivo_pedido"
+        )
+        desconto_pedido = st.number_input(
+            "Desconto padrão (%) para linhas sem desconto:",
+            min_value=0.0, max_value=50.0, value=0.0, step=0.5, key="desconto_pedido"
+        )
+        
+        if arquivo_pedido is not None and st.button("📥 Adicionar pedido à simulação", use_container_width=True):
+            try:
+                pedido, colunas_pedido = ler_pedido(arquivo_pedido.getvalue(), arquivo_pedido.name)
+                precificado, nao_encontrados, invalidas = precificar_pedido(df, pedido, colunas_pedido, desconto_pedido)
+                adicionar_itens_carrinho(st.session_state.carrinho, itens_de_pedido(precificado, codtab_selecionada))
+                st.session_state.pedido_nao_encontrados = nao_encontrados
+                st.session_state.pedido_invalidas = invalidas
+                st.success(f"✅ {len(precificado)} linhas do pedido adicionadas à simulação")
+            except ValueError as e:
+                st.error(f"❌ Erro ao importar o pedido: {str(e)}")
+        
+        nao_encontrados = st.session_state.get('pedido_nao_encontrados')
+        if nao_encontrados is not None and len(nao_encontrados) > 0:
+            st.warning(f"⚠️ {len(nao_encontrados)} linhas do pedido não foram encontradas na tabela:")
+            st.dataframe(nao_encontrados, use_container_width=True)
+        
+        invalidas = st.session_state.get('pedido_invalidas')
+        if invalidas is not None and len(invalidas) > 0:
+            st.warning(f"⚠️ {len(invalidas)} linhas do pedido têm quantidade ou desconto inválido e não foram adicionadas:")
+            st.dataframe(invalidas, use_container_width=True)
+    
+    # Seção da simulação (fragmento: editar itens não reexecuta a tabela de produtos)
+    simulacao_carrinho(df, catalogo, codtab_selecionada, guardas_margem)
 
 else:
     # Tela inicial quando não há arquivo carregado
@@ -654,3 +1401,35 @@ st.markdown(
     "**Sadio | Simulador Comercial** - Para suporte, entre em contato com o administrador do sistema - Daniel Babo."
 
 )
+
+# Painel de desempenho (no fim da sidebar, depois de todas as etapas da execução)
+with st.sidebar.expander("⏱️ Perfil de desempenho"):
+    st.toggle("Medir etapas de cada execução", key="perfil_ativo")
+    st.checkbox(
+        "Gravar traces em JSONL",
+        key="perfil_jsonl",
+        help=f"Acrescenta cada execução medida em {os.path.basename(CAMINHO_TRACES_PERFIL)}"
+    )
+    
+    if perfil_ativo:
+        etapas_execucao = perfil.desativar()
+        st.caption(f"Execução {registro_perfil['numero_execucao']} (tempo em ms, memória residente em MB)")
+        st.dataframe(pd.DataFrame(etapas_execucao), use_container_width=True, hide_index=True)
+        
+        # Histórico das últimas execuções de cada etapa
+        resumo_perfil = perfil.resumo_etapas(registro_perfil)
+        st.dataframe(pd.DataFrame(resumo_perfil), use_container_width=True, hide_index=True)
+        
+        etapa_histograma = st.selectbox("Histograma da etapa:", [linha['Etapa'] for linha in resumo_perfil])
+        amostras = perfil.amostras_etapa(registro_perfil, etapa_histograma)
+        if amostras:
+            contagens, limites = np.histogram(amostras, bins=min(20, len(amostras)))
+            st.bar_chart(
+                pd.DataFrame({'Execuções': contagens}, index=pd.Index(np.round(limites[:-1], 2), name='ms'))
+            )
+        
+        # Tabelas em memória compartilhadas entre as sessões do servidor
+        st.caption("Tabelas compartilhadas entre sessões")
+        st.dataframe(pd.DataFrame(resumo_repositorio_tabelas(repositorio)), use_container_width=True, hide_index=True)
+    else:
+        st.caption("Ative para ver o tempo e a memória de cada etapa (carga, filtros, grade, carrinho, exportação).")
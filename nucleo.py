@@ -0,0 +1,2230 @@
+"""
+Núcleo do Simulador Comercial: leitura das tabelas de preços, catálogo, clientes,
+busca, carrinho e cálculo de preços, sem dependência do Streamlit.
+
+pandas, numpy e openpyxl são importados sob demanda (no primeiro uso), para que
+ferramentas de linha de comando iniciem rápido.
+"""
+import codecs
+import collections
+import concurrent.futures
+from datetime import datetime
+import hashlib
+import html
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+
+import perfil
+import processos
+
+logger = logging.getLogger(__name__)
+
+# Função para importar um módulo pesado apenas no primeiro uso
+def _importar_sob_demanda(nome):
+    """
+    Retorna o módulo já carregado ou um módulo preguiçoso (importlib.util.LazyLoader)
+    que só executa a importação quando algum atributo é acessado
+    """
+    if nome in sys.modules:
+        return sys.modules[nome]
+    spec = importlib.util.find_spec(nome)
+    if spec is None:
+        raise ImportError(f"Módulo '{nome}' não encontrado")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nome] = modulo
+    loader.exec_module(modulo)
+    return modulo
+
+np = _importar_sob_demanda('numpy')
+pd = _importar_sob_demanda('pandas')
+openpyxl = _importar_sob_demanda('openpyxl')
+
+# Função padrão de mensagens: sem interface, as mensagens vão para o logging
+def _notificar_log(nivel, *conteudo, area='sidebar'):
+    """
+    Registra a mensagem no logging (ERROR para erros, INFO para o restante)
+    """
+    mensagem = ' '.join(str(parte) for parte in conteudo)
+    logger.log(logging.ERROR if nivel == 'error' else logging.WARNING if nivel == 'warning' else logging.INFO, mensagem)
+
+_notificador = _notificar_log
+
+# Função para trocar o destino das mensagens de diagnóstico
+def definir_notificador(funcao):
+    """
+    Define a função que recebe as mensagens (nivel, *conteudo, area='sidebar' | 'principal').
+    O aplicativo Streamlit registra uma função que exibe as mensagens na tela
+    """
+    global _notificador
+    _notificador = funcao
+
+# Função para emitir uma mensagem de diagnóstico
+def notificar(nivel, *conteudo, area='sidebar'):
+    """
+    Envia a mensagem ao notificador atual (nivel: write, info, success, warning ou error)
+    """
+    _notificador(nivel, *conteudo, area=area)
+
+# Função para processar arquivo XLSX
+@perfil.medir('processar_xlsx')
+def processar_xlsx(uploaded_file):
+    """
+    Função para processar arquivo XLSX - estrutura específica do arquivo
+    Lê a planilha em modo streaming (openpyxl somente leitura), linha a linha,
+    montando as colunas diretamente, sem carregar a planilha inteira como object
+    """
+    try:
+        workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+        
+        # ESTRUTURA DO ARQUIVO:
+        # Linha 0: Cabeçalho geral
+        # Linha 1: (vazia ou com outros dados)
+        # Linha 2: Cabeçalho real (EAN, NCM, Cod, Descrição, QTD, etc.)
+        # Linha 3 em diante: Dados reais (a última linha é um rodapé e é descartada)
+        try:
+            linhas = workbook.active.iter_rows(values_only=True)
+            
+            # Pular as duas linhas de preâmbulo e pegar o cabeçalho real da linha 2 (índice 2)
+            cabecalho_real = next(itertools.islice(linhas, 2, None), None)
+            if cabecalho_real is None:
+                notificar('error', "❌ Arquivo muito pequeno. Necessário pelo menos 4 linhas.", area='principal')
+                return None
+            notificar('write', "📝 Cabeçalho real encontrado na linha 3")
+            
+            num_colunas = len(cabecalho_real)
+            colunas = [[] for _ in range(num_colunas)]
+            total_linhas = 3
+            
+            # A linha pendente só é gravada quando chega a próxima: assim a última (rodapé) nunca é gravada
+            pendente = None
+            for linha in linhas:
+                total_linhas += 1
+                # Linhas completamente vazias são descartadas
+                if all(valor is None or valor == '' for valor in linha):
+                    continue
+                if pendente is not None:
+                    for i in range(num_colunas):
+                        colunas[i].append(pendente[i] if i < len(pendente) else None)
+                pendente = linha
+        finally:
+            workbook.close()
+        
+        # Exibir informações originais para debug
+        notificar('write', f"📊 Arquivo original: {total_linhas} linhas, {num_colunas} colunas")
+        
+        if pendente is None:
+            notificar('error', "❌ Arquivo muito pequeno. Necessário pelo menos 4 linhas.", area='principal')
+            return None
+        notificar('write', "✅ Última linha removida")
+        
+        # Montar o DataFrame coluna a coluna (tipos inferidos diretamente de cada lista)
+        df_processado = pd.DataFrame({i: valores for i, valores in enumerate(colunas)})
+        df_processado.columns = [str(nome).strip() if nome is not None else 'nan' for nome in cabecalho_real]
+        
+        notificar('write', f"📊 Arquivo processado: {len(df_processado)} linhas")
+        notificar('write', "🔍 Colunas finais:", list(df_processado.columns))
+        
+        return df_processado
+        
+    except Exception as e:
+        notificar('error', f"❌ Erro ao processar arquivo XLSX: {str(e)}", area='principal')
+        return None
+
+# Função para mapear colunas automaticamente
+@perfil.medir('mapear_colunas')
+def mapear_colunas(df):
+    """
+    Tenta mapear automaticamente as colunas disponíveis para as colunas esperadas
+    """
+    mapeamento = {}
+    colunas_esperadas = ['EAN', 'Descrição', 'QTD', 'Preco CX', 'Preco UN', 'Grupo']
+    colunas_disponiveis = [str(col).strip() for col in df.columns]
+    
+    notificar('write', "🔄 Tentando mapear colunas automaticamente...")
+    
+    # Mapeamento por padrões conhecidos
+    padroes = {
+        'EAN': ['ean', 'codigo barras', 'código barras', 'codigo de barras'],
+        'Descrição': ['descrição', 'descricao', 'produto', 'nome', 'item'],
+        'QTD': ['qtd', 'quantidade', 'qtde', 'qty', 'quant'],
+        'Preco CX': ['preco cx', 'precocx', 'preço cx', 'preçocx', 'caixa'],
+        'Preco UN': ['preco un', 'precoun', 'preço un', 'preçoun', 'unidade', 'unitário'],
+        'Grupo': ['grupo', 'categoria', 'categ', 'familia', 'família']
+    }
+    
+    for col_esperada, possiveis_nomes in padroes.items():
+        for col_disponivel in colunas_disponiveis:
+            col_lower = col_disponivel.lower()
+            for padrao in possiveis_nomes:
+                if padrao in col_lower:
+                    mapeamento[col_esperada] = col_disponivel
+                    notificar('write', f"   ✅ '{col_disponivel}' → '{col_esperada}'")
+                    break
+            if col_esperada in mapeamento:
+                break
+    
+    return mapeamento
+
+# Função para renomear colunas
+def renomear_colunas(df, mapeamento):
+    """
+    Renomeia as colunas do DataFrame baseado no mapeamento
+    """
+    return df.rename(columns=mapeamento)
+
+# Colunas de código que devem ser lidas como texto (preserva zeros à esquerda)
+COLUNAS_CODIGO = ['ean', 'dun', 'ncm', 'cod', 'referencia']
+
+# Função para detectar o formato do CSV
+@perfil.medir('detectar_dialeto_csv')
+def detectar_dialeto_csv(conteudo, tamanho_amostra=65536):
+    """
+    Detecta delimitador, codificação, fim de linha e formato decimal a partir
+    de um trecho inicial do arquivo, sem fazer nenhuma leitura completa
+    """
+    amostra = conteudo[:tamanho_amostra]
+
+    # Codificação: avaliada sobre os trechos não-ASCII do arquivo inteiro (busca em bytes, sem decodificar)
+    trechos = b' '.join(m.group() for m in itertools.islice(re.finditer(rb'[\x80-\xff]+', conteudo), 500))
+    if conteudo.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif not trechos:
+        encoding = 'utf-8'
+    else:
+        encoding = None
+        try:
+            trechos.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            # Escolher a codificação de 8 bits que produz mais letras acentuadas válidas
+            acentos = set('ÁÉÍÓÚÂÊÔÃÕÇÀÜáéíóúâêôãõçàü')
+            melhor_pontuacao = -1
+            for candidata in ['cp1252', 'mac_roman', 'latin-1']:
+                try:
+                    texto = trechos.decode(candidata)
+                except UnicodeDecodeError:
+                    continue
+                pontuacao = sum(1 for c in texto if c in acentos)
+                if pontuacao > melhor_pontuacao:
+                    encoding, melhor_pontuacao = candidata, pontuacao
+
+    texto = amostra.decode(encoding, errors='ignore')
+
+    # Fim de linha: CR isolado (arquivos exportados no formato Mac antigo) precisa ser informado
+    lineterminator = None
+    if '\r' in texto and '\n' not in texto:
+        lineterminator = '\r'
+    linhas = [linha for linha in texto.splitlines() if linha.strip()][:50]
+    if len(amostra) < len(conteudo) and len(linhas) > 1:
+        # A última linha da amostra pode estar cortada
+        linhas = linhas[:-1]
+    cabecalho = linhas[0] if linhas else ''
+
+    # Delimitador: o candidato que mais aparece no cabeçalho
+    sep = max([';', ',', '\t', '|'], key=cabecalho.count)
+    if cabecalho.count(sep) == 0:
+        sep = ','
+
+    # Formato decimal: vírgula (1.234,56) ou ponto (1234.56)
+    decimal, thousands = '.', None
+    if sep != ',':
+        valores = [campo.strip().strip('"') for linha in linhas[1:] for campo in linha.split(sep)]
+        com_virgula = sum(1 for v in valores if re.fullmatch(r'-?\d{1,3}(\.\d{3})*,\d+|-?\d+,\d+', v))
+        com_ponto = sum(1 for v in valores if re.fullmatch(r'-?\d+\.\d+', v))
+        if com_virgula >= com_ponto:
+            decimal, thousands = ',', '.'
+
+    colunas = [c.strip().strip('"') for c in cabecalho.split(sep)]
+    dtype = {c: str for c in colunas if c.lower() in COLUNAS_CODIGO}
+
+    return {
+        'sep': sep,
+        'encoding': encoding,
+        'lineterminator': lineterminator,
+        'decimal': decimal,
+        'thousands': thousands,
+        'dtype': dtype
+    }
+
+# Função para ler o CSV com o formato detectado
+@perfil.medir('ler_csv')
+def ler_csv(conteudo, dialeto):
+    """
+    Lê o CSV inteiro em uma única passada com o engine C do pandas
+    """
+    # Quebras de linha soltas no fim do arquivo viram uma linha de lixo quando o separador é CR
+    conteudo = conteudo.rstrip(b'\r\n')
+
+    return pd.read_csv(
+        io.BytesIO(conteudo),
+        engine='c',
+        sep=dialeto['sep'],
+        encoding=dialeto['encoding'],
+        lineterminator=dialeto['lineterminator'],
+        decimal=dialeto['decimal'],
+        thousands=dialeto['thousands'],
+        dtype=dialeto['dtype']
+    )
+
+# Colunas de código de produto guardadas como inteiros quando os valores permitem
+COLUNAS_CODIGO_INTEIRO = ['EAN', 'DUN', 'Cod']
+
+# Colunas com poucos valores distintos guardadas como categóricas
+COLUNAS_CATEGORICAS = ['Grupo', 'Marca', 'CODTAB', 'CIDADE', 'VENDEDOR']
+
+# Função para medir a memória ocupada por uma tabela
+def memoria_tabela_mb(df):
+    """
+    Memória do DataFrame em MB, incluindo o conteúdo dos textos
+    """
+    return float(df.memory_usage(deep=True).sum()) / (1024 * 1024)
+
+# Função para converter uma coluna de números escritos como texto
+def converter_decimal(serie):
+    """
+    Converte a coluna para número aceitando vírgula decimal (1.234,56) ou ponto (1234.56).
+    A coluna inteira é lida direto como número; só os valores que não foram reconhecidos
+    (os escritos com vírgula) passam por texto
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie
+    numeros = pd.to_numeric(serie, errors='coerce')
+    pendentes = numeros.isna().to_numpy() & serie.notna().to_numpy()
+    if pendentes.any():
+        texto = serie[pendentes].astype(str).str.strip()
+        com_virgula = texto.str.contains(',', regex=False)
+        texto = texto.where(~com_virgula, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        numeros[pendentes] = pd.to_numeric(texto, errors='coerce').to_numpy()
+    return numeros
+
+# Função para guardar uma coluna de códigos de produto no menor formato
+def compactar_codigos(serie):
+    """
+    Converte a coluna para int64 quando todos os valores são números de até 18 dígitos sem
+    zero à esquerda e sem ausentes (o código exibido continua o mesmo); caso contrário,
+    mantém os códigos como texto. Uma célula vazia faz a coluna da planilha chegar como
+    float: números inteiros (9880.0) voltam a ser o código 9880, nunca o texto '9880.0'
+    """
+    if pd.api.types.is_integer_dtype(serie):
+        return serie
+    valores = serie.to_numpy(dtype=float) if pd.api.types.is_float_dtype(serie) else None
+    if valores is not None and np.all(np.isnan(valores) | ((valores == np.floor(valores)) & (np.abs(valores) < 2 ** 53))):
+        texto = serie.astype('Int64').astype(str)
+    else:
+        texto = serie.astype(str).str.replace(r'^(\d+)\.0$', r'\1', regex=True)
+    if len(texto) and texto.str.fullmatch(r'[1-9]\d{0,17}').fillna(False).all():
+        return pd.to_numeric(texto).astype(np.int64)
+    return texto
+
+# Função para guardar a tabela carregada em tipos compactos
+@perfil.medir('compactar_tabela')
+def compactar_tabela(df):
+    """
+    Códigos de produto (EAN, DUN, Cod) como inteiros e Grupo, Marca, CODTAB, CIDADE e VENDEDOR
+    como categóricos (um código inteiro por linha e cada texto guardado uma vez), desde que
+    a coluna repita valores. Filtros e agrupamentos passam a comparar códigos inteiros
+    """
+    colunas = {}
+    for col in COLUNAS_CODIGO_INTEIRO:
+        if col in df.columns:
+            colunas[col] = compactar_codigos(df[col])
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            if df[col].nunique() <= len(df) // 2:
+                colunas[col] = df[col].astype('category')
+    return df.assign(**colunas) if colunas else df
+
+# Função para carregar dados
+@perfil.medir('load_data')
+def load_data(uploaded_file, file_type):
+    """
+    Função para carregar arquivo CSV ou XLSX com tratamento robusto de erros
+    Retorna uma tupla (DataFrame limpo, mapeamento de colunas aplicado)
+    """
+    mapeamento = {}
+    try:
+        if file_type == 'xlsx':
+            # Processar arquivo XLSX
+            df = processar_xlsx(uploaded_file)
+            if df is None:
+                return None, mapeamento
+            
+            # Tentar mapear colunas automaticamente
+            mapeamento = mapear_colunas(df)
+            
+            if mapeamento:
+                df = renomear_colunas(df, mapeamento)
+                notificar('success', "✅ Colunas mapeadas automaticamente")
+                
+        else:
+            # Processar arquivo CSV
+            conteudo = uploaded_file.getvalue()
+
+            # Detectar o formato a partir de um trecho inicial e ler o arquivo uma única vez
+            dialeto = detectar_dialeto_csv(conteudo)
+            notificar(
+                'info',
+                f"Delimitador detectado: '{dialeto['sep']}' | Codificação: {dialeto['encoding']}"
+            )
+            df = ler_csv(conteudo, dialeto)
+        
+        # Verificar se as colunas necessárias existem
+        required_columns = ['EAN', 'Descrição', 'QTD', 'Preco CX', 'Preco UN', 'Grupo']
+        
+        # Mostrar colunas disponíveis
+        notificar('write', "🔍 Colunas detectadas:", list(df.columns))
+        
+        # Verificar colunas faltando
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        
+        if missing_columns:
+            notificar('error', f"❌ Colunas faltando: {missing_columns}", area='principal')
+            notificar('info', "📋 Colunas disponíveis: " + ", ".join(df.columns), area='principal')
+            
+            # Tentar encontrar colunas similares
+            notificar('info', "🔍 Tentando encontrar colunas similares...", area='principal')
+            for req_col in missing_columns:
+                for col in df.columns:
+                    if req_col.lower() in str(col).lower():
+                        notificar('info', f"   • '{req_col}' pode ser: '{col}'", area='principal')
+                        break
+            
+            return None, mapeamento
+        
+        # Limpar e converter dados (o DataFrame acabou de ser lido, não precisa de cópia)
+        df_clean = df
+        memoria_inicial = memoria_tabela_mb(df_clean)
+        
+        # Converter colunas numéricas (vírgula decimal interpretada direto, sem passar a coluna por texto)
+        numeric_columns = ['QTD', 'Preco CX', 'Preco UN']
+        for col in numeric_columns:
+            if col in df_clean.columns:
+                df_clean[col] = converter_decimal(df_clean[col])
+        
+        # Remover linhas com valores NaN críticos
+        colunas_criticas = [col for col in ['Descrição', 'Preco CX', 'Preco UN'] if col in df_clean.columns]
+        df_clean = df_clean.dropna(subset=colunas_criticas)
+        
+        # Códigos como inteiros e Grupo/Marca como categóricos
+        df_clean = compactar_tabela(df_clean)
+        notificar('info', f"💾 Memória da tabela: {memoria_inicial:.1f} MB → {memoria_tabela_mb(df_clean):.1f} MB")
+        
+        notificar('success', f"✅ Dados processados: {len(df_clean)} produtos válidos")
+        return df_clean, mapeamento
+        
+    except Exception as e:
+        notificar('error', f"❌ Erro ao carregar o arquivo: {str(e)}", area='principal')
+        return None, mapeamento
+
+# Função para calcular o hash do conteúdo do arquivo
+def calcular_hash_arquivo(conteudo):
+    """
+    Retorna o hash SHA-256 dos bytes do arquivo, usado como chave do cache
+    """
+    return hashlib.sha256(conteudo).hexdigest()
+
+# Função para identificar o tipo do arquivo de tabela pelo nome
+def tipo_arquivo_tabela(nome_arquivo):
+    """
+    Retorna 'xlsx' para planilhas do Excel e 'csv' para o restante
+    """
+    return 'xlsx' if nome_arquivo.lower().endswith('.xlsx') else 'csv'
+
+# Função executada em cada processo da importação em lote
+def _carregar_tabela_processo(nome_arquivo, conteudo):
+    """
+    Lê, mapeia, converte e valida um arquivo (load_data) em um processo separado.
+    As mensagens de diagnóstico são guardadas e devolvidas com o resultado, para serem
+    exibidas pelo processo principal
+    """
+    mensagens = []
+    definir_notificador(lambda nivel, *partes, area='sidebar': mensagens.append((nivel, partes, area)))
+    inicio = time.perf_counter()
+    arquivo = io.BytesIO(conteudo)
+    arquivo.name = nome_arquivo
+    df, mapeamento = load_data(arquivo, tipo_arquivo_tabela(nome_arquivo))
+    return {
+        'nome': nome_arquivo,
+        'df': df,
+        'mapeamento': mapeamento,
+        'mensagens': mensagens,
+        'erro': None,
+        'tempo_s': time.perf_counter() - inicio
+    }
+
+# Função para criar o pool de processos da importação em lote
+def criar_pool_importacao(max_processos=None):
+    """
+    Pool de processos iniciados com 'spawn' (seguro em aplicativos com várias threads, como o Streamlit).
+    Os processos não reexecutam o módulo __main__ do processo pai (ver processos.py): carregam só
+    o núcleo, onde está _carregar_tabela_processo
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_processos or os.cpu_count() or 1,
+        mp_context=processos.contexto_sem_main()
+    )
+
+# Função para carregar vários arquivos de tabela em paralelo
+@perfil.medir('carregar_tabelas_paralelo')
+def carregar_tabelas_paralelo(arquivos, pool=None, ao_concluir=None):
+    """
+    Carrega os arquivos [(nome, conteudo), ...] em paralelo, um por processo: o tempo total
+    fica próximo ao do arquivo mais lento. ao_concluir(resultado, concluidos, total) é chamada
+    no processo atual a cada arquivo terminado (para barras de progresso).
+    Retorna os resultados na ordem dos arquivos; falhas têm df None e a mensagem em 'erro'
+    """
+    pool_proprio = pool is None
+    if pool_proprio:
+        pool = criar_pool_importacao(min(len(arquivos), os.cpu_count() or 1))
+    try:
+        futuros = {
+            pool.submit(_carregar_tabela_processo, nome, conteudo): i
+            for i, (nome, conteudo) in enumerate(arquivos)
+        }
+        resultados = [None] * len(arquivos)
+        for concluidos, futuro in enumerate(concurrent.futures.as_completed(futuros), start=1):
+            i = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                resultado = {
+                    'nome': arquivos[i][0], 'df': None, 'mapeamento': {}, 'mensagens': [],
+                    'erro': str(e) or type(e).__name__, 'tempo_s': None
+                }
+            resultados[i] = resultado
+            if ao_concluir is not None:
+                ao_concluir(resultado, concluidos, len(arquivos))
+        return resultados
+    finally:
+        if pool_proprio:
+            pool.shutdown()
+
+# Função para arredondar meio para cima até o inteiro
+def _inteiro_meio_para_cima(valores):
+    """
+    Arredonda para o inteiro mais próximo (meio para cima) e retorna int64.
+    O arredondamento prévio em 6 casas elimina o ruído binário (ex.: 2.675 * 100 = 267.4999...)
+    """
+    return np.floor(np.round(valores, 6) + 0.5).astype(np.int64)
+
+# Função para converter valores em reais para centavos inteiros
+def para_centavos(valores):
+    """
+    Converte valores em reais (float, int ou texto numérico) para int64 em centavos,
+    arredondando meio para cima; valores ausentes (NaN) viram 0
+    """
+    valores = np.asarray(valores, dtype=float)
+    return _inteiro_meio_para_cima(np.nan_to_num(valores * 100, nan=0.0))
+
+# Função para converter centavos inteiros para reais
+def de_centavos(centavos):
+    """
+    Converte int64 em centavos para float em reais (apenas para exibição e exportação:
+    o valor exato continua sendo o inteiro)
+    """
+    return np.asarray(centavos, dtype=np.int64) / 100
+
+# Função para calcular preços com desconto em lote, em centavos inteiros
+def calcular_precos_lote_centavos(precos_base, quantidades, descontos_percentuais=None, descontos_reais=None,
+                                  usar_descontos_reais=True):
+    """
+    Motor de precificação em centavos (int64), com as regras de arredondamento explícitas:
+    - preço com desconto por %: preço base × (100 − %) / 100, arredondado meio para cima por unidade
+    - preço com desconto em R$: preço base − desconto (ambos em centavos, exato)
+    - total da linha: preço com desconto × quantidade (inteiro, sem novo arredondamento)
+    - totais do pedido: soma inteira dos totais das linhas (sem arredondamento, sem deriva)
+    precos_base e descontos_reais em centavos; descontos_reais tem prioridade sobre o %
+    nas linhas em que usar_descontos_reais (booleano ou máscara por linha) é verdadeiro.
+    Retorna um dicionário de arrays int64 (e o desconto percentual efetivo em float)
+    """
+    precos_base = np.asarray(precos_base, dtype=np.int64)
+    quantidades = np.asarray(quantidades, dtype=np.int64)
+    precos_base, quantidades = np.broadcast_arrays(precos_base, quantidades)
+    
+    preco_com_desconto = precos_base.copy()
+    if descontos_percentuais is not None:
+        descontos_percentuais = np.asarray(descontos_percentuais, dtype=float)
+        preco_com_desconto = _inteiro_meio_para_cima(precos_base * (100 - descontos_percentuais) / 100)
+    if descontos_reais is not None:
+        descontos_reais = np.broadcast_to(np.asarray(descontos_reais, dtype=np.int64), precos_base.shape)
+        preco_com_desconto = np.where(usar_descontos_reais, precos_base - descontos_reais, preco_com_desconto)
+    preco_com_desconto = np.broadcast_to(preco_com_desconto, precos_base.shape)
+    
+    total_com_desconto = preco_com_desconto * quantidades
+    total_sem_desconto = precos_base * quantidades
+    desconto_unitario = precos_base - preco_com_desconto
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desconto_percentual = np.where(precos_base > 0, desconto_unitario / precos_base * 100, 0.0)
+    
+    return {
+        'preco_unitario_com_desconto': preco_com_desconto,
+        'total_com_desconto': total_com_desconto,
+        'total_sem_desconto': total_sem_desconto,
+        'desconto_total': total_sem_desconto - total_com_desconto,
+        'desconto_reais': desconto_unitario,
+        'desconto_percentual': desconto_percentual
+    }
+
+# Função para calcular preços com desconto em lote
+def calcular_precos_lote(precos_base, quantidades, descontos_percentuais=None, descontos_reais=None,
+                         tipos=None, precos_un=None):
+    """
+    Calcula todos os valores derivados de vários itens em uma única passada vetorizada,
+    com valores em reais na entrada e na saída (o cálculo é feito em centavos inteiros).
+    - descontos_percentuais: desconto em % por item
+    - descontos_reais: desconto em R$ por unidade vendida; quando não for NaN, tem prioridade sobre o %
+    - tipos/precos_un: se informados, itens do tipo 'UN' usam precos_un como preço base
+    Retorna um dicionário de arrays em reais, exatos ao centavo
+    """
+    precos_base = np.asarray(precos_base, dtype=float)
+    if tipos is not None and precos_un is not None:
+        precos_base = np.where(np.asarray(tipos) == 'UN', np.asarray(precos_un, dtype=float), precos_base)
+    
+    usar_descontos_reais = True
+    if descontos_reais is not None:
+        descontos_reais = np.asarray(descontos_reais, dtype=float)
+        usar_descontos_reais = ~np.isnan(descontos_reais)
+        descontos_reais = para_centavos(descontos_reais)
+    calculo = calcular_precos_lote_centavos(
+        para_centavos(precos_base), quantidades, descontos_percentuais, descontos_reais, usar_descontos_reais
+    )
+    return {
+        chave: valores if chave == 'desconto_percentual' else de_centavos(valores)
+        for chave, valores in calculo.items()
+    }
+
+# Função para extrair um único item do resultado em lote
+def _item_do_lote(calculo):
+    """
+    Converte a primeira posição do resultado em lote no dicionário de um item
+    """
+    return {
+        'preco_unitario_com_desconto': float(calculo['preco_unitario_com_desconto'][0]),
+        'total_com_desconto': float(calculo['total_com_desconto'][0]),
+        'total_sem_desconto': float(calculo['total_sem_desconto'][0]),
+        'desconto_total': float(calculo['desconto_total'][0])
+    }
+
+# Função para calcular preços com desconto
+def calcular_precos_com_desconto(preco_base, quantidade, desconto_percentual, tipo_preco='CX'):
+    """
+    Calcula preços com desconto aplicado (um item; usa a mesma regra de calcular_precos_lote)
+    """
+    return _item_do_lote(calcular_precos_lote([preco_base], [quantidade], descontos_percentuais=[desconto_percentual]))
+
+# Função para converter desconto em R$ para porcentagem
+def converter_desconto_reais_para_percentual(desconto_reais, preco_base):
+    """
+    Converte desconto em R$ para porcentagem
+    """
+    if preco_base > 0:
+        return (desconto_reais / preco_base) * 100
+    return 0
+
+# Função para calcular preço com desconto em R$
+def calcular_preco_com_desconto_reais(preco_base, desconto_reais, quantidade):
+    """
+    Calcula preço com desconto direto em R$ (um item; usa a mesma regra de calcular_precos_lote)
+    """
+    return _item_do_lote(calcular_precos_lote([preco_base], [quantidade], descontos_reais=[desconto_reais]))
+
+# Colunas do carrinho da simulação (valores monetários guardados em centavos int64)
+COLUNAS_CARRINHO_TEXTO = ['codigo', 'descricao', 'tipo', 'tipo_desconto', 'codtab']
+COLUNAS_CARRINHO_NUMERICAS = [
+    'quantidade', 'preco_base', 'desconto_percentual', 'desconto_reais',
+    'preco_com_desconto', 'total_com_desconto', 'total_sem_desconto', 'desconto_total'
+]
+COLUNAS_CARRINHO_CENTAVOS = [
+    'preco_base', 'desconto_reais', 'preco_com_desconto', 'total_com_desconto', 'total_sem_desconto', 'desconto_total'
+]
+
+# Função para criar o carrinho da simulação
+def criar_carrinho(capacidade=64):
+    """
+    Cria o carrinho em formato colunar: um array por coluna (com capacidade de reserva),
+    índice produto+tipo → linha para deduplicação e totais mantidos de forma incremental.
+    A coluna codtab guarda, como texto, a tabela de preços de onde veio o preço base da linha
+    """
+    colunas = {col: np.empty(capacidade, dtype=object) for col in COLUNAS_CARRINHO_TEXTO}
+    colunas.update({col: np.zeros(capacidade) for col in COLUNAS_CARRINHO_NUMERICAS})
+    for col in ['quantidade'] + COLUNAS_CARRINHO_CENTAVOS:
+        colunas[col] = np.zeros(capacidade, dtype=np.int64)
+    return {
+        'colunas': colunas,
+        'tamanho': 0,
+        'indice': {},
+        'totais': {'total_sem_desconto': 0, 'total_com_desconto': 0, 'desconto_total': 0},
+        'versao': 0
+    }
+
+# Função para acessar uma coluna do carrinho (somente as linhas ocupadas)
+def coluna_carrinho(carrinho, coluna):
+    """
+    Retorna a visão da coluna com as linhas ocupadas do carrinho (sem cópia);
+    colunas monetárias em centavos
+    """
+    return carrinho['colunas'][coluna][:carrinho['tamanho']]
+
+# Função para acessar uma coluna do carrinho em reais
+def coluna_carrinho_reais(carrinho, coluna):
+    """
+    Como coluna_carrinho, mas com as colunas monetárias convertidas para reais
+    """
+    valores = coluna_carrinho(carrinho, coluna)
+    return de_centavos(valores) if coluna in COLUNAS_CARRINHO_CENTAVOS else valores
+
+# Função para obter os totais do carrinho em reais
+def totais_carrinho(carrinho):
+    """
+    Totais do carrinho em reais (somas exatas em centavos convertidas só na saída)
+    """
+    return {total: float(de_centavos(valor)) for total, valor in carrinho['totais'].items()}
+
+# Função para somar/subtrair linhas dos totais do carrinho
+def _acumular_totais(carrinho, linhas, sinal):
+    """
+    Atualiza os totais incrementais com os valores das linhas (sinal +1 ou -1), em centavos inteiros
+    """
+    colunas = carrinho['colunas']
+    for total in carrinho['totais']:
+        carrinho['totais'][total] += sinal * int(np.sum(colunas[total][linhas]))
+
+# Função para recalcular os valores de linhas do carrinho
+def _recalcular_linhas(carrinho, linhas):
+    """
+    Recalcula preço e totais das linhas a partir de preço base, quantidade e desconto, em uma
+    única chamada vetorizada: linhas com desconto do tipo 'Reais' usam o desconto em R$ e as
+    demais o %, com a mesma regra de arredondamento da prévia (preço unitário com desconto).
+    O desconto em R$ das linhas por % passa a ser o efetivo, após o arredondamento
+    """
+    colunas = carrinho['colunas']
+    usar_descontos_reais = colunas['tipo_desconto'][linhas] == 'Reais'
+    calculo = calcular_precos_lote_centavos(
+        colunas['preco_base'][linhas],
+        colunas['quantidade'][linhas],
+        descontos_percentuais=colunas['desconto_percentual'][linhas],
+        descontos_reais=colunas['desconto_reais'][linhas],
+        usar_descontos_reais=usar_descontos_reais
+    )
+    colunas['desconto_reais'][linhas] = calculo['desconto_reais']
+    colunas['preco_com_desconto'][linhas] = calculo['preco_unitario_com_desconto']
+    colunas['total_com_desconto'][linhas] = calculo['total_com_desconto']
+    colunas['total_sem_desconto'][linhas] = calculo['total_sem_desconto']
+    colunas['desconto_total'][linhas] = calculo['desconto_total']
+
+# Função para garantir espaço nos arrays do carrinho
+def _garantir_capacidade(carrinho, tamanho):
+    """
+    Dobra a capacidade dos arrays até comportar o tamanho pedido
+    """
+    colunas = carrinho['colunas']
+    capacidade = len(colunas['quantidade'])
+    if tamanho <= capacidade:
+        return
+    while capacidade < tamanho:
+        capacidade *= 2
+    for col, valores in colunas.items():
+        novos = np.empty(capacidade, dtype=object) if valores.dtype == object \
+            else np.zeros(capacidade, dtype=valores.dtype)
+        novos[:carrinho['tamanho']] = valores[:carrinho['tamanho']]
+        colunas[col] = novos
+
+# Função para adicionar vários itens ao carrinho de uma vez
+@perfil.medir('carrinho_adicionar')
+def adicionar_itens_carrinho(carrinho, itens):
+    """
+    Adiciona vários itens (dicionário de listas/arrays com as chaves de um item) em uma operação.
+    A chave 'codtab' (tabela de preços do item) é opcional.
+    Itens de produto e tipo de venda já presentes têm as quantidades somadas e recebem o preço base,
+    a tabela e o desconto mais recentes (a linha é reprecificada, por exemplo após a troca da tabela de preços).
+    Os preços das linhas afetadas são recalculados em uma única passada vetorizada.
+    Retorna as linhas do carrinho correspondentes a cada item
+    """
+    colunas = carrinho['colunas']
+    indice = carrinho['indice']
+    tamanho_anterior = carrinho['tamanho']
+    
+    # Localizar (ou reservar) a linha de cada item pelo índice produto+tipo
+    linhas = np.empty(len(itens['codigo']), dtype=np.int64)
+    novos = []
+    tamanho = tamanho_anterior
+    for i, chave in enumerate(zip(map(str, itens['codigo']), itens['tipo'])):
+        linha = indice.get(chave)
+        if linha is None:
+            linha = indice[chave] = tamanho
+            tamanho += 1
+            novos.append(i)
+        linhas[i] = linha
+    
+    existentes = np.unique(linhas[linhas < tamanho_anterior])
+    _acumular_totais(carrinho, existentes, -1)
+    
+    _garantir_capacidade(carrinho, tamanho)
+    colunas = carrinho['colunas']
+    if novos:
+        linhas_novas = linhas[novos]
+        for col in ['codigo', 'descricao', 'tipo']:
+            colunas[col][linhas_novas] = np.asarray(itens[col], dtype=object)[novos]
+        colunas['quantidade'][linhas_novas] = 0
+    
+    np.add.at(colunas['quantidade'], linhas, np.asarray(itens['quantidade'], dtype=np.int64))
+    colunas['preco_base'][linhas] = para_centavos(itens['preco_base'])
+    codtabs = itens.get('codtab')
+    colunas['codtab'][linhas] = '' if codtabs is None else [
+        '' if codtab is None else str(codtab) for codtab in np.broadcast_to(np.asarray(codtabs, dtype=object), linhas.shape)
+    ]
+    colunas['desconto_percentual'][linhas] = np.asarray(itens['desconto_percentual'], dtype=float)
+    colunas['desconto_reais'][linhas] = para_centavos(itens['desconto_reais'])
+    colunas['tipo_desconto'][linhas] = np.asarray(itens['tipo_desconto'], dtype=object)
+    carrinho['tamanho'] = tamanho
+    
+    afetadas = np.unique(linhas)
+    _recalcular_linhas(carrinho, afetadas)
+    _acumular_totais(carrinho, afetadas, +1)
+    carrinho['versao'] += 1
+    return linhas
+
+# Função para adicionar um item ao carrinho
+def adicionar_item_carrinho(carrinho, item):
+    """
+    Adiciona um item ao carrinho. Se o mesmo produto e tipo de venda já estiver no carrinho,
+    as quantidades são somadas e o preço base e o desconto mais recentes são aplicados à linha.
+    Retorna a linha do item no carrinho
+    """
+    return int(adicionar_itens_carrinho(carrinho, {col: [valor] for col, valor in item.items()})[0])
+
+# Função para editar quantidade/desconto de um item do carrinho
+@perfil.medir('carrinho_editar')
+def editar_item_carrinho(carrinho, linha, quantidade=None, desconto_reais=None):
+    """
+    Altera a quantidade e/ou o desconto em R$ (em reais) de uma linha, atualizando os totais.
+    Informar o desconto em R$ passa a linha para o tipo de desconto 'Reais'
+    """
+    colunas = carrinho['colunas']
+    _acumular_totais(carrinho, linha, -1)
+    if quantidade is not None:
+        colunas['quantidade'][linha] = quantidade
+    if desconto_reais is not None:
+        colunas['desconto_reais'][linha] = para_centavos(desconto_reais)
+        colunas['tipo_desconto'][linha] = 'Reais'
+        colunas['desconto_percentual'][linha] = converter_desconto_reais_para_percentual(
+            int(colunas['desconto_reais'][linha]), int(colunas['preco_base'][linha])
+        )
+    _recalcular_linhas(carrinho, [linha])
+    _acumular_totais(carrinho, linha, +1)
+    carrinho['versao'] += 1
+
+# Função para remover um item do carrinho
+@perfil.medir('carrinho_remover')
+def remover_item_carrinho(carrinho, linha):
+    """
+    Remove a linha do carrinho, deslocando as linhas seguintes
+    """
+    colunas = carrinho['colunas']
+    tamanho = carrinho['tamanho']
+    _acumular_totais(carrinho, linha, -1)
+    for valores in colunas.values():
+        valores[linha:tamanho - 1] = valores[linha + 1:tamanho]
+    carrinho['tamanho'] = tamanho - 1
+    carrinho['indice'] = {
+        (str(codigo), tipo): i
+        for i, (codigo, tipo) in enumerate(zip(coluna_carrinho(carrinho, 'codigo'), coluna_carrinho(carrinho, 'tipo')))
+    }
+    carrinho['versao'] += 1
+
+# Função para exibir uma página do carrinho
+@perfil.medir('carrinho_pagina')
+def pagina_carrinho(carrinho, inicio, fim):
+    """
+    Monta o DataFrame formatado apenas com as linhas visíveis [inicio, fim)
+    """
+    fim = min(fim, carrinho['tamanho'])
+    colunas = {
+        col: de_centavos(valores[inicio:fim]) if col in COLUNAS_CARRINHO_CENTAVOS else valores[inicio:fim]
+        for col, valores in carrinho['colunas'].items()
+    }
+    return pd.DataFrame({
+        'Item': np.arange(inicio + 1, fim + 1),
+        'Código': colunas['codigo'],
+        'Descrição': colunas['descricao'],
+        'Tipo': colunas['tipo'],
+        'Qtd': colunas['quantidade'],
+        'Preço Base': [f"R$ {v:.2f}" for v in colunas['preco_base']],
+        'Desconto %': [f"{v:.1f}%" for v in colunas['desconto_percentual']],
+        'Desconto R$': [f"R$ {v:.2f}" for v in colunas['desconto_reais']],
+        'Tipo Desc.': colunas['tipo_desconto'],
+        'Preço c/ Desc': [f"R$ {v:.2f}" for v in colunas['preco_com_desconto']],
+        'Total': [f"R$ {v:.2f}" for v in colunas['total_com_desconto']]
+    })
+
+# Função para serializar o carrinho em formato compacto
+def serializar_carrinho(carrinho):
+    """
+    Grava as linhas ocupadas do carrinho como um .npz compactado: uma coluna por array,
+    números em int64/float e texto em largura fixa (sem pickle)
+    """
+    colunas = {}
+    for col in COLUNAS_CARRINHO_TEXTO:
+        valores = pd.Series(coluna_carrinho(carrinho, col), dtype=object).fillna('').astype(str)
+        colunas[col] = valores.to_numpy(dtype=str)
+    for col in COLUNAS_CARRINHO_NUMERICAS:
+        colunas[col] = coluna_carrinho(carrinho, col)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **colunas)
+    return buffer.getvalue()
+
+# Função para restaurar um carrinho serializado
+def restaurar_carrinho(dados):
+    """
+    Recria o carrinho a partir de serializar_carrinho: colunas, índice produto+tipo e totais
+    """
+    with np.load(io.BytesIO(dados), allow_pickle=False) as arquivo:
+        colunas = {col: arquivo[col] for col in arquivo.files}
+    tamanho = len(colunas['quantidade'])
+    carrinho = criar_carrinho(max(64, tamanho))
+    for col, valores in colunas.items():
+        if col in carrinho['colunas']:
+            carrinho['colunas'][col][:tamanho] = valores
+    carrinho['tamanho'] = tamanho
+    carrinho['indice'] = {
+        (str(codigo), tipo): i
+        for i, (codigo, tipo) in enumerate(zip(coluna_carrinho(carrinho, 'codigo'), coluna_carrinho(carrinho, 'tipo')))
+    }
+    _acumular_totais(carrinho, slice(0, tamanho), +1)
+    return carrinho
+
+# Colunas da exportação: nome no arquivo → coluna do carrinho
+COLUNAS_EXPORTACAO = {
+    'Código': 'codigo',
+    'Descrição': 'descricao',
+    'Tipo_Venda': 'tipo',
+    'Quantidade': 'quantidade',
+    'Preço_Base': 'preco_base',
+    'Desconto_Percentual': 'desconto_percentual',
+    'Desconto_Reais': 'desconto_reais',
+    'Tipo_Desconto': 'tipo_desconto',
+    'Preço_Com_Desconto': 'preco_com_desconto',
+    'Total_Com_Desconto': 'total_com_desconto'
+}
+
+# Função para montar o DataFrame de exportação
+def dataframe_exportacao(carrinho):
+    """
+    Monta o DataFrame de exportação diretamente das colunas do carrinho
+    """
+    return pd.DataFrame({nome: coluna_carrinho_reais(carrinho, col) for nome, col in COLUNAS_EXPORTACAO.items()})
+
+# Função para exportar o carrinho em CSV
+@perfil.medir('exportacao_csv')
+def exportar_csv(carrinho):
+    """
+    CSV com separador ';' e vírgula decimal (padrão das planilhas em português)
+    """
+    return dataframe_exportacao(carrinho).to_csv(index=False, decimal=',', sep=';').encode('utf-8')
+
+# Função para exportar o carrinho em XLSX
+@perfil.medir('exportacao_xlsx')
+def exportar_xlsx(carrinho):
+    """
+    XLSX gravado em modo streaming (openpyxl write_only): as linhas vão direto para o arquivo,
+    sem montar a planilha inteira em memória
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    planilha = workbook.create_sheet("Simulação")
+    planilha.append(list(COLUNAS_EXPORTACAO))
+    colunas = [coluna_carrinho_reais(carrinho, col).tolist() for col in COLUNAS_EXPORTACAO.values()]
+    for linha in zip(*colunas):
+        planilha.append(linha)
+    
+    saida = io.BytesIO()
+    workbook.save(saida)
+    return saida.getvalue()
+
+# Função para exportar o carrinho como orçamento para impressão
+@perfil.medir('exportacao_html')
+def exportar_orcamento_html(carrinho, cliente=None, tabela=None):
+    """
+    Orçamento em HTML pronto para impressão (ou "Salvar como PDF" no navegador)
+    """
+    def moeda(valor):
+        return f"R$ {valor:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    
+    def percentual(valor):
+        return f"{valor:.1f}%".replace('.', ',')
+    
+    linhas = []
+    colunas = [coluna_carrinho_reais(carrinho, col).tolist() for col in COLUNAS_EXPORTACAO.values()]
+    for item, (codigo, descricao, tipo, quantidade, preco_base, desconto_percentual, _, _, preco, total) \
+            in enumerate(zip(*colunas), start=1):
+        linhas.append(
+            f"<tr><td>{item}</td><td>{html.escape(str(codigo))}</td><td>{html.escape(str(descricao))}</td>"
+            f"<td>{html.escape(str(tipo))}</td><td class='n'>{quantidade}</td><td class='n'>{moeda(preco_base)}</td>"
+            f"<td class='n'>{percentual(desconto_percentual)}</td><td class='n'>{moeda(preco)}</td><td class='n'>{moeda(total)}</td></tr>"
+        )
+    
+    totais = totais_carrinho(carrinho)
+    cabecalho = [f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}"]
+    if cliente is not None:
+        cabecalho.append(f"Cliente: {html.escape(str(cliente))}")
+    if tabela is not None:
+        cabecalho.append(f"Tabela: {html.escape(str(tabela))}")
+    
+    return f"""<!DOCTYPE html>
+<html lang="pt-BR"><head><meta charset="utf-8"><title>Orçamento - Sadio</title>
+<style>
+body {{ font-family: Arial, sans-serif; font-size: 12px; margin: 24px; }}
+table {{ border-collapse: collapse; width: 100%; }}
+th, td {{ border-bottom: 1px solid #ccc; padding: 4px 6px; text-align: left; }}
+td.n, th.n {{ text-align: right; }}
+thead {{ display: table-header-group; }}
+tr {{ page-break-inside: avoid; }}
+.totais {{ margin-top: 16px; text-align: right; font-size: 14px; }}
+</style></head><body>
+<h2>Sadio | Orçamento Comercial</h2>
+<p>{' | '.join(cabecalho)}</p>
+<table><thead><tr><th>Item</th><th>Código</th><th>Descrição</th><th>Tipo</th><th class="n">Qtd</th>
+<th class="n">Preço Base</th><th class="n">Desc. %</th><th class="n">Preço c/ Desc</th><th class="n">Total</th></tr></thead>
+<tbody>
+{chr(10).join(linhas)}
+</tbody></table>
+<div class="totais">
+<p>Total sem desconto: {moeda(totais['total_sem_desconto'])}</p>
+<p>Desconto total: {moeda(totais['desconto_total'])}</p>
+<p><strong>Total com desconto: {moeda(totais['total_com_desconto'])}</strong></p>
+</div></body></html>""".encode('utf-8')
+
+# Formatos de exportação disponíveis
+EXPORTADORES = {
+    'csv': exportar_csv,
+    'xlsx': exportar_xlsx,
+    'html': exportar_orcamento_html
+}
+
+# Função para exportar o carrinho com memorização pela versão
+def exportar_carrinho(carrinho, formato, **opcoes):
+    """
+    Gera a exportação no formato pedido apenas uma vez por versão do carrinho;
+    chamadas seguintes com o carrinho inalterado devolvem os bytes já gerados
+    """
+    chave = (formato, carrinho['versao'], tuple(sorted(opcoes.items())))
+    memoria = carrinho.setdefault('exportacoes', {})
+    if memoria.get(formato, (None,))[0] != chave:
+        memoria[formato] = (chave, EXPORTADORES[formato](carrinho, **opcoes))
+    return memoria[formato][1]
+
+# Função para normalizar textos de busca (sem acentos, em maiúsculas)
+def normalizar_texto(serie):
+    """
+    Remove acentos e converte para maiúsculas, de forma vetorizada
+    """
+    return (
+        serie.fillna('').astype(str)
+        .str.normalize('NFKD')
+        .str.encode('ascii', errors='ignore')
+        .str.decode('ascii')
+        .str.upper()
+        .str.strip()
+    )
+
+# Função para normalizar um único texto digitado pelo usuário
+def normalizar_termo(texto):
+    """
+    Versão escalar de normalizar_texto, sem o custo de criar uma Series por consulta
+    """
+    texto = unicodedata.normalize('NFKD', str(texto))
+    return texto.encode('ascii', errors='ignore').decode('ascii').upper().strip()
+
+# Colunas de código usadas na busca exata
+COLUNAS_BUSCA_EXATA = ['EAN', 'DUN', 'Cod']
+
+# Função para construir o índice de busca de produtos
+@perfil.medir('indice_busca')
+def construir_indice_busca(df):
+    """
+    Monta o índice de busca da tabela carregada:
+    - índice invertido de bigramas/trigramas sobre descrição + códigos normalizados
+    - dicionários de busca exata para EAN, DUN e Cod
+    """
+    textos = normalizar_texto(df['Descrição'])
+    for col in COLUNAS_BUSCA_EXATA:
+        if col in df.columns:
+            textos = textos + ' ' + normalizar_texto(df[col])
+    textos = textos.to_numpy(dtype=str)
+    
+    ngramas = {}
+    for posicao, texto in enumerate(textos):
+        vistos = set()
+        for palavra in texto.split():
+            for n in (2, 3):
+                for inicio in range(len(palavra) - n + 1):
+                    vistos.add(palavra[inicio:inicio + n])
+        for ngrama in vistos:
+            ngramas.setdefault(ngrama, []).append(posicao)
+    ngramas = {ngrama: np.array(posicoes, dtype=np.int32) for ngrama, posicoes in ngramas.items()}
+    
+    exatos = {}
+    for col in COLUNAS_BUSCA_EXATA:
+        if col in df.columns:
+            for posicao, codigo in enumerate(normalizar_texto(df[col]).tolist()):
+                if codigo:
+                    exatos.setdefault(codigo, []).append(posicao)
+    
+    return {
+        'textos': textos,
+        'ngramas': ngramas,
+        'exatos': exatos,
+        'tamanho': len(textos)
+    }
+
+# Função para buscar produtos no índice
+@perfil.medir('busca')
+def buscar_produtos(indice, busca):
+    """
+    Retorna as posições dos produtos que contêm todos os termos buscados, ordenadas por relevância:
+    código exato, descrição começando pelo termo, palavra começando pelo termo e demais ocorrências
+    """
+    termos = normalizar_termo(busca).split()
+    if not termos:
+        return np.arange(indice['tamanho'])
+    
+    # Listas de n-gramas de todos os termos, da mais curta para a mais longa
+    listas = []
+    for termo in termos:
+        if len(termo) < 2:
+            continue
+        n = 2 if len(termo) == 2 else 3
+        for i in range(len(termo) - n + 1):
+            lista = indice['ngramas'].get(termo[i:i + n])
+            if lista is None:
+                return np.array([], dtype=np.int32)
+            listas.append(lista)
+    listas.sort(key=len)
+    
+    # Interseção só enquanto reduz bastante os candidatos; o restante é confirmado abaixo
+    candidatos = listas[0] if listas else np.arange(indice['tamanho'])
+    for lista in listas[1:]:
+        if len(candidatos) <= 256:
+            break
+        candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+    
+    # Confirmar as ocorrências e calcular a relevância, de forma vetorizada, apenas nos candidatos
+    textos = indice['textos'][candidatos]
+    encontrados = np.ones(len(candidatos), dtype=bool)
+    for termo in termos:
+        encontrados &= np.char.find(textos, termo) >= 0
+    candidatos = candidatos[encontrados]
+    textos = textos[encontrados]
+    
+    busca_completa = ' '.join(termos)
+    relevancia = np.full(len(candidatos), 3, dtype=np.int8)
+    relevancia[np.char.find(textos, ' ' + termos[0]) >= 0] = 2
+    relevancia[np.char.startswith(textos, busca_completa)] = 1
+    relevancia[np.isin(candidatos, indice['exatos'].get(busca_completa, []))] = 0
+    
+    return candidatos[np.lexsort((candidatos, relevancia))]
+
+# Colunas da grade de produtos que podem ser ordenadas
+COLUNAS_ORDENACAO_GRADE = ['Descrição', 'Cod', 'EAN', 'QTD', 'Preco CX', 'Preco UN', 'Grupo', 'Marca']
+
+# Função para pré-calcular as chaves de filtro e ordenação da grade de produtos
+@perfil.medir('chaves_grade')
+def construir_chaves_grade(df):
+    """
+    Pré-calcula, uma vez por tabela carregada, os códigos inteiros de Grupo e Marca
+    (filtro por comparação de inteiros) e a ordem completa de cada coluna ordenável.
+    Ordenar um subconjunto filtrado é só manter, na ordem completa, as posições que passaram no filtro
+    """
+    chaves = {'tamanho': len(df), 'filtros': {}, 'ordens': {}}
+    for coluna in ['Grupo', 'Marca']:
+        if coluna in df.columns:
+            try:
+                codigos, valores = pd.factorize(df[coluna], sort=True)
+            except TypeError:
+                # Tipos misturados (ex.: números e textos) não são ordenáveis entre si
+                codigos, valores = pd.factorize(df[coluna])
+            valores = valores.tolist()
+            chaves['filtros'][coluna] = {
+                'codigos': codigos.astype(np.int32),
+                'valores': valores,
+                'indice': {valor: codigo for codigo, valor in enumerate(valores)}
+            }
+    
+    for coluna in COLUNAS_ORDENACAO_GRADE:
+        if coluna in df.columns:
+            categorias = df[coluna].cat.categories if isinstance(df[coluna].dtype, pd.CategoricalDtype) else None
+            if categorias is not None and categorias.is_monotonic_increasing:
+                # Categorias já ordenadas: basta ordenar os códigos inteiros (ausentes, código -1, no fim)
+                codigos = df[coluna].cat.codes.to_numpy()
+                codigos = np.where(codigos < 0, len(categorias), codigos)
+                chaves['ordens'][coluna] = np.argsort(codigos, kind='stable').astype(np.int64)
+                continue
+            serie = pd.Series(df[coluna].to_numpy())
+            if not pd.api.types.is_numeric_dtype(serie):
+                serie = serie.where(serie.isna(), serie.astype(str))
+            chaves['ordens'][coluna] = serie.sort_values(kind='stable', na_position='last').index.to_numpy(dtype=np.int64)
+    return chaves
+
+# Função para filtrar e ordenar a grade de produtos por posições
+@perfil.medir('filtrar_grade')
+def filtrar_grade(chaves, posicoes=None, filtros=None, ordenar_por=None, decrescente=False):
+    """
+    Retorna as posições (na tabela base) das linhas que passam nos filtros, na ordem pedida, sem copiar a tabela.
+    posicoes: resultado da busca (em ordem de relevância), ou None para a tabela inteira.
+    filtros: {coluna: valor}, comparados pelos códigos pré-calculados.
+    Sem ordenação, mantém a ordem da busca ou a ordem original da tabela
+    """
+    mascara = None
+    for coluna, valor in (filtros or {}).items():
+        filtro = chaves['filtros'].get(coluna)
+        if filtro is None:
+            continue
+        codigo = filtro['indice'].get(valor)
+        if codigo is None:
+            return np.empty(0, dtype=np.int64)
+        selecionados = filtro['codigos'] == codigo
+        mascara = selecionados if mascara is None else mascara & selecionados
+    
+    if ordenar_por in chaves['ordens']:
+        ordem = chaves['ordens'][ordenar_por]
+        if decrescente:
+            ordem = ordem[::-1]
+        if posicoes is not None:
+            na_busca = np.zeros(chaves['tamanho'], dtype=bool)
+            na_busca[posicoes] = True
+            mascara = na_busca if mascara is None else mascara & na_busca
+        return ordem if mascara is None else ordem[mascara[ordem]]
+    
+    if posicoes is None:
+        return np.arange(chaves['tamanho']) if mascara is None else np.flatnonzero(mascara)
+    posicoes = np.asarray(posicoes, dtype=np.int64)
+    return posicoes if mascara is None else posicoes[mascara[posicoes]]
+
+# Função para montar uma página da grade de produtos
+def pagina_grade(df, posicoes, inicio, fim, colunas):
+    """
+    Retorna somente as linhas da página (posições inicio:fim) e as colunas pedidas:
+    apenas a página é copiada e enviada ao navegador
+    """
+    return df.iloc[posicoes[inicio:fim], [df.columns.get_loc(coluna) for coluna in colunas]]
+
+# Campos agregados nas estatísticas da tabela e sufixos das colunas de preço
+CAMPOS_ESTATISTICAS = ['Grupo', 'Marca', 'CODTAB']
+PRECOS_ESTATISTICAS = {'Preco CX': 'cx', 'Preco UN': 'un'}
+NOMES_AGREGACOES = {'count': 'n', 'sum': 'soma', 'min': 'min', 'max': 'max'}
+
+# Função para agregar os preços de uma tabela por um campo
+def _agregar_por_campo(df, campo):
+    """
+    Uma linha por valor do campo (inclusive vazio) com número de linhas e, para cada preço,
+    quantidade de valores, soma, mínimo e máximo (colunas linhas, n_cx, soma_cx, min_cx, max_cx, ...)
+    """
+    precos = [preco for preco in PRECOS_ESTATISTICAS if preco in df.columns]
+    agrupado = df.groupby(campo, sort=True, dropna=False)
+    agregado = agrupado[precos].agg(list(NOMES_AGREGACOES))
+    agregado.columns = [f"{NOMES_AGREGACOES[funcao]}_{PRECOS_ESTATISTICAS[preco]}" for preco, funcao in agregado.columns]
+    agregado.insert(0, 'linhas', agrupado.size())
+    if isinstance(agregado.index, pd.CategoricalIndex):
+        # Índice comum, para combinar agregados de tabelas com categorias diferentes
+        agregado.index = pd.Index(np.asarray(agregado.index), name=campo)
+    return agregado
+
+# Função para calcular as estatísticas de uma tabela carregada
+@perfil.medir('estatisticas_tabela')
+def calcular_estatisticas_tabela(df):
+    """
+    Agrega a tabela uma única vez por Grupo, Marca e CODTAB (os que existirem).
+    Guarda somas e contagens em vez de médias, para que as estatísticas possam ser
+    atualizadas de forma incremental e fatiadas sem voltar às linhas da tabela
+    """
+    return {'por': {campo: _agregar_por_campo(df, campo) for campo in CAMPOS_ESTATISTICAS if campo in df.columns}}
+
+# Função para somar ou subtrair agregados
+def _combinar_agregados(agregado, delta, sinal):
+    """
+    Soma (sinal=+1) ou subtrai (sinal=-1) contagens e somas; mínimos e máximos só são combinados na soma
+    """
+    indice = agregado.index.union(delta.index)
+    agregado = agregado.reindex(indice)
+    delta = delta.reindex(indice)
+    combinado = {}
+    for coluna in agregado.columns:
+        if coluna.startswith('min_') and sinal > 0:
+            combinado[coluna] = np.fmin(agregado[coluna], delta[coluna])
+        elif coluna.startswith('max_') and sinal > 0:
+            combinado[coluna] = np.fmax(agregado[coluna], delta[coluna])
+        elif coluna.startswith(('min_', 'max_')):
+            combinado[coluna] = agregado[coluna]
+        else:
+            combinado[coluna] = agregado[coluna].fillna(0) + sinal * delta[coluna].fillna(0)
+    return pd.DataFrame(combinado, index=indice)
+
+# Função para atualizar as estatísticas quando linhas entram ou saem da tabela
+@perfil.medir('estatisticas_tabela')
+def atualizar_estatisticas_tabela(estatisticas, novas=None, removidas=None, tabela=None):
+    """
+    Atualiza as estatísticas a partir apenas das linhas incluídas e/ou removidas.
+    Mínimos e máximos não podem ser desfeitos: os grupos em que uma linha removida era
+    o extremo são recalculados a partir da tabela já atualizada (obrigatória quando há remoções)
+    """
+    if removidas is not None and len(removidas) and tabela is None:
+        raise ValueError("A tabela atualizada é necessária para remover linhas das estatísticas")
+    
+    por = {}
+    for campo, agregado in estatisticas['por'].items():
+        if novas is not None and len(novas):
+            agregado = _combinar_agregados(agregado, _agregar_por_campo(novas, campo), +1)
+        
+        if removidas is not None and len(removidas):
+            delta = _agregar_por_campo(removidas, campo)
+            extremos = agregado.reindex(delta.index)
+            afetados = np.zeros(len(delta), dtype=bool)
+            for sufixo in PRECOS_ESTATISTICAS.values():
+                if f"min_{sufixo}" in delta.columns:
+                    afetados |= (delta[f"min_{sufixo}"] <= extremos[f"min_{sufixo}"]).to_numpy()
+                    afetados |= (delta[f"max_{sufixo}"] >= extremos[f"max_{sufixo}"]).to_numpy()
+            
+            agregado = _combinar_agregados(agregado, delta, -1)
+            agregado = agregado[agregado['linhas'] > 0]
+            valores_afetados = delta.index[afetados]
+            if len(valores_afetados):
+                recalculado = _agregar_por_campo(tabela[tabela[campo].isin(valores_afetados)], campo)
+                agregado = pd.concat([agregado.drop(recalculado.index, errors='ignore'), recalculado]).sort_index()
+        
+        agregado['linhas'] = agregado['linhas'].astype(np.int64)
+        por[campo] = agregado
+    return {'por': por}
+
+
+# Função para atualizar as estatísticas do catálogo de um lote quando arquivos entram ou saem
+def atualizar_estatisticas_lote(estatisticas, base_anterior, base, chaves_anteriores, chaves):
+    """
+    Estatísticas da base (linhas_catalogo) do lote chaves ((nome, chave), ...) a partir das do
+    lote chaves_anteriores, agregando só as linhas das tabelas (CODTAB = nome) acrescentadas
+    ou retiradas. Vale quando um lote começa pelo outro (arquivos acrescentados ou retirados no
+    fim): Grupo e Marca vêm da primeira tabela em que o produto aparece e não mudam nas tabelas
+    em comum. Nos demais casos retorna None (as estatísticas devem ser calculadas do zero)
+    """
+    comum = min(len(chaves_anteriores), len(chaves))
+    if tuple(chaves_anteriores[:comum]) != tuple(chaves[:comum]):
+        return None
+    acrescentadas = [nome for nome, _ in chaves[comum:]]
+    retiradas = [nome for nome, _ in chaves_anteriores[comum:]]
+    return atualizar_estatisticas_tabela(
+        estatisticas,
+        novas=base[base['CODTAB'].isin(acrescentadas)],
+        removidas=base_anterior[base_anterior['CODTAB'].isin(retiradas)],
+        tabela=base
+    )
+
+# Função para obter os valores distintos de um campo a partir das estatísticas
+def valores_distintos(estatisticas, campo):
+    """
+    Lista ordenada dos valores presentes do campo (sem vazios), sem percorrer a tabela
+    """
+    agregado = estatisticas['por'].get(campo)
+    if agregado is None:
+        return []
+    return agregado.index.dropna().tolist()
+
+# Função para resumir a tabela inteira a partir das estatísticas
+def resumo_estatisticas(estatisticas):
+    """
+    Totais da tabela (produtos, grupos, marcas, tabelas e preços mínimo/médio/máximo),
+    obtidos somando os agregados por Grupo
+    """
+    agregado = estatisticas['por']['Grupo']
+    resumo = {'produtos': int(agregado['linhas'].sum())}
+    for campo in CAMPOS_ESTATISTICAS:
+        if campo in estatisticas['por']:
+            resumo[f"distintos_{campo}"] = int(estatisticas['por'][campo].index.notna().sum())
+    for sufixo in PRECOS_ESTATISTICAS.values():
+        if f"n_{sufixo}" in agregado.columns:
+            quantidade = agregado[f"n_{sufixo}"].sum()
+            resumo[f"medio_{sufixo}"] = float(agregado[f"soma_{sufixo}"].sum() / quantidade) if quantidade else float('nan')
+            resumo[f"min_{sufixo}"] = float(agregado[f"min_{sufixo}"].min())
+            resumo[f"max_{sufixo}"] = float(agregado[f"max_{sufixo}"].max())
+    return resumo
+
+# Função para fatiar as estatísticas por um campo e um preço
+def fatia_estatisticas(estatisticas, campo, preco='Preco CX', valores=None):
+    """
+    Retorna, para cada valor do campo (ou só os valores pedidos), produtos e preço mínimo,
+    médio e máximo, usando apenas os agregados
+    """
+    agregado = estatisticas['por'][campo]
+    if valores:
+        agregado = agregado[agregado.index.isin(valores)]
+    sufixo = PRECOS_ESTATISTICAS[preco]
+    return pd.DataFrame({
+        campo: agregado.index,
+        'Produtos': agregado['linhas'].to_numpy(),
+        'Mínimo': agregado[f"min_{sufixo}"].to_numpy(),
+        'Médio': (agregado[f"soma_{sufixo}"] / agregado[f"n_{sufixo}"]).round(2).to_numpy(),
+        'Máximo': agregado[f"max_{sufixo}"].to_numpy()
+    })
+
+# Arquivos de tabela distribuídos junto com o aplicativo
+DIRETORIO_APP = os.path.dirname(os.path.abspath(__file__))
+CAMINHO_TABELA_PRODUTO = os.path.join(DIRETORIO_APP, 'tabela_produto.csv')
+CAMINHO_TABELA_PARCEIRO = os.path.join(DIRETORIO_APP, 'tabela_parceiro.csv')
+DIRETORIO_CACHE_TABELAS = os.path.join(DIRETORIO_APP, '.cache_tabelas')
+CAMINHO_TRACES_PERFIL = os.path.join(DIRETORIO_APP, 'perfil_execucoes.jsonl')
+CAMINHO_BANCO_SIMULACOES = os.path.join(DIRETORIO_APP, 'simulacoes.db')
+
+# Versão do formato do cache binário (alterar invalida os caches existentes)
+VERSAO_CACHE_TABELAS = 1
+
+# Função para identificar a versão do arquivo de origem
+def assinatura_arquivo(caminho):
+    """
+    Retorna tamanho e data de modificação do arquivo (verificação rápida de alteração)
+    """
+    info = os.stat(caminho)
+    return {'tamanho': info.st_size, 'mtime_ns': info.st_mtime_ns}
+
+# Função para ler os metadados do cache binário de uma tabela
+def ler_metadados_cache(diretorio_cache):
+    """
+    Retorna o conteúdo do meta.json do cache, ou None se ele não existir ou estiver incompleto
+    """
+    try:
+        with open(os.path.join(diretorio_cache, 'meta.json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+# Função para gravar o cache binário de uma tabela
+def gravar_cache_tabela(df, diretorio_cache, metadados):
+    """
+    Grava cada coluna como um arquivo .npy (texto em largura fixa) mais um meta.json.
+    A gravação é feita em um diretório temporário, publicado com dois os.replace: o cache
+    anterior sai e o novo entra. Um cache publicado está sempre completo, mas a troca não é
+    atômica: entre os dois passos o cache falta e quem o lê nesse intervalo volta a ler o CSV.
+    Se outro processo publicar o mesmo cache (mesma versão e hash) no meio da troca, a gravação
+    é considerada concluída. Os diretórios temporários são removidos mesmo em caso de erro
+    """
+    os.makedirs(os.path.dirname(diretorio_cache), exist_ok=True)
+    temporario = f"{diretorio_cache}.tmp{os.getpid()}_{threading.get_ident()}"
+    anterior = f"{temporario}.anterior"
+    shutil.rmtree(temporario, ignore_errors=True)
+    shutil.rmtree(anterior, ignore_errors=True)
+    os.makedirs(temporario)
+    
+    try:
+        colunas = []
+        for i, col in enumerate(df.columns):
+            serie = df[col]
+            if pd.api.types.is_numeric_dtype(serie):
+                tipo = 'numero'
+                valores = serie.to_numpy()
+            else:
+                # Texto vazio representa valores ausentes
+                tipo = 'texto'
+                valores = serie.fillna('').astype(str).to_numpy(dtype=str)
+            np.save(os.path.join(temporario, f"{i}.npy"), valores, allow_pickle=False)
+            colunas.append({'nome': str(col), 'tipo': tipo})
+        
+        with open(os.path.join(temporario, 'meta.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump(dict(metadados, colunas=colunas), arquivo, ensure_ascii=False)
+        
+        try:
+            os.replace(diretorio_cache, anterior)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(temporario, diretorio_cache)
+        except OSError:
+            # Outro processo publicou o cache entre os dois passos: vale se for o mesmo conteúdo
+            publicado = ler_metadados_cache(diretorio_cache)
+            if publicado is None or any(publicado.get(k) != metadados.get(k) for k in ('versao', 'hash')):
+                raise
+    finally:
+        shutil.rmtree(temporario, ignore_errors=True)
+        shutil.rmtree(anterior, ignore_errors=True)
+
+# Função para ler o cache binário de uma tabela
+def ler_cache_tabela(diretorio_cache, metadados):
+    """
+    Abre as colunas do cache com memory-map (sem cópia para colunas numéricas)
+    """
+    colunas = {}
+    for i, coluna in enumerate(metadados['colunas']):
+        valores = np.load(os.path.join(diretorio_cache, f"{i}.npy"), mmap_mode='r', allow_pickle=False)
+        if coluna['tipo'] == 'texto':
+            valores = pd.Series(valores).replace('', np.nan)
+        colunas[coluna['nome']] = valores
+    return pd.DataFrame(colunas, copy=False)
+
+# Função para ler uma tabela distribuída com o aplicativo usando o cache binário
+@perfil.medir('ler_tabela_com_cache')
+def ler_tabela_com_cache(caminho):
+    """
+    Lê uma tabela CSV distribuída com o aplicativo, usando o cache binário ao lado do CSV.
+    O cache é criado no primeiro uso e invalidado quando o CSV muda (data/tamanho e, se preciso, hash).
+    A tabela é devolvida em tipos compactos (compactar_tabela)
+    """
+    diretorio_cache = os.path.join(DIRETORIO_CACHE_TABELAS, os.path.basename(caminho))
+    caminho_meta = os.path.join(diretorio_cache, 'meta.json')
+    assinatura = assinatura_arquivo(caminho)
+    
+    metadados = ler_metadados_cache(diretorio_cache)
+    if metadados is not None and metadados.get('versao') != VERSAO_CACHE_TABELAS:
+        metadados = None
+    
+    if metadados is not None and all(metadados.get(k) == v for k, v in assinatura.items()):
+        try:
+            return compactar_tabela(ler_cache_tabela(diretorio_cache, metadados))
+        except (OSError, ValueError):
+            # Cache corrompido ou incompleto: reconstruir a partir do CSV
+            metadados = None
+    
+    with open(caminho, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    hash_arquivo = calcular_hash_arquivo(conteudo)
+    novos_metadados = dict(assinatura, versao=VERSAO_CACHE_TABELAS, hash=hash_arquivo)
+    
+    try:
+        if metadados is not None and metadados.get('hash') == hash_arquivo:
+            # Conteúdo igual (ex.: arquivo copiado ou "tocado"): só atualizar a assinatura
+            metadados.update(novos_metadados)
+            with open(caminho_meta, 'w', encoding='utf-8') as arquivo:
+                json.dump(metadados, arquivo, ensure_ascii=False)
+            return compactar_tabela(ler_cache_tabela(diretorio_cache, metadados))
+        
+        df = ler_csv(conteudo, detectar_dialeto_csv(conteudo))
+        gravar_cache_tabela(df, diretorio_cache, novos_metadados)
+        return compactar_tabela(df)
+    except OSError:
+        # Diretório somente leitura: seguir sem cache
+        return compactar_tabela(ler_csv(conteudo, detectar_dialeto_csv(conteudo)))
+
+# Função para criar o repositório de tabelas compartilhadas entre sessões
+def criar_repositorio_tabelas(max_tabelas_livres=8, ttl_sessao=4 * 3600):
+    """
+    Cria o repositório de tabelas (somente leitura) compartilhado por todas as sessões do processo.
+    Cada tabela guarda as sessões que a referenciam; tabelas sem referência ficam disponíveis
+    em ordem LRU e são descartadas além de max_tabelas_livres.
+    Sessões sem acesso há mais de ttl_sessao segundos deixam de contar como referência
+    """
+    return {
+        'tabelas': collections.OrderedDict(),
+        'referencias': {},
+        'travas_chave': {},
+        'trava': threading.Lock(),
+        'max_tabelas_livres': max_tabelas_livres,
+        'ttl_sessao': ttl_sessao
+    }
+
+# Função para descartar referências expiradas e tabelas livres excedentes
+def _despejar_tabelas(repositorio):
+    """
+    Chamada com a trava do repositório adquirida
+    """
+    limite = time.monotonic() - repositorio['ttl_sessao']
+    for sessoes in repositorio['referencias'].values():
+        for sessao in [s for s, ultimo_acesso in sessoes.items() if ultimo_acesso < limite]:
+            del sessoes[sessao]
+    
+    livres = [chave for chave in repositorio['tabelas'] if not repositorio['referencias'].get(chave)]
+    for chave in livres[:max(0, len(livres) - repositorio['max_tabelas_livres'])]:
+        del repositorio['tabelas'][chave]
+        repositorio['referencias'].pop(chave, None)
+        repositorio['travas_chave'].pop(chave, None)
+        logger.info("Tabela compartilhada descartada: %s", chave)
+
+# Função para obter (ou construir uma única vez) uma tabela compartilhada
+def obter_tabela_compartilhada(repositorio, chave, construir=None, sessao=None):
+    """
+    Retorna a tabela da chave. Se ainda não existir e construir for informado, ela é construída
+    uma única vez por processo (chamadas simultâneas para a mesma chave aguardam a primeira);
+    resultados None não são guardados. A sessão informada passa a referenciar a tabela.
+    A tabela retornada é compartilhada: não deve ser alterada no lugar
+    """
+    with repositorio['trava']:
+        valor = repositorio['tabelas'].get(chave)
+        trava_chave = repositorio['travas_chave'].setdefault(chave, threading.Lock())
+    
+    if valor is None and construir is not None:
+        with trava_chave:
+            with repositorio['trava']:
+                valor = repositorio['tabelas'].get(chave)
+            if valor is None:
+                valor = construir()
+                if valor is not None:
+                    with repositorio['trava']:
+                        repositorio['tabelas'][chave] = valor
+    
+    with repositorio['trava']:
+        if valor is None:
+            repositorio['travas_chave'].pop(chave, None)
+            return None
+        if chave in repositorio['tabelas']:
+            repositorio['tabelas'].move_to_end(chave)
+        if sessao is not None:
+            repositorio['referencias'].setdefault(chave, {})[sessao] = time.monotonic()
+        _despejar_tabelas(repositorio)
+    return valor
+
+# Função para retirar a referência de uma sessão a uma tabela compartilhada
+def liberar_tabela_compartilhada(repositorio, chave, sessao):
+    """
+    A sessão deixou de usar a tabela (ex.: trocou de tabela); sem outras referências,
+    a tabela passa a ser candidata a descarte
+    """
+    with repositorio['trava']:
+        repositorio['referencias'].get(chave, {}).pop(sessao, None)
+        _despejar_tabelas(repositorio)
+
+# Função para resumir o conteúdo do repositório de tabelas
+def resumo_repositorio_tabelas(repositorio):
+    """
+    Retorna uma linha por tabela com o número de sessões que a referenciam, linhas e memória (MB)
+    """
+    with repositorio['trava']:
+        itens = [(chave, valor, len(repositorio['referencias'].get(chave, {}))) for chave, valor in repositorio['tabelas'].items()]
+    
+    linhas = []
+    for chave, valor, sessoes in itens:
+        df = valor[0] if isinstance(valor, tuple) else valor
+        linhas.append({
+            'Tabela': chave if len(chave) <= 24 else chave[:12] + '…',
+            'Sessões': sessoes,
+            'Linhas': len(df),
+            'Memória (MB)': round(memoria_tabela_mb(df), 2)
+        })
+    return linhas
+
+# Função para montar o catálogo de preços multi-tabela
+@perfil.medir('construir_catalogo')
+def construir_catalogo(df_produto):
+    """
+    Monta o catálogo em formato colunar a partir da tabela_produto.csv:
+    uma matriz produto × tabela (CODTAB) indexada por códigos categóricos.
+    Preço de um produto em uma tabela é um acesso O(1) e uma tabela inteira é uma coluna da matriz.
+    Grupo e marca vêm das colunas GRUPO/MARCA quando existem; a tabela_produto.csv não as tem,
+    e nela são a primeira e a última palavra da descrição
+    """
+    produtos = pd.Categorical(df_produto['CODPROD'])
+    tabelas = pd.Categorical(df_produto['CODTAB'])
+    linhas = produtos.codes
+    colunas = tabelas.codes
+    formato = (len(produtos.categories), len(tabelas.categories))
+    
+    # Produtos ausentes em uma tabela ficam como NaN
+    preco_un = np.full(formato, np.nan)
+    preco_cx = np.full(formato, np.nan)
+    preco_un[linhas, colunas] = df_produto['PRECO_UNITARIO'].to_numpy(dtype=float)
+    preco_cx[linhas, colunas] = df_produto['PRECO_CX'].to_numpy(dtype=float)
+    preco_un.setflags(write=False)
+    preco_cx.setflags(write=False)
+    
+    # Atributos do produto são iguais em todas as tabelas: usar a primeira ocorrência
+    _, primeira_ocorrencia = np.unique(linhas, return_index=True)
+    atributos = df_produto.iloc[primeira_ocorrencia]
+    palavras = atributos['DESCRPROD'].str.split()
+    grupo = atributos['GRUPO'] if 'GRUPO' in atributos.columns else palavras.str[0]
+    marca = atributos['MARCA'] if 'MARCA' in atributos.columns else palavras.str[-1]
+    
+    codigos_produto = produtos.categories.to_numpy()
+    codigos_tabela = tabelas.categories.to_numpy()
+    
+    return {
+        'codigos_produto': codigos_produto,
+        'codigos_tabela': codigos_tabela,
+        'indice_produto': {codigo: i for i, codigo in enumerate(codigos_produto.tolist())},
+        'indice_tabela': {codigo: j for j, codigo in enumerate(codigos_tabela.tolist())},
+        'ean': atributos['REFERENCIA'].fillna('').to_numpy(),
+        'descricao': atributos['DESCRPROD'].to_numpy(),
+        'grupo': pd.Categorical(grupo.to_numpy(dtype=object)),
+        'marca': pd.Categorical(marca.to_numpy(dtype=object)),
+        'quantidade': atributos['QUANTIDADE'].to_numpy(),
+        'preco_un': preco_un,
+        'preco_cx': preco_cx
+    }
+
+# Função para consultar o preço de um produto em uma tabela
+def preco_produto_tabela(catalogo, codigo_produto, codtab, tipo_preco='CX'):
+    """
+    Retorna o preço do produto na tabela (CX ou UN), ou None se não houver preço
+    """
+    i = catalogo['indice_produto'].get(codigo_produto)
+    j = catalogo['indice_tabela'].get(codtab)
+    if i is None or j is None:
+        return None
+    matriz = catalogo['preco_cx'] if tipo_preco == 'CX' else catalogo['preco_un']
+    preco = matriz[i, j]
+    return None if np.isnan(preco) else float(preco)
+
+# Função para obter todos os preços de uma tabela
+@perfil.medir('precos_tabela')
+def precos_tabela(catalogo, codtab):
+    """
+    Retorna a tabela de preços no formato do simulador (Cod, EAN, Descrição, QTD, Preco CX, Preco UN, Grupo, Marca).
+    Produtos sem preço na tabela são omitidos.
+    """
+    j = catalogo['indice_tabela'][codtab]
+    preco_cx = catalogo['preco_cx'][:, j]
+    preco_un = catalogo['preco_un'][:, j]
+    disponiveis = np.flatnonzero(preco_cx > 0)
+    
+    return pd.DataFrame({
+        'Cod': catalogo['codigos_produto'][disponiveis],
+        'EAN': catalogo['ean'][disponiveis],
+        'Descrição': catalogo['descricao'][disponiveis],
+        'QTD': catalogo['quantidade'][disponiveis],
+        'Preco CX': preco_cx[disponiveis],
+        'Preco UN': preco_un[disponiveis],
+        'Grupo': catalogo['grupo'][disponiveis],
+        'Marca': catalogo['marca'][disponiveis]
+    })
+
+# Função para obter todas as combinações produto × tabela com preço
+def linhas_catalogo(catalogo):
+    """
+    Retorna o catálogo inteiro em formato longo (uma linha por produto em cada CODTAB com preço),
+    montado por indexação vetorizada da matriz
+    """
+    produtos, tabelas = np.nonzero(catalogo['preco_cx'] > 0)
+    return pd.DataFrame({
+        'Cod': catalogo['codigos_produto'][produtos],
+        'Descrição': catalogo['descricao'][produtos],
+        'Grupo': catalogo['grupo'][produtos],
+        'Marca': catalogo['marca'][produtos],
+        'CODTAB': pd.Categorical.from_codes(tabelas, categories=catalogo['codigos_tabela']),
+        'Preco CX': catalogo['preco_cx'][produtos, tabelas]
+    })
+
+# Função para reunir várias tabelas de preços em um catálogo
+@perfil.medir('catalogo_de_tabelas')
+def catalogo_de_tabelas(tabelas):
+    """
+    Monta um catálogo (mesmo formato de construir_catalogo) a partir de tabelas no formato
+    do simulador, {nome da tabela: DataFrame}: o nome faz o papel do CODTAB e o produto é
+    identificado pelo Cod (ou pelo EAN, se a tabela não tiver Cod). Grupo e Marca são os
+    das próprias tabelas (Marca vazia nas tabelas que não têm a coluna)
+    """
+    partes = []
+    for nome, tabela in tabelas.items():
+        codigos = tabela['Cod'] if 'Cod' in tabela.columns else tabela['EAN']
+        partes.append(pd.DataFrame({
+            'CODPROD': normalizar_codigos(codigos).to_numpy(),
+            'CODTAB': nome,
+            'PRECO_UNITARIO': tabela['Preco UN'].to_numpy(dtype=float),
+            'PRECO_CX': tabela['Preco CX'].to_numpy(dtype=float),
+            'DESCRPROD': tabela['Descrição'].astype(str).to_numpy(),
+            'REFERENCIA': tabela['EAN'].to_numpy() if 'EAN' in tabela.columns else '',
+            'QUANTIDADE': tabela['QTD'].to_numpy(),
+            'GRUPO': tabela['Grupo'].to_numpy(dtype=object),
+            'MARCA': tabela['Marca'].to_numpy(dtype=object) if 'Marca' in tabela.columns else None
+        }))
+    return construir_catalogo(pd.concat(partes, ignore_index=True))
+
+# Campos aceitos nas regras de cenário
+CAMPOS_REGRA_CENARIO = ['CODTAB', 'Grupo', 'Marca', 'Cod']
+
+# Função para aplicar um cenário de descontos a uma tabela inteira
+@perfil.medir('aplicar_cenario')
+def aplicar_cenario(base, regras, quantidade=1):
+    """
+    Aplica regras de desconto a todas as linhas da base em uma única passada vetorizada.
+    Cada regra é um dicionário {'CODTAB': [...], 'Grupo': [...], 'Marca': [...], 'Cod': [...], 'desconto_percentual': x};
+    os campos informados são combinados com E, e regras posteriores prevalecem sobre as anteriores.
+    Retorna a base com as colunas de desconto e totais (quantidade de referência por linha, em caixas)
+    """
+    descontos = np.zeros(len(base))
+    codigos_base = None
+    for regra in regras:
+        mascara = np.ones(len(base), dtype=bool)
+        for campo in CAMPOS_REGRA_CENARIO:
+            valores = regra.get(campo)
+            if not valores or campo not in base.columns:
+                continue
+            if campo == 'Cod':
+                # Códigos comparados como texto normalizado (a lista pode vir digitada)
+                if codigos_base is None:
+                    codigos_base = normalizar_codigos(base['Cod'])
+                mascara &= codigos_base.isin(normalizar_codigos(pd.Series(valores, dtype=object))).to_numpy()
+            else:
+                mascara &= base[campo].isin(valores).to_numpy()
+        descontos[mascara] = regra['desconto_percentual']
+    
+    calculo = calcular_precos_lote(base['Preco CX'].to_numpy(), quantidade, descontos_percentuais=descontos)
+    resultado = base.assign(**{
+        'Desconto %': descontos,
+        'Preço c/ Desc': calculo['preco_unitario_com_desconto'],
+        'Total sem Desconto': calculo['total_sem_desconto'],
+        'Total com Desconto': calculo['total_com_desconto'],
+        'Desconto Total': calculo['desconto_total']
+    })
+    return resultado[descontos > 0]
+
+# Função para ler uma lista de códigos digitada
+def ler_lista_codigos(texto):
+    """
+    Separa os códigos digitados (separados por vírgula, ponto e vírgula, espaço ou linha)
+    """
+    return [codigo for codigo in re.split(r'[\s,;]+', texto or '') if codigo]
+
+# Função para resumir um cenário por um campo
+def resumir_cenario(resultado, campo):
+    """
+    Soma receita e desconto do cenário agrupados pelo campo (ex.: CODTAB ou Grupo)
+    """
+    resumo = resultado.groupby(campo, observed=True).agg(
+        SKUs=('Preco CX', 'size'),
+        **{
+            'Total sem Desconto': ('Total sem Desconto', 'sum'),
+            'Total com Desconto': ('Total com Desconto', 'sum'),
+            'Desconto Total': ('Desconto Total', 'sum')
+        }
+    )
+    return resumo.sort_values('Desconto Total', ascending=False)
+
+# Função para localizar itens no catálogo pelo código (Cod) ou, na falta dele, pelo EAN
+def posicoes_catalogo(catalogo, codigos):
+    """
+    Retorna a linha do catálogo de cada código (-1 para códigos não encontrados)
+    """
+    codigos = normalizar_codigos(pd.Series(np.asarray(codigos, dtype=object)))
+    posicoes = pd.Index(normalizar_codigos(pd.Series(catalogo['codigos_produto']))).get_indexer(codigos)
+    ausentes = posicoes < 0
+    if ausentes.any():
+        eans = normalizar_codigos(pd.Series(catalogo['ean']))
+        unicos = ~eans.duplicated().to_numpy() & (eans != '').to_numpy()
+        linhas_ean = np.flatnonzero(unicos)
+        por_ean = pd.Index(eans[unicos]).get_indexer(codigos[ausentes])
+        posicoes[ausentes] = np.where(por_ean >= 0, linhas_ean[por_ean], -1)
+    return posicoes
+
+# Função para precificar uma cesta de itens em todas as tabelas do catálogo
+@perfil.medir('comparar_cesta_tabelas')
+def comparar_cesta_tabelas(catalogo, codigos, tipos, quantidades, descontos_percentuais=None):
+    """
+    Precifica a cesta em todas as tabelas (CODTAB) de uma vez: a submatriz itens × tabelas
+    do catálogo passa por uma única chamada do motor em centavos, com o desconto % de cada item.
+    Itens vendidos por unidade ('Unidade'/'UN') usam o preço unitário.
+    Retorna um DataFrame por CODTAB com itens sem preço, totais (reais) e a diferença para a
+    mais barata entre as comparáveis (as de maior cobertura da cesta), das comparáveis mais
+    baratas para as de menor cobertura
+    """
+    tamanho = len(quantidades)
+    posicoes = posicoes_catalogo(catalogo, codigos)
+    achados = posicoes >= 0
+    unidade = pd.Series(np.asarray(tipos, dtype=object)).astype(str).str.upper().str.startswith('UN').to_numpy()
+    
+    # Submatriz de preços (itens × tabelas); itens não encontrados ficam sem preço em todas as tabelas
+    linhas = np.where(achados, posicoes, 0)
+    precos = np.where(unidade[:, None], catalogo['preco_un'][linhas], catalogo['preco_cx'][linhas])
+    precos[~achados] = np.nan
+    com_preco = precos > 0
+    
+    if descontos_percentuais is None:
+        descontos_percentuais = np.zeros(tamanho)
+    calculo = calcular_precos_lote_centavos(
+        np.where(com_preco, para_centavos(precos), 0),
+        np.asarray(quantidades, dtype=np.int64)[:, None],
+        descontos_percentuais=np.asarray(descontos_percentuais, dtype=float)[:, None]
+    )
+    total_sem_desconto = calculo['total_sem_desconto'].sum(axis=0)
+    total_com_desconto = calculo['total_com_desconto'].sum(axis=0)
+    itens_sem_preco = tamanho - com_preco.sum(axis=0)
+    
+    comparaveis = itens_sem_preco == itens_sem_preco.min()
+    referencia = total_com_desconto[comparaveis].min()
+    comparacao = pd.DataFrame({
+        'CODTAB': catalogo['codigos_tabela'],
+        'Itens sem Preço': itens_sem_preco,
+        'Total sem Desconto': de_centavos(total_sem_desconto),
+        'Total com Desconto': de_centavos(total_com_desconto),
+        'Desconto Total': de_centavos(total_sem_desconto - total_com_desconto),
+        'Diferença vs Menor': np.where(comparaveis, de_centavos(total_com_desconto - referencia), np.nan),
+        'Comparável': comparaveis
+    })
+    return comparacao.sort_values(['Itens sem Preço', 'Total com Desconto'], ignore_index=True)
+
+# Função para montar o índice de clientes (parceiros)
+def construir_indice_parceiros(df_parceiro):
+    """
+    Monta os índices da tabela_parceiro.csv: cliente → CODTAB e
+    vendedor/cidade/grupo → posições dos clientes, todos como dicionários (consulta O(1))
+    """
+    ids = df_parceiro['ID_CLIENTE'].to_numpy()
+    codtab = df_parceiro['CODTAB'].to_numpy(dtype=float)
+    vendedor = df_parceiro['VENDEDOR'].str.strip().fillna('')
+    cidade = df_parceiro['CIDADE'].str.strip().str.upper().fillna('')
+    grupo = df_parceiro['GRUPODESC'].fillna('').str.strip()
+    
+    return {
+        'ids': ids,
+        'fantasia': df_parceiro['FANTASIA'].fillna('').to_numpy(),
+        'vendedor': vendedor.to_numpy(),
+        'cidade': cidade.to_numpy(),
+        'grupo': grupo.to_numpy(),
+        'posicao_cliente': {cliente: i for i, cliente in enumerate(ids.tolist())},
+        'cliente_codtab': {
+            cliente: int(tabela) for cliente, tabela in zip(ids.tolist(), codtab.tolist()) if not np.isnan(tabela)
+        },
+        'por_vendedor': {k: v for k, v in vendedor.groupby(vendedor).indices.items() if k},
+        'por_cidade': {k: v for k, v in cidade.groupby(cidade).indices.items() if k},
+        'por_grupo': {k: v for k, v in grupo.groupby(grupo).indices.items() if k}
+    }
+
+# Função para filtrar clientes pelos índices
+def filtrar_clientes(parceiros, vendedor=None, cidade=None, grupo=None):
+    """
+    Retorna as posições dos clientes que atendem aos filtros (interseção dos índices)
+    """
+    posicoes = None
+    for indice, valor in [('por_vendedor', vendedor), ('por_cidade', cidade), ('por_grupo', grupo)]:
+        if valor is None:
+            continue
+        encontrados = parceiros[indice].get(valor, np.array([], dtype=np.intp))
+        posicoes = encontrados if posicoes is None else np.intersect1d(posicoes, encontrados)
+    if posicoes is None:
+        return np.arange(len(parceiros['ids']))
+    return posicoes
+
+# Função para descrever um cliente na lista de seleção
+def descrever_cliente(parceiros, posicao):
+    """
+    Texto exibido no seletor de clientes
+    """
+    return f"{parceiros['ids'][posicao]} - {parceiros['fantasia'][posicao]} ({parceiros['cidade'][posicao]})"
+
+# Padrões de nomes de colunas em arquivos de pedido
+PADROES_COLUNAS_PEDIDO = {
+    'codigo': ['ean', 'dun', 'cod', 'código', 'codigo', 'referencia', 'codprod'],
+    'quantidade': ['quantidade', 'qtd', 'qtde', 'quant', 'qty'],
+    'tipo': ['tipo'],
+    'desconto': ['desconto', 'desc %', 'desc%']
+}
+
+# Colunas da tabela de preços usadas para localizar os itens do pedido, em ordem de prioridade
+COLUNAS_JUNCAO_PEDIDO = ['EAN', 'DUN', 'Cod']
+
+# Faixa de desconto (%) aceita nas linhas do pedido, a mesma do configurador de desconto
+DESCONTO_MINIMO_PEDIDO = 0.0
+DESCONTO_MAXIMO_PEDIDO = 50.0
+
+# Função para normalizar códigos de produto para comparação
+def normalizar_codigos(serie):
+    """
+    Converte códigos para texto comparável: sem espaços, sem '.0' de planilhas e sem zeros à esquerda
+    """
+    return (
+        serie.astype(str)
+        .str.strip()
+        .str.replace(r'\.0$', '', regex=True)
+        .str.lstrip('0')
+    )
+
+# Função para ler uma planilha simples (cabeçalho na primeira linha)
+def ler_planilha_simples(conteudo, nome_arquivo):
+    """
+    Lê um CSV (formato detectado automaticamente) ou XLSX com o cabeçalho na primeira linha
+    """
+    if nome_arquivo.lower().endswith('.xlsx'):
+        df = pd.read_excel(io.BytesIO(conteudo), engine='openpyxl', dtype=object)
+    else:
+        df = ler_csv(conteudo, detectar_dialeto_csv(conteudo))
+    df.columns = [str(col).strip() for col in df.columns]
+    return df
+
+# Função para identificar as colunas de uma planilha pelos nomes
+def identificar_colunas(colunas_disponiveis, padroes_por_papel):
+    """
+    Para cada papel, escolhe a primeira coluna com nome igual a um dos padrões ou, na falta,
+    que contenha um deles. Cada coluna é usada por um único papel (na ordem dos papéis)
+    """
+    colunas = {}
+    livres = list(colunas_disponiveis)
+    for papel, padroes in padroes_por_papel.items():
+        colunas[papel] = next(
+            (col for padrao in padroes for col in livres if col.lower() == padrao),
+            next((col for padrao in padroes for col in livres if padrao in col.lower()), None)
+        )
+        if colunas[papel] is not None:
+            livres.remove(colunas[papel])
+    return colunas
+
+# Função para ler um arquivo de pedido
+@perfil.medir('ler_pedido')
+def ler_pedido(conteudo, nome_arquivo):
+    """
+    Lê um pedido em CSV ou XLSX (cabeçalho na primeira linha) e identifica as colunas de código,
+    quantidade, tipo de venda e desconto (%).
+    Retorna (DataFrame, {'codigo': col, 'quantidade': col, 'tipo': col ou None, 'desconto': col ou None})
+    """
+    df = ler_planilha_simples(conteudo, nome_arquivo)
+    colunas = identificar_colunas(df.columns, PADROES_COLUNAS_PEDIDO)
+    if colunas['codigo'] is None or colunas['quantidade'] is None:
+        raise ValueError(f"Pedido sem coluna de código ou quantidade. Colunas: {list(df.columns)}")
+    return df, colunas
+
+# Função para precificar um pedido contra a tabela carregada
+@perfil.medir('precificar_pedido')
+def precificar_pedido(tabela, pedido, colunas, desconto_percentual=0.0):
+    """
+    Localiza cada linha do pedido na tabela (hash join por EAN, DUN ou Cod, nessa ordem)
+    e calcula todos os preços em uma única passada vetorizada.
+    O desconto da coluna de desconto do pedido (%) prevalece; linhas sem desconto usam desconto_percentual.
+    Linhas com quantidade ausente, não numérica ou que não é um inteiro positivo, ou com desconto
+    fora da faixa DESCONTO_MINIMO_PEDIDO a DESCONTO_MAXIMO_PEDIDO, não são precificadas.
+    Retorna (DataFrame precificado no formato de exportação, linhas do pedido não encontradas,
+    linhas do pedido com quantidade ou desconto inválido)
+    """
+    codigos_pedido = normalizar_codigos(pedido[colunas['codigo']])
+    posicoes = np.full(len(pedido), -1, dtype=np.int64)
+    for col in COLUNAS_JUNCAO_PEDIDO:
+        if col not in tabela.columns:
+            continue
+        codigos_tabela = normalizar_codigos(tabela[col])
+        unicos = ~codigos_tabela.duplicated()
+        indice = pd.Index(codigos_tabela[unicos])
+        encontrados = indice.get_indexer(codigos_pedido)
+        originais = np.flatnonzero(unicos.to_numpy())
+        pendentes = (posicoes < 0) & (encontrados >= 0)
+        posicoes[pendentes] = originais[encontrados[pendentes]]
+    
+    quantidades_pedido = converter_decimal(pedido[colunas['quantidade']]).to_numpy(dtype=float)
+    validas = (quantidades_pedido > 0) & (quantidades_pedido == np.floor(quantidades_pedido))
+    
+    descontos_pedido = np.full(len(pedido), float(desconto_percentual))
+    if colunas.get('desconto') is not None:
+        informados = converter_decimal(
+            pedido[colunas['desconto']].astype(str).str.replace('%', '', regex=False)
+        ).to_numpy(dtype=float)
+        descontos_pedido = np.where(np.isnan(informados), descontos_pedido, informados)
+    validas &= (descontos_pedido >= DESCONTO_MINIMO_PEDIDO) & (descontos_pedido <= DESCONTO_MAXIMO_PEDIDO)
+    
+    encontrados_pedido = posicoes >= 0
+    achados = encontrados_pedido & validas
+    linhas = posicoes[achados]
+    quantidades = quantidades_pedido[achados].astype(np.int64)
+    tipos = np.full(len(linhas), 'CX', dtype=object)
+    if colunas.get('tipo') is not None:
+        tipos = np.where(
+            pedido[colunas['tipo']].astype(str).str.upper().str.startswith('UN').to_numpy()[achados], 'UN', 'CX'
+        )
+    
+    descontos = descontos_pedido[achados]
+    
+    precos_cx = tabela['Preco CX'].to_numpy(dtype=float)[linhas]
+    precos_un = tabela['Preco UN'].to_numpy(dtype=float)[linhas]
+    calculo = calcular_precos_lote(
+        precos_cx, quantidades, descontos_percentuais=descontos, tipos=tipos, precos_un=precos_un
+    )
+    codigo_tabela = 'Cod' if 'Cod' in tabela.columns else 'EAN'
+    
+    precificado = pd.DataFrame({
+        'Código': tabela[codigo_tabela].to_numpy()[linhas],
+        'Descrição': tabela['Descrição'].to_numpy()[linhas],
+        'Tipo_Venda': np.where(tipos == 'UN', 'Unidade', 'Caixa'),
+        'Quantidade': quantidades,
+        'Preço_Base': np.where(tipos == 'UN', precos_un, precos_cx),
+        'Desconto_Percentual': descontos,
+        'Desconto_Reais': calculo['desconto_reais'],
+        'Tipo_Desconto': 'Porcentagem',
+        'Preço_Com_Desconto': calculo['preco_unitario_com_desconto'],
+        'Total_Com_Desconto': calculo['total_com_desconto']
+    })
+    return precificado, pedido[~encontrados_pedido], pedido[encontrados_pedido & ~validas]
+
+# Função para converter um pedido precificado em itens do carrinho
+def itens_de_pedido(precificado, codtab=None):
+    """
+    Converte o resultado de precificar_pedido no formato aceito por adicionar_itens_carrinho
+    (codtab: tabela de preços usada na precificação)
+    """
+    return {
+        'codigo': precificado['Código'].to_numpy(),
+        'descricao': precificado['Descrição'].to_numpy(),
+        'tipo': precificado['Tipo_Venda'].to_numpy(),
+        'quantidade': precificado['Quantidade'].to_numpy(),
+        'preco_base': precificado['Preço_Base'].to_numpy(),
+        'desconto_percentual': precificado['Desconto_Percentual'].to_numpy(),
+        'desconto_reais': precificado['Desconto_Reais'].to_numpy(),
+        'tipo_desconto': precificado['Tipo_Desconto'].to_numpy(),
+        'codtab': codtab
+    }
+
+# Arquivo opcional de custos distribuído junto com o aplicativo
+CAMINHO_TABELA_CUSTO = os.path.join(DIRETORIO_APP, 'tabela_custo.csv')
+
+# Padrões de nomes de coluna da tabela de custos (papéis mais específicos primeiro)
+PADROES_COLUNAS_CUSTO = {
+    'codigo': ['codprod', 'cod', 'código', 'codigo', 'referencia', 'ean'],
+    'custo_un': ['custo un', 'custo_un', 'custo unitario', 'custo unitário'],
+    'piso_un': ['preco minimo un', 'preco_minimo_un', 'preço mínimo un', 'piso un', 'piso_un'],
+    'custo_cx': ['custo cx', 'custo_cx', 'custo'],
+    'piso_cx': ['preco minimo cx', 'preco_minimo_cx', 'preço mínimo cx', 'piso cx', 'piso_cx',
+                'preco minimo', 'preco_minimo', 'preço mínimo', 'piso'],
+    'qtd': ['qtd', 'quantidade', 'qtde']
+}
+
+# Campos aceitos nas regras de margem mínima
+CAMPOS_REGRA_MARGEM = ['CODTAB', 'Grupo']
+
+# Função para ler a tabela de custos e preços mínimos
+@perfil.medir('ler_custos')
+def ler_tabela_custos(conteudo, nome_arquivo):
+    """
+    Lê a tabela opcional de custos (CSV ou XLSX): código do produto (Cod/CODPROD) e custo e/ou
+    preço mínimo, por caixa (CX) e/ou por unidade (UN).
+    Retorna (DataFrame, colunas identificadas por papel)
+    """
+    df = ler_planilha_simples(conteudo, nome_arquivo)
+    colunas = identificar_colunas(df.columns, PADROES_COLUNAS_CUSTO)
+    if colunas['codigo'] is None or not any(colunas[papel] for papel in ['custo_cx', 'custo_un', 'piso_cx', 'piso_un']):
+        raise ValueError(f"Tabela de custos sem coluna de código ou de custo/preço mínimo. Colunas: {list(df.columns)}")
+    return df, colunas
+
+# Função para indexar os custos por código de produto
+@perfil.medir('indexar_custos')
+def indexar_custos(custos, colunas, tabela=None):
+    """
+    Monta arrays de custo e preço mínimo por caixa e por unidade, indexados pelo código normalizado.
+    Valores por unidade ausentes são derivados dos por caixa (e vice-versa) pela quantidade por caixa,
+    lida da tabela de custos ou, na falta, da tabela de preços (QTD). Valores desconhecidos ficam NaN
+    """
+    codigos = normalizar_codigos(custos[colunas['codigo']])
+    ultimos = ~codigos.duplicated(keep='last').to_numpy()
+    custos = custos[ultimos]
+    codigos = codigos[ultimos]
+    
+    # Função para ler uma coluna numérica da tabela de custos
+    def valores(papel):
+        """
+        Coluna do papel como float (vírgula decimal aceita), ou NaN se a coluna não existir
+        """
+        if colunas.get(papel) is None:
+            return np.full(len(custos), np.nan)
+        serie = custos[colunas[papel]]
+        if not pd.api.types.is_numeric_dtype(serie):
+            serie = pd.to_numeric(serie.astype(str).str.strip().str.replace(',', '.'), errors='coerce')
+        return serie.to_numpy(dtype=float)
+    
+    quantidade = valores('qtd')
+    if tabela is not None and 'QTD' in tabela.columns and 'Cod' in tabela.columns:
+        codigos_tabela = normalizar_codigos(tabela['Cod'])
+        unicos = ~codigos_tabela.duplicated().to_numpy()
+        posicoes = pd.Index(codigos_tabela[unicos]).get_indexer(codigos)
+        quantidade_tabela = np.where(posicoes >= 0, tabela['QTD'].to_numpy(dtype=float)[unicos][posicoes], np.nan)
+        quantidade = np.where(np.isnan(quantidade), quantidade_tabela, quantidade)
+    quantidade = np.where(quantidade > 0, quantidade, np.nan)
+    
+    indexados = {'indice': pd.Index(codigos)}
+    for valor in ['custo', 'piso']:
+        por_caixa = valores(f"{valor}_cx")
+        por_unidade = valores(f"{valor}_un")
+        indexados[f"{valor}_cx"] = np.where(np.isnan(por_caixa), por_unidade * quantidade, por_caixa)
+        indexados[f"{valor}_un"] = np.where(np.isnan(por_unidade), por_caixa / quantidade, por_unidade)
+    return indexados
+
+# Função para definir a margem mínima exigida em cada linha
+def margens_minimas(regras, campos, tamanho, margem_padrao=0.0):
+    """
+    Margem mínima (% sobre o preço de venda) de cada linha: margem_padrao, substituída pelas regras
+    {'CODTAB': [...], 'Grupo': [...], 'margem_minima': x} cujos campos informados casam (E);
+    regras posteriores prevalecem. campos: {campo: array por linha ou valor único}.
+    Os valores são comparados como texto (a CODTAB guardada no carrinho é texto)
+    """
+    margens = np.full(tamanho, float(margem_padrao))
+    for regra in regras:
+        mascara = np.ones(tamanho, dtype=bool)
+        for campo in CAMPOS_REGRA_MARGEM:
+            valores = regra.get(campo)
+            if valores and campo in campos:
+                valores_linhas = np.broadcast_to(np.asarray(campos[campo], dtype=object), (tamanho,)).astype(str)
+                mascara &= np.isin(valores_linhas, [str(valor) for valor in valores])
+        margens[mascara] = regra['margem_minima']
+    return margens
+
+# Função para verificar margem e preço mínimo de várias linhas de uma vez
+@perfil.medir('verificar_guardas')
+def verificar_guardas(custos, codigos, tipos, precos_base, precos_com_desconto, margens):
+    """
+    Verifica, em uma única passada vetorizada, margem e preço mínimo de cada linha.
+    precos_base e precos_com_desconto em centavos; tipos 'Caixa'/'CX' ou 'Unidade'/'UN'.
+    Preço mínimo = maior entre o piso da tabela de custos e custo / (1 − margem mínima),
+    arredondado para cima ao centavo. Linhas sem custo nem piso não têm guarda.
+    Retorna arrays: margem_percentual (NaN sem custo), preco_minimo (centavos), violacao,
+    desconto_maximo_reais (centavos por unidade vendida), desconto_maximo_percentual e tem_guarda
+    """
+    tamanho = len(precos_base)
+    precos_base = np.asarray(precos_base, dtype=np.int64)
+    precos_com_desconto = np.asarray(precos_com_desconto, dtype=np.int64)
+    posicoes = custos['indice'].get_indexer(normalizar_codigos(pd.Series(np.asarray(codigos, dtype=object))))
+    achados = posicoes >= 0
+    unidade = pd.Series(np.broadcast_to(np.asarray(tipos, dtype=object), (tamanho,))).astype(str).str.upper().str.startswith('UN').to_numpy()
+    
+    # Função para obter o valor da tabela de custos de cada linha, em centavos (float, NaN se ausente)
+    def por_linha(valor):
+        """
+        Valor por caixa ou por unidade, conforme o tipo de venda da linha
+        """
+        por_caixa = custos[f"{valor}_cx"][posicoes]
+        por_unidade = custos[f"{valor}_un"][posicoes]
+        return np.where(achados, np.where(unidade, por_unidade, por_caixa), np.nan) * 100
+    
+    custo = por_linha('custo')
+    piso = por_linha('piso')
+    margens = np.broadcast_to(np.asarray(margens, dtype=float), (tamanho,))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        minimo_margem = np.where(margens < 100, np.ceil(np.round(custo / (1 - margens / 100), 6)), np.nan)
+        minimo = np.fmax(minimo_margem, np.ceil(np.round(piso, 6)))
+        margem_percentual = np.where(precos_com_desconto > 0, (precos_com_desconto - custo) / precos_com_desconto * 100, np.nan)
+    
+    tem_guarda = ~np.isnan(minimo)
+    preco_minimo = np.where(tem_guarda, minimo, 0).astype(np.int64)
+    desconto_maximo = np.where(tem_guarda, np.maximum(precos_base - preco_minimo, 0), precos_base)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desconto_maximo_percentual = np.where(precos_base > 0, desconto_maximo / precos_base * 100, 0.0)
+    
+    return {
+        'margem_percentual': margem_percentual,
+        'preco_minimo': preco_minimo,
+        'violacao': tem_guarda & (precos_com_desconto < preco_minimo),
+        'desconto_maximo_reais': desconto_maximo,
+        'desconto_maximo_percentual': desconto_maximo_percentual,
+        'tem_guarda': tem_guarda
+    }
+
+# Função para buscar um atributo da tabela de preços pelo código dos itens
+def atributo_por_codigo(tabela, codigos, coluna):
+    """
+    Valor da coluna da tabela (ex.: Grupo) para cada código (Cod), ou None para códigos ausentes
+    """
+    codigos_tabela = normalizar_codigos(tabela['Cod'])
+    unicos = ~codigos_tabela.duplicated().to_numpy()
+    posicoes = pd.Index(codigos_tabela[unicos]).get_indexer(normalizar_codigos(pd.Series(np.asarray(codigos, dtype=object))))
+    valores = tabela[coluna].to_numpy(dtype=object)[unicos]
+    return np.where(posicoes >= 0, valores[posicoes], None)
+
+# Função para verificar as guardas de todas as linhas do carrinho
+def verificar_guardas_carrinho(carrinho, custos, margens):
+    """
+    Verifica margem e preço mínimo do carrinho inteiro em uma passada (margens por linha ou valor único)
+    """
+    return verificar_guardas(
+        custos,
+        coluna_carrinho(carrinho, 'codigo'),
+        coluna_carrinho(carrinho, 'tipo'),
+        coluna_carrinho(carrinho, 'preco_base'),
+        coluna_carrinho(carrinho, 'preco_com_desconto'),
+        margens
+    )
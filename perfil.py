@@ -0,0 +1,189 @@
+"""
+Instrumentação de desempenho do Simulador Comercial: tempo de parede e memória de
+cada etapa nomeada de uma execução (rerun), com histórico por etapa e gravação
+opcional dos traces em JSONL para análise fora do aplicativo.
+
+Sem dependência do Streamlit nem do pandas: quando nenhum registro está ativo na
+thread atual, as etapas não medem nada.
+"""
+import collections
+import contextlib
+from datetime import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+_ativo = threading.local()
+
+# Função para criar o registro de perfil de uma sessão
+def criar_registro(max_amostras=200, arquivo_jsonl=None):
+    """
+    Cria o registro que acumula as etapas da execução atual e o histórico
+    (últimas max_amostras medições) de cada etapa
+    """
+    return {
+        'execucao': [],
+        'numero_execucao': 0,
+        'inicio': None,
+        'historico': {},
+        'max_amostras': max_amostras,
+        'arquivo_jsonl': arquivo_jsonl,
+        'trava': threading.Lock(),
+    }
+
+# Função para ler a memória residente do processo
+def memoria_processo_mb():
+    """
+    Retorna a memória residente (RSS) atual do processo em MB; fora do Linux,
+    usa o pico informado por resource
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as arquivo:
+            paginas = int(arquivo.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS informa em bytes, Linux em KB
+    return pico / (1024 * 1024) if os.uname().sysname == 'Darwin' else pico / 1024
+
+# Função para iniciar uma execução medida na thread atual
+def ativar(registro):
+    """
+    Associa o registro à thread atual e começa uma nova execução
+    """
+    with registro['trava']:
+        registro['execucao'] = []
+        registro['numero_execucao'] += 1
+        registro['inicio'] = time.perf_counter()
+    _ativo.registro = registro
+
+# Função para encerrar a execução medida na thread atual
+def desativar():
+    """
+    Desassocia o registro da thread atual, registra o tempo total da execução
+    e grava o trace em JSONL quando configurado. Retorna as etapas da execução
+    """
+    registro = getattr(_ativo, 'registro', None)
+    _ativo.registro = None
+    if registro is None:
+        return []
+
+    total_ms = (time.perf_counter() - registro['inicio']) * 1000
+    _adicionar_amostra(registro, 'execucao_total', total_ms, 0.0, memoria_processo_mb())
+    etapas = list(registro['execucao'])
+
+    if registro['arquivo_jsonl']:
+        trace = {
+            'momento': datetime.now().isoformat(timespec='seconds'),
+            'execucao': registro['numero_execucao'],
+            'etapas': etapas,
+        }
+        try:
+            with open(registro['arquivo_jsonl'], 'a', encoding='utf-8') as arquivo:
+                arquivo.write(json.dumps(trace, ensure_ascii=False) + '\n')
+        except OSError:
+            # Trace é diagnóstico: falha de gravação não interrompe o aplicativo
+            pass
+    return etapas
+
+# Função para guardar uma medição na execução e no histórico
+def _adicionar_amostra(registro, nome, tempo_ms, delta_mb, memoria_mb):
+    """
+    Acrescenta a medição à execução atual e ao histórico circular da etapa
+    """
+    amostra = {
+        'etapa': nome,
+        'tempo_ms': round(tempo_ms, 3),
+        'delta_memoria_mb': round(delta_mb, 3),
+        'memoria_mb': round(memoria_mb, 1),
+    }
+    with registro['trava']:
+        registro['execucao'].append(amostra)
+        historico = registro['historico'].get(nome)
+        if historico is None:
+            historico = registro['historico'][nome] = collections.deque(maxlen=registro['max_amostras'])
+        historico.append(tempo_ms)
+
+# Função para medir um bloco de código como etapa nomeada
+@contextlib.contextmanager
+def etapa(nome, registro=None):
+    """
+    Mede tempo de parede e variação de memória do bloco. Usa o registro ativo da
+    thread quando nenhum é informado (útil para callbacks executados em outras
+    threads, como os downloads do Streamlit); sem registro, não mede nada
+    """
+    registro = registro or getattr(_ativo, 'registro', None)
+    if registro is None:
+        yield
+        return
+
+    memoria_inicial = memoria_processo_mb()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempo_ms = (time.perf_counter() - inicio) * 1000
+        memoria_final = memoria_processo_mb()
+        _adicionar_amostra(registro, nome, tempo_ms, memoria_final - memoria_inicial, memoria_final)
+
+# Função para medir uma função inteira como etapa
+def medir(nome):
+    """
+    Decorador equivalente a envolver o corpo da função em etapa(nome)
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if getattr(_ativo, 'registro', None) is None:
+                return funcao(*args, **kwargs)
+            with etapa(nome):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+# Função para calcular o percentil de uma lista já ordenada
+def _percentil(ordenados, fracao):
+    """
+    Percentil por vizinho mais próximo (suficiente para o painel)
+    """
+    return ordenados[min(len(ordenados) - 1, int(fracao * len(ordenados)))]
+
+# Função para resumir o histórico de cada etapa
+def resumo_etapas(registro):
+    """
+    Retorna uma linha por etapa com número de amostras, última medição,
+    mediana, p95 e máximo (em ms), da etapa mais lenta para a mais rápida
+    """
+    with registro['trava']:
+        historicos = {nome: list(valores) for nome, valores in registro['historico'].items()}
+
+    linhas = []
+    for nome, valores in historicos.items():
+        if not valores:
+            continue
+        ordenados = sorted(valores)
+        linhas.append({
+            'Etapa': nome,
+            'Amostras': len(valores),
+            'Última (ms)': round(valores[-1], 2),
+            'Mediana (ms)': round(_percentil(ordenados, 0.5), 2),
+            'p95 (ms)': round(_percentil(ordenados, 0.95), 2),
+            'Máx (ms)': round(ordenados[-1], 2),
+        })
+    linhas.sort(key=lambda linha: linha['Mediana (ms)'], reverse=True)
+    return linhas
+
+# Função para obter as amostras de uma etapa
+def amostras_etapa(registro, nome):
+    """
+    Retorna uma cópia das medições (ms) guardadas para a etapa
+    """
+    with registro['trava']:
+        return list(registro['historico'].get(nome, ()))
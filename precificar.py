@@ -0,0 +1,102 @@
+"""
+Precificação de pedidos em lote, sem interface (para rotinas noturnas).
+
+Exemplos:
+    python precificar.py pedido.csv --codtab 26
+    python precificar.py pedidos/*.xlsx --tabela tabela.xlsx --desconto 5 --saida precificados/
+
+Cada pedido precisa de uma coluna de código (EAN, DUN ou Cod) e uma de quantidade.
+O resultado é gravado como CSV (separador ';' e vírgula decimal, igual à exportação do aplicativo).
+"""
+import argparse
+import glob
+import io
+import logging
+import os
+import sys
+
+import nucleo
+
+# Função para montar os argumentos da linha de comando
+def criar_parser():
+    """
+    Define os argumentos aceitos pelo comando
+    """
+    parser = argparse.ArgumentParser(
+        description="Precifica arquivos de pedido contra uma tabela de preços, sem abrir a interface."
+    )
+    parser.add_argument('pedidos', nargs='+', help="Arquivos de pedido (CSV ou XLSX); aceita curingas")
+    fonte = parser.add_mutually_exclusive_group(required=True)
+    fonte.add_argument('--tabela', help="Arquivo da tabela de preços (CSV ou XLSX no formato do aplicativo)")
+    fonte.add_argument('--codtab', type=int, help="Código da tabela (CODTAB) do catálogo tabela_produto.csv")
+    parser.add_argument('--desconto', type=float, default=0.0, help="Desconto padrão em %% (padrão: 0)")
+    parser.add_argument('--saida', default='.', help="Diretório dos arquivos precificados (padrão: atual)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Exibir mensagens de diagnóstico")
+    return parser
+
+# Função para carregar a tabela de preços escolhida
+def carregar_tabela(args):
+    """
+    Carrega a tabela de preços a partir de um arquivo ou do catálogo (CODTAB)
+    """
+    if args.codtab is not None:
+        catalogo = nucleo.construir_catalogo(nucleo.ler_tabela_com_cache(nucleo.CAMINHO_TABELA_PRODUTO))
+        if args.codtab not in catalogo['indice_tabela']:
+            raise SystemExit(f"Tabela {args.codtab} não existe no catálogo")
+        return nucleo.precos_tabela(catalogo, args.codtab)
+
+    with open(args.tabela, 'rb') as arquivo:
+        conteudo = io.BytesIO(arquivo.read())
+    conteudo.name = args.tabela
+    file_type = 'xlsx' if args.tabela.lower().endswith('.xlsx') else 'csv'
+    tabela, _ = nucleo.load_data(conteudo, file_type)
+    if tabela is None:
+        raise SystemExit(f"Não foi possível carregar a tabela {args.tabela}")
+    return tabela
+
+# Função principal do comando
+def main(argv=None):
+    """
+    Carrega a tabela uma única vez e precifica cada arquivo de pedido informado
+    """
+    args = criar_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(message)s')
+
+    tabela = carregar_tabela(args)
+    os.makedirs(args.saida, exist_ok=True)
+
+    arquivos = [caminho for padrao in args.pedidos for caminho in sorted(glob.glob(padrao)) or [padrao]]
+    falhas = 0
+    for caminho in arquivos:
+        try:
+            with open(caminho, 'rb') as arquivo:
+                pedido, colunas = nucleo.ler_pedido(arquivo.read(), caminho)
+            precificado, nao_encontrados, invalidas = nucleo.precificar_pedido(tabela, pedido, colunas, args.desconto)
+        except (OSError, ValueError) as e:
+            print(f"{caminho}: erro - {e}", file=sys.stderr)
+            falhas += 1
+            continue
+
+        nome = os.path.splitext(os.path.basename(caminho))[0]
+        destino = os.path.join(args.saida, f"{nome}_precificado.csv")
+        precificado.to_csv(destino, index=False, decimal=',', sep=';')
+
+        total = nucleo.de_centavos(nucleo.para_centavos(precificado['Total_Com_Desconto']).sum())
+        print(f"{caminho}: {len(precificado)} itens, total R$ {total:.2f} -> {destino}")
+        if len(nao_encontrados):
+            print(
+                f"{caminho}: {len(nao_encontrados)} linhas sem produto na tabela: "
+                + ", ".join(nao_encontrados[colunas['codigo']].astype(str).head(10)),
+                file=sys.stderr
+            )
+        if len(invalidas):
+            print(
+                f"{caminho}: {len(invalidas)} linhas com quantidade ou desconto inválido: "
+                + ", ".join(invalidas[colunas['codigo']].astype(str).head(10)),
+                file=sys.stderr
+            )
+
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Contexto 'spawn' do multiprocessing que não leva o módulo __main__ do processo pai.
+
+No 'spawn' padrão, cada processo novo reexecuta o script principal do pai (pelo caminho
+do arquivo ou pelo nome do módulo) antes de receber a tarefa. No Streamlit o script
+principal é o próprio aplicativo (comercial.py), que não pode ser reexecutado fora do
+servidor. Os processos criados por este contexto carregam só os módulos das funções que
+recebem (o núcleo), qualquer que seja o __main__ do pai no momento.
+"""
+import io
+import multiprocessing
+import multiprocessing.context
+import os
+import sys
+
+# Chaves dos dados de preparação que fazem o processo novo reexecutar o __main__ do pai
+CHAVES_MAIN = ('init_main_from_path', 'init_main_from_name')
+
+if sys.platform != 'win32':
+    from multiprocessing import popen_spawn_posix, resource_tracker, spawn, util
+    from multiprocessing.context import reduction, set_spawning_popen
+
+    # Inicialização de um processo 'spawn' sem o módulo __main__ do pai
+    class PopenSemMain(popen_spawn_posix.Popen):
+        """
+        Igual a popen_spawn_posix.Popen, exceto pelos dados de preparação enviados ao
+        processo novo, que não incluem o __main__ do pai
+        """
+        def _launch(self, process_obj):
+            tracker_fd = resource_tracker.getfd()
+            self._fds.append(tracker_fd)
+            dados = spawn.get_preparation_data(process_obj._name)
+            for chave in CHAVES_MAIN:
+                dados.pop(chave, None)
+            fp = io.BytesIO()
+            set_spawning_popen(self)
+            try:
+                reduction.dump(dados, fp)
+                reduction.dump(process_obj, fp)
+            finally:
+                set_spawning_popen(None)
+
+            parent_r = child_w = child_r = parent_w = None
+            try:
+                parent_r, child_w = os.pipe()
+                child_r, parent_w = os.pipe()
+                cmd = spawn.get_command_line(tracker_fd=tracker_fd, pipe_handle=child_r)
+                self._fds.extend([child_r, child_w])
+                self.pid = util.spawnv_passfds(spawn.get_executable(), cmd, self._fds)
+                self.sentinel = parent_r
+                with open(parent_w, 'wb', closefd=False) as f:
+                    f.write(fp.getbuffer())
+            finally:
+                self.finalizer = util.Finalize(
+                    self, util.close_fds, [fd for fd in (parent_r, parent_w) if fd is not None]
+                )
+                for fd in (child_r, child_w):
+                    if fd is not None:
+                        os.close(fd)
+
+    # Processo 'spawn' iniciado por PopenSemMain
+    class ProcessoSemMain(multiprocessing.context.SpawnProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            return PopenSemMain(process_obj)
+
+    # Contexto 'spawn' cujos processos são ProcessoSemMain
+    class ContextoSemMain(multiprocessing.context.SpawnContext):
+        Process = ProcessoSemMain
+
+# Função para obter o contexto de processos independentes do __main__
+def contexto_sem_main():
+    """
+    Retorna o contexto 'spawn' sem o __main__ do pai. No Windows, onde o 'spawn' é
+    iniciado por outro mecanismo, retorna o contexto 'spawn' padrão
+    """
+    if sys.platform == 'win32':
+        return multiprocessing.get_context('spawn')
+    return ContextoSemMain()
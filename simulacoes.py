@@ -0,0 +1,272 @@
+"""
+Armazenamento local das simulações comerciais em SQLite (modo WAL), sem dependência
+do Streamlit: salvar, reabrir, duplicar e pesquisar orçamentos por cliente, vendedor,
+tabela (CODTAB) e data.
+
+Os metadados e totais ficam em colunas indexadas (a pesquisa nunca lê as linhas do
+carrinho); as linhas são gravadas compactadas em um BLOB (nucleo.serializar_carrinho).
+Gravações podem ser adiadas e são enviadas em lote, em uma única transação; a pesquisa
+combina o banco com as gravações pendentes, sem forçar o envio.
+"""
+import atexit
+from datetime import datetime
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import nucleo
+import perfil
+
+ESQUEMA_SIMULACOES = """
+CREATE TABLE IF NOT EXISTS simulacoes (
+    id TEXT PRIMARY KEY,
+    nome TEXT NOT NULL DEFAULT '',
+    cliente INTEGER,
+    vendedor TEXT,
+    codtab TEXT,
+    criado_em TEXT NOT NULL,
+    atualizado_em TEXT NOT NULL,
+    itens INTEGER NOT NULL,
+    total_sem_desconto INTEGER NOT NULL,
+    total_com_desconto INTEGER NOT NULL,
+    linhas BLOB NOT NULL,
+    cenario TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS simulacoes_cliente ON simulacoes (cliente, atualizado_em);
+CREATE INDEX IF NOT EXISTS simulacoes_vendedor ON simulacoes (vendedor, atualizado_em);
+CREATE INDEX IF NOT EXISTS simulacoes_codtab ON simulacoes (codtab, atualizado_em);
+CREATE INDEX IF NOT EXISTS simulacoes_data ON simulacoes (atualizado_em);
+"""
+
+# Colunas devolvidas pela pesquisa (tudo menos as linhas do carrinho)
+COLUNAS_RESUMO = [
+    'id', 'nome', 'cliente', 'vendedor', 'codtab', 'criado_em', 'atualizado_em',
+    'itens', 'total_sem_desconto', 'total_com_desconto'
+]
+
+# Função para abrir (ou criar) o banco de simulações
+def abrir_armazem(caminho, max_pendentes=32, max_espera=5.0):
+    """
+    Abre o banco em modo WAL (leituras não bloqueiam a gravação) e cria o esquema.
+    Gravações adiadas são enviadas quando há max_pendentes na fila, max_espera segundos
+    depois da primeira da fila (temporizador), antes de reabrir, duplicar ou fechar e ao
+    encerrar o processo
+    """
+    conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    conexao.executescript(ESQUEMA_SIMULACOES)
+    armazem = {
+        'caminho': caminho,
+        'conexao': conexao,
+        'trava': threading.Lock(),
+        'pendentes': {},
+        'primeiro_pendente': None,
+        'max_pendentes': max_pendentes,
+        'max_espera': max_espera,
+    }
+    atexit.register(fechar_armazem, armazem)
+    return armazem
+
+# Função para fechar o banco de simulações
+def fechar_armazem(armazem):
+    """
+    Grava as pendências e fecha a conexão
+    """
+    gravar_pendentes(armazem)
+    with armazem['trava']:
+        armazem['conexao'].close()
+
+# Função para montar o registro de uma simulação
+def _registro_simulacao(id_simulacao, carrinho, nome, cliente, vendedor, codtab, cenario, momento):
+    """
+    Converte o carrinho e seus metadados na tupla gravada no banco (totais em centavos)
+    """
+    return (
+        id_simulacao,
+        nome or '',
+        None if cliente is None else int(cliente),
+        vendedor,
+        None if codtab is None else str(codtab),
+        momento,
+        momento,
+        int(carrinho['tamanho']),
+        int(carrinho['totais']['total_sem_desconto']),
+        int(carrinho['totais']['total_com_desconto']),
+        nucleo.serializar_carrinho(carrinho),
+        json.dumps(cenario or [], ensure_ascii=False, default=str),
+    )
+
+# Função para salvar uma simulação
+@perfil.medir('salvar_simulacao')
+def salvar_simulacao(armazem, carrinho, nome='', cliente=None, vendedor=None, codtab=None, cenario=None,
+                     id_simulacao=None, adiar=False):
+    """
+    Salva o carrinho (e as regras de cenário) como uma simulação nova ou atualiza a de id_simulacao.
+    Com adiar=True o registro entra na fila e é gravado no próximo lote; salvar de novo a mesma
+    simulação antes do envio substitui o registro pendente. Retorna o id da simulação
+    """
+    id_simulacao = id_simulacao or uuid.uuid4().hex
+    momento = datetime.now().isoformat(timespec='seconds')
+    registro = _registro_simulacao(id_simulacao, carrinho, nome, cliente, vendedor, codtab, cenario, momento)
+    with armazem['trava']:
+        armazem['pendentes'][id_simulacao] = registro
+        if armazem['primeiro_pendente'] is None:
+            armazem['primeiro_pendente'] = time.monotonic()
+            if adiar:
+                # O lote é enviado no máximo max_espera segundos depois, mesmo sem novas gravações
+                temporizador = threading.Timer(armazem['max_espera'], gravar_pendentes, (armazem,))
+                temporizador.daemon = True
+                temporizador.start()
+        enviar = (
+            not adiar
+            or len(armazem['pendentes']) >= armazem['max_pendentes']
+            or time.monotonic() - armazem['primeiro_pendente'] >= armazem['max_espera']
+        )
+    if enviar:
+        gravar_pendentes(armazem)
+    return id_simulacao
+
+# Função para gravar as simulações pendentes
+@perfil.medir('gravar_simulacoes')
+def gravar_pendentes(armazem):
+    """
+    Envia todas as gravações pendentes em uma única transação (a data de criação de
+    simulações já existentes é preservada). Retorna o número de registros gravados
+    """
+    with armazem['trava']:
+        registros = list(armazem['pendentes'].values())
+        if not registros:
+            return 0
+        conexao = armazem['conexao']
+        conexao.execute("BEGIN")
+        try:
+            conexao.executemany(
+                """
+                INSERT INTO simulacoes (id, nome, cliente, vendedor, codtab, criado_em, atualizado_em,
+                                        itens, total_sem_desconto, total_com_desconto, linhas, cenario)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    nome = excluded.nome, cliente = excluded.cliente, vendedor = excluded.vendedor,
+                    codtab = excluded.codtab, atualizado_em = excluded.atualizado_em, itens = excluded.itens,
+                    total_sem_desconto = excluded.total_sem_desconto,
+                    total_com_desconto = excluded.total_com_desconto,
+                    linhas = excluded.linhas, cenario = excluded.cenario
+                """,
+                registros
+            )
+            conexao.execute("COMMIT")
+        except sqlite3.Error:
+            conexao.execute("ROLLBACK")
+            raise
+        armazem['pendentes'].clear()
+        armazem['primeiro_pendente'] = None
+    return len(registros)
+
+# Função para pesquisar simulações salvas
+@perfil.medir('buscar_simulacoes')
+def buscar_simulacoes(armazem, cliente=None, vendedor=None, codtab=None, desde=None, ate=None, texto=None, limite=200):
+    """
+    Pesquisa pelos índices de cliente, vendedor, CODTAB e data (datas ISO, 'ate' inclusivo
+    no dia) e, opcionalmente, por trecho do nome. Retorna só os metadados (sem as linhas),
+    da simulação alterada mais recentemente para a mais antiga. As gravações pendentes
+    entram no resultado sem serem enviadas (a pesquisa roda a cada execução do aplicativo)
+    """
+    condicoes, parametros = [], []
+    for coluna, valor in (('cliente', cliente), ('vendedor', vendedor), ('codtab', codtab)):
+        if valor is not None:
+            condicoes.append(f"{coluna} = ?")
+            parametros.append(str(valor) if coluna == 'codtab' else valor)
+    if desde:
+        condicoes.append("atualizado_em >= ?")
+        parametros.append(str(desde))
+    if ate:
+        condicoes.append("atualizado_em < ?")
+        parametros.append(f"{ate}T99")
+    if texto:
+        condicoes.append("nome LIKE ?")
+        parametros.append(f"%{texto}%")
+
+    consulta = f"SELECT {', '.join(COLUNAS_RESUMO)} FROM simulacoes"
+    if condicoes:
+        consulta += " WHERE " + " AND ".join(condicoes)
+    consulta += " ORDER BY atualizado_em DESC LIMIT ?"
+    with armazem['trava']:
+        linhas = armazem['conexao'].execute(consulta, parametros + [int(limite)]).fetchall()
+        pendentes = [dict(zip(COLUNAS_RESUMO, registro)) for registro in armazem['pendentes'].values()]
+    encontradas = {linha[0]: dict(zip(COLUNAS_RESUMO, linha)) for linha in linhas}
+    
+    # Gravações pendentes: mesmos filtros da consulta; a data de criação gravada prevalece
+    texto = texto.casefold() if texto else None
+    for simulacao in pendentes:
+        if (
+            (cliente is not None and simulacao['cliente'] != cliente)
+            or (vendedor is not None and simulacao['vendedor'] != vendedor)
+            or (codtab is not None and simulacao['codtab'] != str(codtab))
+            or (desde and simulacao['atualizado_em'] < str(desde))
+            or (ate and simulacao['atualizado_em'] >= f"{ate}T99")
+            or (texto and texto not in simulacao['nome'].casefold())
+        ):
+            encontradas.pop(simulacao['id'], None)
+            continue
+        gravada = encontradas.get(simulacao['id'])
+        if gravada is not None:
+            simulacao['criado_em'] = gravada['criado_em']
+        encontradas[simulacao['id']] = simulacao
+    
+    resultado = sorted(encontradas.values(), key=lambda simulacao: simulacao['atualizado_em'], reverse=True)
+    return resultado[:int(limite)]
+
+# Função para reabrir uma simulação salva
+@perfil.medir('carregar_simulacao')
+def carregar_simulacao(armazem, id_simulacao):
+    """
+    Retorna os metadados da simulação com o carrinho restaurado ('carrinho') e as regras
+    de cenário ('cenario'), ou None se o id não existir
+    """
+    gravar_pendentes(armazem)
+    with armazem['trava']:
+        linha = armazem['conexao'].execute(
+            f"SELECT {', '.join(COLUNAS_RESUMO)}, linhas, cenario FROM simulacoes WHERE id = ?",
+            (id_simulacao,)
+        ).fetchone()
+    if linha is None:
+        return None
+    simulacao = dict(zip(COLUNAS_RESUMO, linha))
+    simulacao['carrinho'] = nucleo.restaurar_carrinho(linha[-2])
+    simulacao['cenario'] = json.loads(linha[-1])
+    return simulacao
+
+# Função para duplicar uma simulação salva
+def duplicar_simulacao(armazem, id_simulacao, nome=None):
+    """
+    Copia a simulação dentro do banco (sem decodificar as linhas) com novo id e datas.
+    Retorna o id da cópia, ou None se o id não existir
+    """
+    gravar_pendentes(armazem)
+    novo_id = uuid.uuid4().hex
+    momento = datetime.now().isoformat(timespec='seconds')
+    with armazem['trava']:
+        cursor = armazem['conexao'].execute(
+            """
+            INSERT INTO simulacoes (id, nome, cliente, vendedor, codtab, criado_em, atualizado_em,
+                                    itens, total_sem_desconto, total_com_desconto, linhas, cenario)
+            SELECT ?, COALESCE(?, nome || ' (cópia)'), cliente, vendedor, codtab, ?, ?,
+                   itens, total_sem_desconto, total_com_desconto, linhas, cenario
+            FROM simulacoes WHERE id = ?
+            """,
+            (novo_id, nome, momento, momento, id_simulacao)
+        )
+    return novo_id if cursor.rowcount else None
+
+# Função para excluir uma simulação salva
+def excluir_simulacao(armazem, id_simulacao):
+    """
+    Remove a simulação (inclusive uma gravação ainda pendente). Retorna True se existia
+    """
+    with armazem['trava']:
+        pendente = armazem['pendentes'].pop(id_simulacao, None) is not None
+        cursor = armazem['conexao'].execute("DELETE FROM simulacoes WHERE id = ?", (id_simulacao,))
+    return pendente or cursor.rowcount > 0
@@ -0,0 +1,119 @@
+"""
+Testes do núcleo do Simulador Comercial (rodar com python -m pytest)
+"""
+import numpy as np
+import pandas as pd
+
+import nucleo
+
+# Função para montar uma tabela de preços pequena
+def tabela_exemplo():
+    """
+    Tabela com dois produtos no formato produzido por load_data
+    """
+    return pd.DataFrame({
+        'Cod': [100, 200],
+        'EAN': ['7890000000100', '7890000000200'],
+        'Descrição': ['PRODUTO A', 'PRODUTO B'],
+        'Preco CX': [120.0, 48.0],
+        'Preco UN': [10.0, 4.0]
+    })
+
+# Função para montar um pedido com as colunas já identificadas
+def pedido_exemplo(codigos, quantidades, descontos):
+    """
+    Retorna (pedido, colunas) como ler_pedido
+    """
+    pedido = pd.DataFrame({'Codigo': codigos, 'Quantidade': quantidades, 'Desconto': descontos})
+    colunas = {'codigo': 'Codigo', 'quantidade': 'Quantidade', 'tipo': None, 'desconto': 'Desconto'}
+    return pedido, colunas
+
+def test_precificar_pedido_rejeita_desconto_fora_da_faixa():
+    pedido, colunas = pedido_exemplo(
+        ['100', '200', '100', '200', '100'], ['4', '2', '1', '3', '2'], ['150', '-5', '50', '', '10%']
+    )
+    precificado, nao_encontrados, invalidas = nucleo.precificar_pedido(tabela_exemplo(), pedido, colunas, 5.0)
+
+    assert len(nao_encontrados) == 0
+    assert invalidas['Desconto'].tolist() == ['150', '-5']
+    assert precificado['Desconto_Percentual'].tolist() == [50.0, 5.0, 10.0]
+    assert (precificado['Total_Com_Desconto'] > 0).all()
+
+def test_precificar_pedido_rejeita_desconto_padrao_fora_da_faixa():
+    pedido, colunas = pedido_exemplo(['100'], ['1'], [''])
+    precificado, _, invalidas = nucleo.precificar_pedido(tabela_exemplo(), pedido, colunas, 75.0)
+
+    assert len(precificado) == 0
+    assert len(invalidas) == 1
+
+# Função para montar um item do carrinho com desconto em %
+def item_carrinho(codigo, preco_base, quantidade, desconto_percentual=0.0):
+    """
+    Item no formato aceito por adicionar_item_carrinho
+    """
+    return {
+        'codigo': codigo, 'descricao': f'PRODUTO {codigo}', 'tipo': 'Caixa', 'quantidade': quantidade,
+        'preco_base': preco_base, 'desconto_percentual': desconto_percentual, 'desconto_reais': 0.0,
+        'tipo_desconto': 'Porcentagem'
+    }
+
+def test_adicionar_mesmo_produto_usa_preco_da_nova_tabela():
+    carrinho = nucleo.criar_carrinho()
+    nucleo.adicionar_item_carrinho(carrinho, item_carrinho(100, 120.0, 2))
+    linha = nucleo.adicionar_item_carrinho(carrinho, item_carrinho(100, 110.0, 3))
+
+    assert carrinho['tamanho'] == 1
+    assert nucleo.coluna_carrinho(carrinho, 'quantidade')[linha] == 5
+    assert nucleo.coluna_carrinho_reais(carrinho, 'preco_base')[linha] == 110.0
+    assert nucleo.totais_carrinho(carrinho)['total_com_desconto'] == 550.0
+
+# Função para montar a base (linhas_catalogo) de um lote de tabelas
+def base_lote(tabelas, nomes):
+    """
+    Retorna (chaves do lote, base do catálogo) como o aplicativo monta para os arquivos enviados
+    """
+    chaves = tuple((nome, f"chave {nome}") for nome in nomes)
+    return chaves, nucleo.linhas_catalogo(nucleo.catalogo_de_tabelas({nome: tabelas[nome] for nome in nomes}))
+
+def test_estatisticas_lote_incrementais_iguais_as_calculadas_do_zero():
+    gerador = np.random.default_rng(7)
+    tabelas = {}
+    for nome in ['a', 'b', 'c']:
+        codigos = gerador.choice(np.arange(1, 60), 40, replace=False)
+        tabelas[nome] = pd.DataFrame({
+            'Cod': codigos, 'EAN': codigos.astype(str), 'Descrição': [f'PRODUTO {c}' for c in codigos], 'QTD': 12,
+            'Preco CX': gerador.uniform(10, 100, 40).round(2), 'Preco UN': gerador.uniform(1, 10, 40).round(2),
+            'Grupo': gerador.choice(['AGUA', 'SUCO', None], 40), 'Marca': gerador.choice(['X', 'Y'], 40)
+        })
+
+    for anteriores, atuais in [(['a', 'b'], ['a', 'b', 'c']), (['a', 'b', 'c'], ['a'])]:
+        chaves_anteriores, base_anterior = base_lote(tabelas, anteriores)
+        chaves, base = base_lote(tabelas, atuais)
+        incrementais = nucleo.atualizar_estatisticas_lote(
+            nucleo.calcular_estatisticas_tabela(base_anterior), base_anterior, base, chaves_anteriores, chaves
+        )
+        do_zero = nucleo.calcular_estatisticas_tabela(base)
+        for campo, agregado in do_zero['por'].items():
+            pd.testing.assert_frame_equal(
+                incrementais['por'][campo].sort_index(), agregado.sort_index(),
+                check_dtype=False, check_index_type=False
+            )
+
+    chaves_anteriores, base_anterior = base_lote(tabelas, ['a', 'b'])
+    chaves, base = base_lote(tabelas, ['b', 'c'])
+    assert nucleo.atualizar_estatisticas_lote(
+        nucleo.calcular_estatisticas_tabela(base_anterior), base_anterior, base, chaves_anteriores, chaves
+    ) is None
+
+def test_margem_minima_do_carrinho_usa_a_tabela_de_cada_linha():
+    carrinho = nucleo.criar_carrinho()
+    nucleo.adicionar_item_carrinho(carrinho, dict(item_carrinho(100, 120.0, 1), codtab=35))
+    nucleo.adicionar_item_carrinho(carrinho, dict(item_carrinho(200, 48.0, 1), codtab=36))
+    restaurado = nucleo.restaurar_carrinho(nucleo.serializar_carrinho(carrinho))
+    regras = [{'CODTAB': [35], 'margem_minima': 40.0}]
+
+    for atual in [carrinho, restaurado]:
+        margens = nucleo.margens_minimas(
+            regras, {'CODTAB': nucleo.coluna_carrinho(atual, 'codtab')}, atual['tamanho'], 5.0
+        )
+        assert margens.tolist() == [40.0, 5.0]